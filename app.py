@@ -5,6 +5,38 @@ import yfinance as yf
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
 import streamlit.components.v1 as components
+from indicators import (compute_rsi, compute_mms6m_regression,
+                        aligned_panel, ap_row, ap_returns, ap_maxdd, compact_panel, compact_series,
+                        write_panel, map_panel, panel_age, panel_meta,
+                        multidate_inputs, multidate_block, multidate_block_shared, share_arrays,
+                        FACTOR_BUCKETS, conditional_alpha_cube, cube_frame, bootstrap_cube,
+                        IC_INDICATORS, indicator_panels, ic_engine,
+                        FW_MAX_H, forward_tensor, fw_panel, fw_excess, fw_curve,
+                        operativita_panel, select_weights, simulate_rotation, sim_stats,
+                        WF_TARGETS, walk_forward_folds, wf_fold,
+                        ANALOG_FEATURES, analog_features, analog_index, analog_search,
+                        compute_risk_off_episodes, build_episode_dataset,
+                        PATTERN_NONE, PATTERN_RS_WINDOW, pattern_features, classify_patterns,
+                        relative_strength_panel, risk_off_episodes_panel,
+                        rank_ic, SKEW_LABELS, dispersion_history, skew_label,
+                        RRG_QUADRANTS, rrg_panels, rrg_quadrant, xcorr_fft, rolling_xcorr,
+                        PCT_WINDOW, percentile_latest, table_panels,
+                        constituents_update, constituents_at,
+                        BREADTH_WARMUP, breadth_history, breadth_update, breadth_frame)
+import os
+import sys
+import json
+import time
+import pickle
+import hashlib
+import sqlite3
+import threading
+import tracemalloc
+import cProfile
+from collections import Counter
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait
+from contextlib import contextmanager
 
 # ========================
 # CONFIG & STYLE
@@ -67,12 +99,187 @@ CSS_STYLE = (
 )
 st.markdown(CSS_STYLE, unsafe_allow_html=True)
 
+# ========================
+# PROFILER ON-DEMAND (un solo rerun)
+# ========================
+# Attivazione: ?profile=sample (o ?profile=cprofile) nell'URL, oppure variabile
+# d'ambiente MONITOR_PROFILE=sample|cprofile (vale per il primo rerun di ogni
+# sessione). Il parametro URL viene rimosso subito: il rerun successivo non è
+# profilato. Output in PROFILE_DIR, un file per tipo:
+#   <run>.folded   stack collassati per stage (flamegraph.pl, speedscope)  [sample]
+#   <run>.prof     statistiche cProfile (snakeviz, flameprof)               [cprofile]
+#   <run>_mem.txt  tracemalloc: delta allocazioni e picco per stage
+PROFILE_DIR         = os.environ.get("MONITOR_PROFILE_DIR", "profiles")
+PROFILE_SAMPLE_MS   = 5
+PROFILE_MEM_TOP     = 15
+PROFILE_MEM_FRAMES  = 1
+
+_PROF = None   # stato del rerun profilato corrente (None = profiler spento)
+
+
+def _profile_requested():
+    # Un rerun terminato su eccezione nel thread dello script lascia agganciato il
+    # suo cProfile (hook per thread): il rerun successivo parte sempre senza
+    if isinstance(sys.getprofile(), cProfile.Profile):
+        sys.setprofile(None)
+    mode = st.query_params.get("profile")
+    if mode:
+        del st.query_params["profile"]
+    else:
+        mode = os.environ.get("MONITOR_PROFILE")
+        if not mode or st.session_state.get("_profile_env_done"):
+            return None
+        st.session_state["_profile_env_done"] = True
+    mode = str(mode).lower()
+    return "cprofile" if mode in ("cprofile", "det", "deterministic") else "sample"
+
+
+def _profile_sampler(prof):
+    """
+    Ogni PROFILE_SAMPLE_MS ms campiona lo stack del thread dello script (modo
+    sample) e controlla che il rerun sia ancora in corso: se lo script è uscito
+    senza _profile_finish (eccezione o st.stop() fuori da un _profile_stage) chiude
+    qui il profilo, così tracemalloc e il lock non restano attivi.
+    """
+    interval = PROFILE_SAMPLE_MS / 1000
+    while not prof["stop"].wait(interval):
+        frame = sys._current_frames().get(prof["thread_id"])
+        stack, running = [], False
+        while frame is not None:
+            running = running or frame is prof["frame"]
+            if prof["mode"] == "sample":
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        if not running:
+            _profile_finish(prof)
+            return
+        if stack:
+            prof["folded"][";".join([prof["stage"]] + stack[::-1])] += 1
+
+
+@st.cache_resource
+def _profile_lock():
+    """tracemalloc e profiler sono globali al processo: un solo rerun profilato alla volta."""
+    return threading.Lock()
+
+
+def _profile_start(mode):
+    global _PROF
+    if not _profile_lock().acquire(blocking=False):
+        st.sidebar.warning("🩺 Profilo già in corso in un'altra sessione: rerun non profilato.")
+        return
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    _PROF = {
+        "mode": mode, "run_id": datetime.now().strftime("%Y%m%d-%H%M%S"),
+        "thread_id": threading.get_ident(), "t0": time.perf_counter(),
+        "stage": "setup", "stage_t0": time.perf_counter(), "stage_snap": None,
+        "stages": [], "folded": Counter(), "stop": threading.Event(), "done": False,
+        "finish": threading.Lock(), "frame": sys._getframe(1),   # frame top-level del rerun
+    }
+    tracemalloc.start(PROFILE_MEM_FRAMES)
+    _PROF["stage_snap"] = tracemalloc.take_snapshot()
+    if mode == "cprofile":
+        _PROF["profiler"] = cProfile.Profile()
+        _PROF["profiler"].enable()
+    _PROF["sampler"] = threading.Thread(target=_profile_sampler, args=(_PROF,),
+                                        name="monitor-profiler", daemon=True)
+    _PROF["sampler"].start()
+
+
+def _profile_close_stage(next_stage, prof=None):
+    # Lo snapshot tracemalloc è costoso: escluso dal profilo CPU
+    prof = _PROF if prof is None else prof
+    secs, name = time.perf_counter() - prof["stage_t0"], prof["stage"]
+    if "profiler" in prof:
+        prof["profiler"].disable()
+    prof["stage"] = "(snapshot tracemalloc)"
+    snap = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    prof["stages"].append({
+        "name": name, "secs": secs, "peak": peak,
+        "top": snap.compare_to(prof["stage_snap"], "lineno")[:PROFILE_MEM_TOP],
+    })
+    tracemalloc.reset_peak()
+    prof["stage"], prof["stage_t0"], prof["stage_snap"] = next_stage, time.perf_counter(), snap
+    if "profiler" in prof and next_stage != "end":
+        prof["profiler"].enable()
+
+
+def _profile_finish(prof=None):
+    """
+    Chiude l'ultimo stage, ferma profiler e tracemalloc e scrive i report.
+    Idempotente; chiamata dallo script a fine rerun o dal thread di controllo.
+    """
+    prof = _PROF if prof is None else prof
+    # Lock mai rilasciato: solo il primo tra script e thread di controllo prosegue
+    if prof is None or not prof["finish"].acquire(blocking=False):
+        return
+    prof["done"] = True
+    try:
+        _profile_close_stage("end", prof)
+    finally:
+        if prof["mode"] == "cprofile":
+            prof["profiler"].disable()
+        prof["stop"].set()
+        if prof["sampler"] is not threading.current_thread():
+            prof["sampler"].join()
+        prof["frame"] = None
+        tracemalloc.stop()
+        _profile_lock().release()
+    base = os.path.join(PROFILE_DIR, prof["run_id"])
+    if prof["mode"] == "cprofile":
+        prof["profiler"].dump_stats(base + ".prof")
+        report = base + ".prof"
+    else:
+        with open(base + ".folded", "w", encoding="utf-8") as f:
+            for stack, n in prof["folded"].items():
+                f.write(f"{stack} {n}\n")
+        report = base + ".folded"
+    with open(base + "_mem.txt", "w", encoding="utf-8") as f:
+        total = time.perf_counter() - prof["t0"]
+        f.write(f"Rerun profilato {prof['run_id']} · modo {prof['mode']} · {total:.2f}s\n")
+        for stg in prof["stages"]:
+            f.write(f"\n== {stg['name']} · {stg['secs']:.2f}s · picco {stg['peak'] / 2**20:.1f} MiB\n")
+            for diff in stg["top"]:
+                f.write(f"{diff}\n")
+    if threading.get_ident() == prof["thread_id"]:
+        st.sidebar.info(f"🩺 Profilo salvato: {report} · {base}_mem.txt")
+
+
+def _profile_mark(name):
+    """Apre lo stage `name` per il codice top-level che segue."""
+    if _PROF is not None and not _PROF["done"]:
+        _profile_close_stage(name)
+
+
+@contextmanager
+def _profile_stage(name):
+    """Attribuisce tempo e allocazioni del blocco allo stage `name`."""
+    if _PROF is None or _PROF["done"]:
+        yield
+        return
+    _profile_close_stage(name)
+    try:
+        yield
+    except BaseException:
+        # st.stop() / st.rerun() interrompono lo script: il report va scritto qui
+        _profile_finish()
+        raise
+    _profile_close_stage("main")
+
+
+_profile_mode = _profile_requested()
+if _profile_mode:
+    _profile_start(_profile_mode)
+
 # ========================
 # TICKERS
 # ========================
 SECTORS = ["XLK","XLY","XLF","XLC","XLV","XLP","XLI","XLE","XLB","XLU","XLRE"]
 BENCHMARK = "SPY"
 ALL_TICKERS = SECTORS + [BENCHMARK]
+MACRO_TICKERS = ["^VIX", "^MOVE", "IEF", "SHY"]    # variabili dei pattern A/B/C/D
 
 CYCLICAL = ["XLK","XLY","XLF","XLI","XLB","XLE"]
 DEFENSIVE = ["XLV","XLP","XLU","XLRE"]
@@ -122,8 +329,66 @@ TF_DAYS = {"1D": 1, "1W": 5, "1M": 21, "3M": 63, "6M": 126, "YTD": None, "1A": 2
 # ========================
 # DATA LOADERS
 # ========================
-@st.cache_data(ttl=60*60)
-def load_prices(tickers):
+# Pannelli compatti: close float32 e OHLCV colonnare float32 (metà memoria per
+# sessione in cache). Attivabili con MONITOR_COMPACT=1.
+COMPACT_PANELS = os.environ.get("MONITOR_COMPACT", "0") == "1"
+
+
+def _compact_close(close):
+    """Close in float32 se i pannelli compatti sono attivi."""
+    return close.astype(np.float32) if COMPACT_PANELS else close
+
+
+def ohlcv_series(raw, field, ticker):
+    """Serie di un campo OHLCV: pannello compatto o download yfinance (MultiIndex o singolo)."""
+    if isinstance(raw, dict):
+        return compact_series(raw, field, ticker)
+    if isinstance(raw.columns, pd.MultiIndex):
+        return raw[field][ticker]
+    return raw[field]
+
+
+def ohlcv_tickers(raw):
+    """Ticker disponibili nel download OHLCV (None se singolo ticker senza MultiIndex)."""
+    if isinstance(raw, dict):
+        return list(raw["tickers"])
+    return list(raw["Close"].columns) if isinstance(raw.columns, pd.MultiIndex) else None
+
+
+# Pannelli close condivisi: st.cache_data copierebbe il DataFrame per ogni
+# sessione; qui il pannello è pubblicato una volta su disco (.npy) e ogni
+# sessione/processo lo mappa in sola lettura (cache_resource = stesso oggetto).
+PANEL_DIR = os.environ.get("MONITOR_PANEL_DIR", os.path.join(".cache", "panels"))
+
+
+def panel_path(name):
+    """Percorso del pannello su disco (il dtype fa parte del nome)."""
+    return os.path.join(PANEL_DIR, f"{name}-{'f32' if COMPACT_PANELS else 'f64'}")
+
+
+def shared_close(name, fetch, max_age):
+    """
+    Pannello `name` mappato da disco; se manca o ha più di max_age secondi lo
+    riscarica con fetch() e pubblica la nuova versione.
+    """
+    path = panel_path(name)
+    if panel_age(path) < max_age:
+        mapped = map_panel(path)
+        if mapped is not None:
+            return mapped
+    close = fetch()
+    if close.empty:
+        return close
+    write_panel(close, path)
+    mapped = map_panel(path)
+    return mapped if mapped is not None else close
+
+
+def _panel_name(prefix, tickers):
+    return f"{prefix}-{hashlib.sha1(','.join(tickers).encode()).hexdigest()[:10]}"
+
+
+def _download_prices(tickers):
     end = datetime.today()
     start = end - timedelta(days=6*365)
     data = yf.download(tickers, start=start, end=end, auto_adjust=True, progress=False)
@@ -131,7 +396,12 @@ def load_prices(tickers):
         close = data["Close"]
     else:
         close = data
-    return close.dropna(how="all")
+    return _compact_close(close.dropna(how="all"))
+
+
+@st.cache_resource(ttl=60*60)
+def load_prices(tickers):
+    return shared_close(_panel_name("prices", tickers), lambda: _download_prices(tickers), 60*60)
 
 
 # ── FIX: load_prices_today con TTL 5 min per dati 1D sempre freschi
@@ -148,7 +418,7 @@ def load_prices_today(tickers):
         close = data["Close"]
     else:
         close = data
-    return close.dropna(how="all")
+    return _compact_close(close.dropna(how="all"))
 
 
 @st.cache_data(ttl=60*60)
@@ -164,63 +434,242 @@ def load_ohlcv_long(tickers):
     end   = datetime.today()
     start = end - timedelta(days=2*365)
     raw = yf.download(tickers, start=start, end=end, auto_adjust=True, progress=False)
+    if COMPACT_PANELS and isinstance(raw.columns, pd.MultiIndex):
+        return compact_panel(raw)
     return raw
 
 
-# ── FIX: Wikipedia con StringIO + fallback robusto
-@st.cache_data(ttl=60*60*6)
-def load_sp500_data(timeframe_days: int):
+# Pannello close S&P 500 unico per tutti i timeframe e per la breadth storica
+# (BREADTH_YEARS anni + warm-up per MM200 e massimi a 52 settimane), condiviso
+# come gli altri pannelli; ogni timeframe ne usa solo la coda.
+# Download a blocchi di ticker su un pool di thread limitato, con retry e backoff
+# per blocco (e per i singoli ticker mancanti da un blocco riuscito): ogni blocco
+# arrivato è pubblicato subito su disco, un blocco fallito non fa perdere gli altri.
+# La sessione che scarica attende comunque tutti i blocchi; il pannello parziale
+# è visibile solo agli altri processi che lo mappano nel frattempo.
+BREADTH_YEARS     = int(os.environ.get("MONITOR_BREADTH_YEARS", "3"))
+SP500_FETCH_DAYS  = 365 * BREADTH_YEARS + 400
+SP500_CHUNK       = int(os.environ.get("MONITOR_SP500_CHUNK", "50"))
+SP500_WORKERS     = int(os.environ.get("MONITOR_SP500_WORKERS", "4"))
+SP500_RETRIES     = 3
+SP500_BACKOFF     = 2.0           # secondi, raddoppiati a ogni tentativo
+SP500_TTL         = 60*60*6
+SP500_PARTIAL_TTL = 15*60         # pannello parziale: nuovo tentativo dopo 15 min
+
+
+def _download_sp500_chunk(chunk, start, end):
+    """
+    Close di un blocco di ticker, con retry e backoff esponenziale. I ticker
+    assenti da un download riuscito vengono ritentati da soli.
+    Ritorna (close, ticker mancanti dopo l'ultimo tentativo).
+    """
+    parts, pending = [], list(chunk)
+    for attempt in range(SP500_RETRIES):
+        try:
+            raw = yf.download(pending, start=start, end=end, auto_adjust=True, progress=False, threads=False)
+            if isinstance(raw.columns, pd.MultiIndex):
+                close = raw["Close"]
+            else:
+                close = raw[["Close"]].set_axis(pending[:1], axis=1)
+            close = close.dropna(how="all").dropna(axis=1, how="all")
+            if close.empty:
+                raise ValueError("nessun dato")
+            parts.append(close)
+            pending = [t for t in pending if t not in close.columns]
+            if not pending:
+                break
+        except Exception:
+            if attempt == SP500_RETRIES - 1 and not parts:
+                raise
+        if attempt < SP500_RETRIES - 1:
+            time.sleep(SP500_BACKOFF * 2 ** attempt)
+    return pd.concat(parts, axis=1), pending
+
+
+def _download_sp500_close(tickers, path):
+    """Scarica i blocchi in parallelo e pubblica il pannello a ogni blocco arrivato."""
+    end    = datetime.today()
+    start  = end - timedelta(days=SP500_FETCH_DAYS)
+    chunks = [list(tickers[i:i + SP500_CHUNK]) for i in range(0, len(tickers), SP500_CHUNK)]
+    parts, failed = [], []
+    with ThreadPoolExecutor(max_workers=SP500_WORKERS, thread_name_prefix="monitor-sp500") as ex:
+        futures = {ex.submit(_download_sp500_chunk, c, start, end): c for c in chunks}
+        for n_done, fut in enumerate(as_completed(futures), 1):
+            try:
+                part, missing = fut.result()
+            except Exception:
+                failed += futures[fut]
+                continue
+            parts.append(part)
+            failed += missing
+            close = pd.concat(parts, axis=1).sort_index()
+            close = _compact_close(close[[t for t in tickers if t in close.columns]])
+            write_panel(close, path, meta={"failed": failed,
+                                           "pending": len(chunks) - n_done, "tickers": len(tickers)})
+
+
+@st.cache_resource(ttl=SP500_PARTIAL_TTL)
+def load_sp500_close(tickers):
+    """
+    Pannello close S&P 500 mappato da disco. Se il download fallisce del tutto
+    resta l'ultima versione pubblicata.
+    """
+    path = panel_path(_panel_name("sp500", tickers))
+    meta = panel_meta(path)
+    if panel_age(path) < (SP500_PARTIAL_TTL if meta.get("failed") or meta.get("pending") else SP500_TTL):
+        mapped = map_panel(path)
+        if mapped is not None:
+            return mapped
+    _download_sp500_close(tickers, path)
+    mapped = map_panel(path)
+    return mapped if mapped is not None else pd.DataFrame()
+
+
+# Lista costituenti S&P 500 persistita: CSV con date di validità (storico per la
+# breadth). Le uscite dall'indice sono note solo dal primo snapshot salvato in
+# poi: prima di quella data lo storico ha ancora survivorship bias.
+# L'app parte sempre dall'ultima lista valida; l'aggiornamento da Wikipedia gira
+# in background quando la lista è vecchia.
+SP500_CONSTITUENTS_PATH = os.environ.get("MONITOR_SP500_CONSTITUENTS",
+                                         os.path.join(".cache", "sp500_constituents.csv"))
+SP500_LIST_MAX_AGE   = 60*60*24
+SP500_LIST_RETRY     = 15*60      # dopo un aggiornamento fallito
+SP500_LIST_MIN_RATIO = 0.9        # snapshot con meno del 90% dei membri attuali = tabella rotta
+
+
+def _fetch_sp500_snapshot():
+    """Solo la tabella #constituents di Wikipedia → Ticker, Sector, Added."""
     import requests
     from io import StringIO
-    wiki, resp = None, None
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+                      "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+        "Accept-Language": "en-US,en;q=0.9",
+    }
+    resp = requests.get("https://en.wikipedia.org/wiki/List_of_S%26P_500_companies",
+                        headers=headers, timeout=15)
+    resp.raise_for_status()
+    # Si passa a read_html solo il frammento <table id="constituents">…</table>
+    html = resp.text
+    i = html.find('id="constituents"')
+    if i >= 0:
+        html = html[html.rfind("<table", 0, i):html.find("</table>", i) + len("</table>")]
+    raw     = pd.read_html(StringIO(html), attrs={"id": "constituents"})[0]
+    sym_col = next(c for c in raw.columns if "Symbol" in str(c) or "Ticker" in str(c))
+    sec_col = next(c for c in raw.columns if "Sector" in str(c) or "GICS" in str(c))
+    add_col = next((c for c in raw.columns if "added" in str(c).lower()), None)
+    snap = pd.DataFrame({
+        "Ticker": raw[sym_col].astype(str).str.replace(".", "-", regex=False),
+        "Sector": raw[sec_col].astype(str),
+        "Added":  raw[add_col] if add_col is not None else pd.NaT,
+    })
+    if snap.empty:
+        raise ValueError("tabella costituenti vuota")
+    return snap
+
+
+def _read_constituents():
+    """Storico persistito (None se assente o illeggibile)."""
     try:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                          "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            "Accept-Language": "en-US,en;q=0.9",
-        }
-        resp = requests.get(
-            "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies",
-            headers=headers, timeout=15
-        )
-        resp.raise_for_status()
-        tables = pd.read_html(StringIO(resp.text), attrs={"id": "constituents"})
-        if tables:
-            raw     = tables[0]
-            sym_col = next((c for c in raw.columns if "Symbol" in str(c) or "Ticker" in str(c)), None)
-            sec_col = next((c for c in raw.columns if "Sector" in str(c) or "GICS"   in str(c)), None)
-            if sym_col and sec_col:
-                wiki = raw[[sym_col, sec_col]].copy()
-                wiki.columns = ["Ticker", "Sector"]
-                wiki["Ticker"] = wiki["Ticker"].astype(str).str.replace(".", "-", regex=False)
-    except Exception:
-        pass
-    if wiki is None and resp is not None:
-        try:
-            from io import StringIO as _SIO
-            tables  = pd.read_html(_SIO(resp.text), header=0)
-            raw     = tables[0]
-            sym_col = next((c for c in raw.columns if "Symbol" in str(c) or "Ticker" in str(c)), raw.columns[0])
-            sec_col = next((c for c in raw.columns if "Sector" in str(c) or "GICS"   in str(c)), raw.columns[3])
-            wiki = raw[[sym_col, sec_col]].copy()
-            wiki.columns = ["Ticker", "Sector"]
-            wiki["Ticker"] = wiki["Ticker"].astype(str).str.replace(".", "-", regex=False)
-        except Exception as e:
-            st.error(f"Errore caricamento lista S&P 500: {e}")
-            return pd.DataFrame()
-    if wiki is None or wiki.empty:
-        st.error("Lista S&P 500 non disponibile. Riprova tra qualche minuto.")
+        return pd.read_csv(SP500_CONSTITUENTS_PATH, parse_dates=["start", "end"])
+    except (OSError, ValueError):
+        return None
+
+
+def refresh_sp500_constituents():
+    """Snapshot da Wikipedia → storico aggiornato, riscritto atomicamente. Ritorna lo storico."""
+    hist = _read_constituents()
+    snap = _fetch_sp500_snapshot()
+    if hist is not None and len(snap) < SP500_LIST_MIN_RATIO * hist["end"].isna().sum():
+        raise ValueError(f"snapshot sospetto: {len(snap)} titoli")
+    hist = constituents_update(hist, snap, datetime.today())
+    os.makedirs(os.path.dirname(SP500_CONSTITUENTS_PATH) or ".", exist_ok=True)
+    tmp = f"{SP500_CONSTITUENTS_PATH}.tmp{os.getpid()}"
+    hist.to_csv(tmp, index=False, date_format="%Y-%m-%d")
+    os.replace(tmp, SP500_CONSTITUENTS_PATH)
+    return hist
+
+
+@st.cache_resource
+def _constituents_refresher():
+    return {"lock": threading.Lock(), "thread": None, "error": None, "last_try": 0.0}
+
+
+def _refresh_constituents_background():
+    """Avvia l'aggiornamento in un thread (uno alla volta, con pausa dopo un errore)."""
+    r = _constituents_refresher()
+    with r["lock"]:
+        if r["thread"] is not None and r["thread"].is_alive():
+            return
+        if r["error"] and time.time() - r["last_try"] < SP500_LIST_RETRY:
+            return
+        r["last_try"] = time.time()
+
+        def _run():
+            try:
+                refresh_sp500_constituents()
+                r["error"] = None
+            except Exception as e:
+                r["error"] = str(e)
+
+        r["thread"] = threading.Thread(target=_run, name="monitor-sp500-list", daemon=True)
+        r["thread"].start()
+
+
+def sp500_constituents_history():
+    """
+    Storico costituenti: l'ultima lista valida su disco (aggiornata in background
+    se vecchia); al primo avvio senza file lo scarica subito.
+    """
+    hist = _read_constituents()
+    if hist is None:
+        return refresh_sp500_constituents()
+    if time.time() - os.path.getmtime(SP500_CONSTITUENTS_PATH) > SP500_LIST_MAX_AGE:
+        _refresh_constituents_background()
+    return hist
+
+
+def sp500_list_status():
+    """
+    (data ultimo aggiornamento della lista, errore dell'ultimo tentativo in
+    background); avvia l'aggiornamento se la lista è vecchia.
+    """
+    try:
+        mtime = os.path.getmtime(SP500_CONSTITUENTS_PATH)
+    except OSError:
+        return None, _constituents_refresher()["error"]
+    if time.time() - mtime > SP500_LIST_MAX_AGE:
+        _refresh_constituents_background()
+    return datetime.fromtimestamp(mtime), _constituents_refresher()["error"]
+
+
+def sp500_universe(hist):
+    """Ticker membri in qualunque momento della finestra del pannello, usciti compresi."""
+    start = pd.Timestamp(datetime.today() - timedelta(days=SP500_FETCH_DAYS))
+    return tuple(sorted(hist.loc[hist["end"].isna() | (hist["end"] >= start), "Ticker"].unique()))
+
+
+@st.cache_data(ttl=SP500_PARTIAL_TTL)
+def load_sp500_data(timeframe_days: int):
+    try:
+        hist = sp500_constituents_history()
+    except Exception as e:
+        st.error(f"Lista S&P 500 non disponibile: {e}")
         return pd.DataFrame()
+    wiki       = constituents_at(hist, datetime.today())
     tickers    = wiki["Ticker"].tolist()
+    universe   = sp500_universe(hist)
     fetch_days = timeframe_days + 15
-    end        = datetime.today()
-    start      = end - timedelta(days=fetch_days)
-    try:
-        raw = yf.download(tickers, start=start, end=end, auto_adjust=True, progress=False, threads=True)
-        close = raw["Close"] if isinstance(raw.columns, pd.MultiIndex) else raw
-    except Exception as e:
-        st.error(f"Errore yfinance: {e}")
+    start      = pd.Timestamp(datetime.today() - timedelta(days=fetch_days)).normalize()
+    close = load_sp500_close(universe)
+    if close.empty:
+        st.error("Errore yfinance: nessun blocco di ticker S&P 500 scaricato.")
         return pd.DataFrame()
+    failed = panel_meta(panel_path(_panel_name("sp500", universe))).get("failed", [])
+    if failed:
+        st.warning(f"S&P 500: {len(failed)}/{len(universe)} ticker non scaricati "
+                   "(download parziale, nuovo tentativo a breve).")
+    close = close[close.index >= start]
     results = []
     for ticker in tickers:
         if ticker not in close.columns:
@@ -234,67 +683,39 @@ def load_sp500_data(timeframe_days: int):
     ret_df = pd.DataFrame(results)
     merged = ret_df.merge(wiki, on="Ticker", how="left").dropna(subset=["Sector"])
     return merged
-    
-
-# ========================
-# HELPER — RSI (Wilder corretto)
-# ========================
-def compute_rsi(series: pd.Series, period: int = 14) -> float:
-    """
-    RSI Wilder corretto — identico a TradingView e alla formula Excel YAHOO_RSI.
-    Smoothing: media_precedente × (period-1) + valore_attuale) / period
-    """
-    s = series.dropna()
-    if len(s) < period + 1:
-        return np.nan
-
-    delta = s.diff().dropna()
-    gain  = delta.clip(lower=0)
-    loss  = (-delta.clip(upper=0))
-
-    # Prima media SMA sui primi 'period' valori (seed di Wilder)
-    avg_gain = float(gain.iloc[:period].mean())
-    avg_loss = float(loss.iloc[:period].mean())
-
-    # Smoothing di Wilder sui valori successivi
-    for i in range(period, len(gain)):
-        avg_gain = (avg_gain * (period - 1) + float(gain.iloc[i])) / period
-        avg_loss = (avg_loss * (period - 1) + float(loss.iloc[i])) / period
-
-    if avg_loss == 0:
-        return 100.0
-
-    rs = avg_gain / avg_loss
-    return round(100 - (100 / (1 + rs)), 2)
 
 
 # ========================
-# HELPER — MMS6M CON REGRESSIONE LINEARE
+# BREADTH S&P 500 — storico (Tab 4)
 # ========================
-def compute_mms6m_regression(r1w, r1m, r3m, r6m,
-                               pesi_lenta=(0.20, 0.35, 0.25, 0.20),  coeff_lenta=0.05,
-                               pesi_veloce=(0.30, 0.40, 0.25, 0.05), coeff_veloce=0.22):
-    """
-    MMS6M con correzione pendenza regressione lineare su 3 punti (1W, 1M, 3M).
-    Lenta  (coeff 0.05) = regime strutturale.
-    Veloce (coeff 0.22) = rotazione nascente.
-    Delta veloce-lenta  = accelerazione.
-    """
-    if any(np.isnan(v) for v in [r1w, r1m, r3m, r6m]):
-        return np.nan, np.nan, np.nan
-    base_lenta  = (r1w*pesi_lenta[0]  + r1m*pesi_lenta[1]  +
-                   r3m*pesi_lenta[2]  + r6m*pesi_lenta[3])
-    base_veloce = (r1w*pesi_veloce[0] + r1m*pesi_veloce[1] +
-                   r3m*pesi_veloce[2] + r6m*pesi_veloce[3])
-    x      = np.array([0.25, 1.0, 3.0])
-    y      = np.array([r1w,  r1m, r3m])
-    xm, ym = x.mean(), y.mean()
-    slope  = np.dot(x - xm, y - ym) / np.dot(x - xm, x - xm)
-    mms_lenta  = base_lenta  + slope * coeff_lenta
-    mms_veloce = base_veloce + slope * coeff_veloce
-    return mms_lenta, mms_veloce, mms_veloce - mms_lenta
+# Stato per processo: calcolo completo solo quando cambia l'universo del
+# pannello; ogni nuova versione del pannello aggiunge soltanto le sedute nuove.
+@st.cache_resource
+def _breadth_store():
+    return {"lock": threading.Lock(), "state": None, "columns": None, "panel": None}
 
 
+def sp500_breadth():
+    """Stato breadth (breadth_history) allineato all'ultimo pannello S&P 500; None se non disponibile."""
+    try:
+        hist  = sp500_constituents_history()
+        close = load_sp500_close(sp500_universe(hist))
+    except Exception as e:
+        st.warning(f"Breadth storico non disponibile: {e}")
+        return None
+    if close.empty or len(close) <= BREADTH_WARMUP:
+        return None
+    store = _breadth_store()
+    with store["lock"]:
+        if store["state"] is None or store["columns"] != list(close.columns):
+            store["state"]   = breadth_history(close, hist)
+            store["columns"] = list(close.columns)
+        elif store["panel"] is not close:
+            store["state"] = breadth_update(store["state"], close, hist)
+        store["panel"] = close
+        return store["state"]
+    
+
 # ========================
 # HELPER — DISPERSIONE CROSS-SETTORIALE
 # ========================
@@ -317,16 +738,10 @@ def compute_cross_sector_dispersion(euro_ind_df: pd.DataFrame) -> dict:
 # ========================
 def compute_vwds(ohlcv_raw, ticker, window, w_dir=0.60, w_pos=0.40):
     try:
-        if isinstance(ohlcv_raw.columns, pd.MultiIndex):
-            hi = ohlcv_raw["High"][ticker].dropna()
-            lo = ohlcv_raw["Low"][ticker].dropna()
-            cl = ohlcv_raw["Close"][ticker].dropna()
-            vo = ohlcv_raw["Volume"][ticker].dropna()
-        else:
-            hi = ohlcv_raw["High"].dropna()
-            lo = ohlcv_raw["Low"].dropna()
-            cl = ohlcv_raw["Close"].dropna()
-            vo = ohlcv_raw["Volume"].dropna()
+        hi = ohlcv_series(ohlcv_raw, "High", ticker).dropna()
+        lo = ohlcv_series(ohlcv_raw, "Low", ticker).dropna()
+        cl = ohlcv_series(ohlcv_raw, "Close", ticker).dropna()
+        vo = ohlcv_series(ohlcv_raw, "Volume", ticker).dropna()
         idx = hi.index.intersection(lo.index).intersection(cl.index).intersection(vo.index)
         hi, lo, cl, vo = hi[idx].iloc[-window:], lo[idx].iloc[-window:], cl[idx].iloc[-window:], vo[idx].iloc[-window:]
         if len(cl) < max(3, window // 3):
@@ -441,10 +856,11 @@ def obv_flow_regime(close: pd.Series, volume: pd.Series,
 # ========================
 # RETURN FUNCTIONS
 # ========================
-def ret(data, days):
-    if len(data) <= days:
-        return np.nan
-    return (data.iloc[-1] / data.iloc[-days-1] - 1) * 100
+def ret(ap, days):
+    """Rendimento % a `days` sedute per ticker, all'ultima riga del pannello allineato."""
+    if not len(ap["index"]):
+        return pd.Series(np.nan, index=ap["columns"])
+    return pd.Series(ap_returns(ap, len(ap["index"]) - 1, days) * 100, index=ap["columns"])
 
 def ret_ytd(data):
     ytd = data[data.index.year == datetime.today().year]
@@ -551,54 +967,21 @@ def compute_band_derivative(adaptive_threshold_series, window=10):
                    "soglia_stretta": s_str, "soglia_larga": s_lar, "deriv_std": deriv_std}
 
 
-# ========================
-# RISK OFF EPISODES
-# ========================
-def compute_risk_off_episodes(series, threshold, confirm_days=3):
-    if series.empty:
-        return []
-    neg_threshold = -abs(threshold)
-    episodes, in_episode, ep_start, ep_confirmed = [], False, None, None
-    consec_below, consec_above = 0, 0
-    for date, val in series.items():
-        is_below = val < neg_threshold
-        if not in_episode:
-            if is_below:
-                consec_below += 1
-                if consec_below == 1:
-                    ep_start = date
-                if consec_below >= confirm_days:
-                    in_episode, ep_confirmed, consec_above = True, date, 0
-            else:
-                consec_below, ep_start = 0, None
-        else:
-            if not is_below:
-                consec_above += 1
-                if consec_above >= confirm_days:
-                    ep_slice = series[ep_start:date]
-                    episodes.append({"start": ep_start, "confirmed": ep_confirmed, "end": date,
-                                     "open": False, "duration": (date - ep_start).days,
-                                     "rs_min": round(float(ep_slice.min()), 2), "rs_min_date": ep_slice.idxmin()})
-                    in_episode, consec_below, consec_above, ep_start = False, 0, 0, None
-            else:
-                consec_above = 0
-    if in_episode and ep_start is not None:
-        ep_slice = series[ep_start:]
-        episodes.append({"start": ep_start, "confirmed": ep_confirmed, "end": None, "open": True,
-                          "duration": (series.index[-1] - ep_start).days,
-                          "rs_min": round(float(ep_slice.min()), 2), "rs_min_date": ep_slice.idxmin()})
-    return episodes
-
 # ========================
 # EUROSTOXX LOADERS
 # ========================
-@st.cache_data(ttl=3600)
-def load_euro_prices():
+def _download_euro_prices():
     end   = datetime.today()
     start = end - timedelta(days=2*365+30)
     raw   = yf.download(EURO_ALL, start=start, end=end, auto_adjust=True, progress=False)
     close = raw["Close"] if isinstance(raw.columns, pd.MultiIndex) else raw
-    return close.dropna(how="all")
+    return _compact_close(close.dropna(how="all"))
+
+
+@st.cache_resource(ttl=3600)
+def load_euro_prices():
+    return shared_close(_panel_name("euro", EURO_ALL), _download_euro_prices, 3600)
+
 
 @st.cache_data(ttl=300)
 def load_euro_prices_today():
@@ -606,37 +989,32 @@ def load_euro_prices_today():
     start = end - timedelta(days=7)
     raw   = yf.download(EURO_ALL, start=start, end=end, auto_adjust=True, progress=False)
     close = raw["Close"] if isinstance(raw.columns, pd.MultiIndex) else raw
-    return close.dropna(how="all")
+    return _compact_close(close.dropna(how="all"))
 
 # ========================
 # EUROSTOXX INDICATORS
 # ========================
 def compute_euro_indicators(prices, today_prices, benchmark):
     results = []
-    bm   = prices[benchmark].dropna()       if benchmark in prices.columns       else None
-    bm_t = today_prices[benchmark].dropna() if benchmark in today_prices.columns else None
     wts  = [0.20, 0.35, 0.25, 0.20]
 
+    # Lookback all'ultima riga: gather sui pannelli allineati (1D da today_prices)
+    ap   = aligned_panel(prices)
+    ap_t = aligned_panel(today_prices)
+    rets = {d: ap_returns(ap, len(prices) - 1, d) for d in [5, 21, 63, 126]}
+    rets[1] = ap_returns(ap_t, len(today_prices) - 1, 1) if len(today_prices) else None
+    dd3  = ap_maxdd(ap, len(prices) - 1, 63)
+    dd6  = ap_maxdd(ap, len(prices) - 1, 126)
+
     def get_rsr(tk, days):
-        try:
-            s = today_prices[tk].dropna() if days == 1 else prices[tk].dropna()
-            b = bm_t if days == 1 else bm
-            if s is None or b is None or len(s) <= days or len(b) <= days:
-                return np.nan
-            rs = float(s.iloc[-1] / s.iloc[-days-1] - 1)
-            rb = float(b.iloc[-1] / b.iloc[-days-1] - 1)
-            return float((1 + rs) / (1 + rb) - 1)
-        except Exception:
+        src = ap_t if days == 1 else ap
+        j, jb = src["col"].get(tk), src["col"].get(benchmark)
+        if rets[days] is None or j is None or jb is None:
             return np.nan
+        return float((1 + rets[days][j]) / (1 + rets[days][jb]) - 1)
 
     def get_abs(tk, days):
-        try:
-            s = prices[tk].dropna()
-            if len(s) <= days:
-                return np.nan
-            return float(s.iloc[-1] / s.iloc[-days-1] - 1)
-        except Exception:
-            return np.nan
+        return float(rets[days][ap["col"][tk]])
 
     for tk in [t for t in prices.columns if t != benchmark]:
         r1d = get_rsr(tk, 1);  r1w = get_rsr(tk, 5)
@@ -675,9 +1053,8 @@ def compute_euro_indicators(prices, today_prices, benchmark):
             mbi = np.nan
 
         # MaxDD assoluto 3M e 6M (prices = storico lungo passato come parametro)
-        actual_ref_euro = prices.index[-1]
-        maxdd_3m = calcola_maxdd_assoluto(tk, prices, actual_ref_euro, periodo_giorni=63)
-        maxdd_6m = calcola_maxdd_assoluto_6m(tk, prices, actual_ref_euro, periodo_giorni=126)
+        maxdd_3m = float(dd3[ap["col"][tk]])
+        maxdd_6m = float(dd6[ap["col"][tk]])
 
         # MME — efficienza assoluta strutturale
         mme = mms_a_lenta / (abs(maxdd_6m) + 0.0001) if not np.isnan(maxdd_6m) else np.nan
@@ -722,58 +1099,993 @@ def compute_euro_indicators(prices, today_prices, benchmark):
             "Tact. Thrust": tt, "Mr Index": mr, "MBI": mbi,
         })
     return pd.DataFrame(results).set_index("Ticker")
-def calcola_maxdd_assoluto(ticker, bt_close, actual_ref, periodo_giorni=63):
+
+
+# ========================
+# BACKTEST ENGINES (Tab 6 / Tab 8) — nessuna chiamata st.*: girano nei worker
+# ========================
+BT_FW_DAYS = {"1M": 21, "3M": 63, "6M": 126, "1A": 252}
+
+
+def _download_close(tickers, start):
+    raw   = yf.download(tickers, start=start, end=datetime.today(), auto_adjust=True, progress=False)
+    close = raw["Close"] if isinstance(raw.columns, pd.MultiIndex) else raw
+    return _compact_close(close.dropna(how="all"))
+
+
+def run_rotation_backtest(params, progress):
+    """
+    Tab 6 — indicatori alla data di riferimento + rendimenti forward.
+    params: tickers, benchmark, ref_date (YYYY-MM-DD), fw1, fw2.
+    progress(frac, msg) aggiorna lo stato del job (e solleva JobCancelled se annullato).
+    """
+    bt_tickers, bt_benchmark = params["tickers"], params["benchmark"]
+    bt_fw1, bt_fw2 = params["fw1"], params["fw2"]
+    ref_dt = pd.Timestamp(params["ref_date"])
+    fwd1_d, fwd2_d = BT_FW_DAYS[bt_fw1], BT_FW_DAYS[bt_fw2]
+    bt_all = bt_tickers + [bt_benchmark]
+    out    = {"warnings": [], "error": None}
+
+    progress(0.0, "Download prezzi...")
     try:
-        tk_s = bt_close[ticker].dropna()
-        end_idx   = tk_s.index.searchsorted(actual_ref)
-        start_idx = max(0, end_idx - periodo_giorni)
-        tk_win = tk_s.iloc[start_idx:end_idx]
-        if len(tk_win) < 10: return np.nan
-        rolling_max = tk_win.expanding().max()
-        drawdown = (tk_win - rolling_max) / rolling_max
-        return float(drawdown.min())
-    except: return np.nan
-def calcola_maxdd_rsr(ticker, benchmark, bt_close, actual_ref, periodo_giorni=63):
+        bt_close = _download_close(bt_all, ref_dt - timedelta(days=3*365))
+    except Exception as e:
+        out["error"] = f"Errore download: {e}"
+        return out
+
+    not_found = [t for t in bt_all if t not in bt_close.columns]
+    if not_found:
+        out["warnings"].append(f"Ticker non trovati: {', '.join(not_found)}")
+    if bt_benchmark not in bt_close.columns:
+        out["error"] = f"Benchmark {bt_benchmark} non disponibile."
+        return out
+
+    actual_ref = bt_close.index[min(bt_close.index.searchsorted(ref_dt), len(bt_close) - 1)]
+
+    bt_hist = bt_close[bt_close.index <= actual_ref].copy()
+    bm_hist = bt_hist[bt_benchmark].dropna()
+
+    # RSI benchmark alla data
+    rsi_bm_bt = compute_rsi(bm_hist)
+
+    # Lookback e max drawdown alla data: gather sul pannello allineato
+    bt_ap  = aligned_panel(bt_close)
+    row    = ap_row(bt_ap, actual_ref)
+    bt_ret = {d: ap_returns(bt_ap, row, d) for d in [1, 5, 21, 63, 126]}
+    bt_dd3 = ap_maxdd(bt_ap, row, 63)
+    bt_dd6 = ap_maxdd(bt_ap, row, 126)
+    j_bm   = bt_ap["col"].get(bt_benchmark)
+
+    def rsr_at(tk, days):
+        if j_bm is None: return np.nan
+        return float((1 + bt_ret[days][bt_ap["col"][tk]]) / (1 + bt_ret[days][j_bm]) - 1)
+
+    def abs_at(tk, days):
+        return float(bt_ret[days][bt_ap["col"][tk]])
+
+    # Rendimenti forward 1..252 sedute alla data, tutti i ticker in un solo tensore
+    bt_ft = forward_tensor(bt_close, FW_MAX_H, dates=[actual_ref])
+
+    def fw(tk, days):
+        return float(fw_panel(bt_ft, days, [tk]).iloc[0, 0])
+
+    wts  = [0.20, 0.35, 0.25, 0.20]
+    rows = []
+    for i_t, tk in enumerate(bt_tickers):
+        progress(0.1 + 0.9 * i_t / len(bt_tickers), f"Indicatori {tk}")
+        if tk not in bt_close.columns:
+            continue
+        r1d = rsr_at(tk, 1);  r1w = rsr_at(tk, 5)
+        r1m = rsr_at(tk, 21); r3m = rsr_at(tk, 63); r6m = rsr_at(tk, 126)
+        vr  = [r1w, r1m, r3m, r6m]
+        mms6m_rsr = (sum(v*w for v,w in zip(vr,wts))
+                     if not any(np.isnan(v) for v in vr) else np.nan)
+
+        va = [abs_at(tk, d) for d in [5, 21, 63, 126]]
+
+        # MMS6M con regressione
+        mms_r_l, mms_r_v, mms_r_d = compute_mms6m_regression(r1w, r1m, r3m, r6m)
+        mms_a_l, mms_a_v, mms_a_d = (compute_mms6m_regression(*va)
+            if not any(np.isnan(v) for v in va) else (np.nan, np.nan, np.nan))
+
+        breve = (r1m*0.50 + r1w*0.35 + r1d*0.15
+                 if not any(np.isnan(v) for v in [r1m,r1w,r1d]) else np.nan)
+        medio = (r1m*0.35 + r3m*0.25 + r6m*0.20 + r1w*0.20
+                 if not any(np.isnan(v) for v in [r1m,r3m,r6m,r1w]) else np.nan)
+        tt = (breve - medio) if not (np.isnan(breve) or np.isnan(medio)) else np.nan
+        mr = (breve / (abs(medio) + 2)) if not (np.isnan(breve) or np.isnan(medio)) else np.nan
+
+        # MaxDD 3M e 6M — su storico fino alla data di riferimento
+        maxdd_3m_bt = float(bt_dd3[bt_ap["col"][tk]])
+        maxdd_6m_bt = float(bt_dd6[bt_ap["col"][tk]])
+
+        # MME — efficienza assoluta strutturale
+        mme_bt = mms_a_l / (abs(maxdd_6m_bt) + 0.0001) if not np.isnan(maxdd_6m_bt) else np.nan
+
+        # GTE — qualità impulso relativo normalizzata su rischio 3M
+        if not any(np.isnan(v) for v in [r1w, r1m, r3m]):
+            gemini_3m_bt = (r1w + (r1m - r1w) / 3 + (r3m - r1m) / 8) / 3
+            gte_bt = gemini_3m_bt / (abs(maxdd_3m_bt) + 0.0001) if not np.isnan(maxdd_3m_bt) else np.nan
+        else:
+            gte_bt = np.nan
+
+        # MAC — Marginal Absolute Contribution (stessa logica di compute_euro_indicators)
+        if not any(np.isnan(v) for v in [r1w, r1m, r3m, r6m]) and not np.isnan(maxdd_3m_bt):
+            marg_1w_bt = r1w
+            marg_1m_bt = r1m - r1w
+            marg_3m_bt = r3m - r1m
+            marg_6m_bt = r6m - r3m
+            mac_num_bt = marg_1w_bt * 0.4 + marg_1m_bt * 0.3 + marg_3m_bt * 0.2 + marg_6m_bt * 0.1
+            mac_bt = mac_num_bt / (abs(maxdd_3m_bt) + 0.0001)
+        else:
+            mac_bt = np.nan
+
+        # _S_minus_M per Δ Rank cross-settoriale (calcolato dopo il loop)
+        s_minus_m_bt = mms_a_v - mms_a_l if not (np.isnan(mms_a_v) or np.isnan(mms_a_l)) else np.nan
+
+        # AMSR Score — riusa maxdd_3m_bt già calcolato; rendimenti alla data di riferimento
+        ret_abs_1m, ret_abs_3m = abs_at(tk, 21), abs_at(tk, 63)
+        amsr_score = ((ret_abs_1m + ret_abs_3m - abs(maxdd_3m_bt))
+                      if not np.isnan(maxdd_3m_bt) else np.nan)
+
+        # Rendimenti forward
+        ret_fw1 = fw(tk, fwd1_d)
+        ret_fw2 = fw(tk, fwd2_d)
+        bm_fw1  = fw(bt_benchmark, fwd1_d)
+        bm_fw2  = fw(bt_benchmark, fwd2_d)
+        d1 = (ret_fw1 - bm_fw1) if not (np.isnan(ret_fw1) or np.isnan(bm_fw1)) else np.nan
+        d2 = (ret_fw2 - bm_fw2) if not (np.isnan(ret_fw2) or np.isnan(bm_fw2)) else np.nan
+
+        rows.append({
+            "Ticker":        tk,
+            "RSI BM":        rsi_bm_bt,
+            "MMS6M RSr":     mms6m_rsr,
+            "MAC":           mac_bt,
+            "MMS6M React.":  mms_r_v,
+            "Δ React.":      mms_r_d,
+            "Tact. Thrust":  tt,
+            "Mr Index":      mr,
+            "MME":           mme_bt,
+            "GTE":           gte_bt,
+            "_S_minus_M":    s_minus_m_bt,
+            "AMSR Score":    amsr_score,
+            f"Rend +{bt_fw1}":     ret_fw1, f"Rend +{bt_fw2}":     ret_fw2,
+            f"Delta BM +{bt_fw1}": d1,      f"Delta BM +{bt_fw2}": d2,
+        })
+
+    if not rows:
+        out["error"] = "Nessun dato calcolato."
+        return out
+
+    res = (pd.DataFrame(rows).set_index("Ticker")
+           .sort_values("MMS6M RSr", ascending=False))
+    res["Rank MMS6M"] = res["MMS6M RSr"].rank(ascending=False, na_option="bottom").astype(int)
+    # Δ Rank condizionato a MAC positivo (stessa logica di Tab 5)
+    res["Δ Rank"] = res["_S_minus_M"].where(res["MAC"] > 0).rank(ascending=False, na_option="keep", method="min")
+    # Percentile di ogni indicatore nella storia del ticker fino alla data (finestra PCT_WINDOW)
+    pct = percentile_latest(table_panels(bt_hist, list(res.index), bt_benchmark))
+    out.update({"res": res, "actual_ref": actual_ref, "rsi_bm": rsi_bm_bt,
+                "fw_curve": fw_curve(bt_ft, list(res.index), bt_benchmark),
+                "pct": pd.DataFrame({f"{k} %ile": v for k, v in pct.items()})})
+    return out
+
+
+MB_PROCESSES          = int(os.environ.get("MONITOR_MB_PROCESSES", os.cpu_count() or 1))
+MB_MIN_DATES_PARALLEL = 8   # sotto questa soglia l'avvio dei processi non conviene
+
+
+@st.cache_resource
+def _mb_process_pool():
+    """
+    Pool di processi persistente. Start method "forkserver" (spawn dove non c'è):
+    un fork del server Streamlit, multithread, rischia deadlock su lock presi da
+    altri thread. I worker non rieseguono app.py: sotto Streamlit __main__ è la
+    CLI, non lo script, e i worker importano solo indicators (precaricato nel
+    forkserver).
+    """
+    methods = multiprocessing.get_all_start_methods()
+    ctx     = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    if ctx.get_start_method() == "forkserver":
+        ctx.set_forkserver_preload(["indicators"])
+    return ProcessPoolExecutor(max_workers=MB_PROCESSES, mp_context=ctx)
+
+
+def mb_date_range(start, end, step):
+    """Date di riferimento del backtest multi-data (passo in giorni di calendario)."""
+    date_range, d, end_ts = [], pd.Timestamp(start), pd.Timestamp(end)
+    while d <= end_ts:
+        date_range.append(d)
+        d += pd.Timedelta(days=step)
+    return date_range
+
+
+def run_multidate_backtest(params, progress, run_key, procs):
+    """
+    Tab 8 — loop su date di riferimento.
+    params: tickers, benchmark, start, end, step, fw. run_key: chiave del job
+    (result_key), usata anche come run nell'archivio osservazioni; procs: pool
+    di processi (_mb_process_pool, creato nel thread dello script).
+    """
+    mb_tickers, mb_bm, mb_fw = params["tickers"], params["benchmark"], params["fw"]
+    mb_all     = mb_tickers + [mb_bm]
+    fw_d       = BT_FW_DAYS[mb_fw]
+    date_range = mb_date_range(params["start"], params["end"], params["step"])
+    out        = {"warnings": [], "error": None}
+
+    progress(0.0, f"Download prezzi ({len(date_range)} date)...")
     try:
-        tk_s = bt_close[ticker].dropna()
-        bm_s = bt_close[benchmark].dropna()
-        end_idx   = tk_s.index.searchsorted(actual_ref)
-        start_idx = max(0, end_idx - periodo_giorni)
-        tk_win = tk_s.iloc[start_idx:end_idx]
-        bm_win = bm_s.reindex(tk_win.index).dropna()
-        tk_win = tk_win.reindex(bm_win.index)
-        if len(tk_win) < 10: return np.nan
-        rsr_s = (tk_win / bm_win) - 1
-        rolling_max = rsr_s.expanding().max()
-        drawdown    = rsr_s - rolling_max
-        return float(drawdown.min())
-    except: return np.nan
-def calcola_maxdd_assoluto_6m(ticker, bt_close, actual_ref, periodo_giorni=126):
+        mb_close = _download_close(mb_all, pd.Timestamp(params["start"]) - timedelta(days=3*365))
+    except Exception as e:
+        out["error"] = f"Errore download: {e}"
+        return out
+
+    # Setup (pannello allineato, tensore forward, RSI benchmark) una sola volta per
+    # tutte le date; le date sono poi indipendenti: blocchi di righe su un pool di
+    # processi, con gli input in shared memory (nessun pickle per task)
+    progress(0.05, "Pannello allineato e rendimenti forward...")
+    inp     = multidate_inputs(mb_close, date_range, mb_bm, fw_d)
+    cols    = list(mb_close.columns)
+    n_dates = len(inp["day"])
+    n_proc  = min(MB_PROCESSES, n_dates)
+    if n_proc <= 1 or n_dates < MB_MIN_DATES_PARALLEL:
+        rows_mb = []
+        for i_d in range(n_dates):
+            progress((i_d + 1) / n_dates, f"Data {np.datetime64(int(inp['day'][i_d]), 'D')}")
+            rows_mb += multidate_block(inp, cols, i_d, i_d + 1, mb_tickers, mb_bm, mb_fw)
+    else:
+        chunk   = max(1, -(-n_dates // (n_proc * 4)))
+        bounds  = [(i, min(i + chunk, n_dates)) for i in range(0, n_dates, chunk)]
+        shm, meta = share_arrays(inp)
+        futures = []
+        try:
+            futures = [procs.submit(multidate_block_shared, meta, cols, lo, hi, mb_tickers, mb_bm, mb_fw)
+                       for lo, hi in bounds]
+            done = 0
+            for _ in as_completed(futures):
+                done += 1
+                progress(done / len(futures), f"Blocchi date {done}/{len(futures)} · {n_proc} processi")
+            rows_mb = [r for fut in futures for r in fut.result()]
+        finally:
+            for fut in futures:
+                fut.cancel()
+            wait(futures)
+            shm.close()
+            shm.unlink()
+
+    if not rows_mb:
+        out["error"] = "Nessun dato calcolato."
+        return out
+
+    mb_df = pd.DataFrame(rows_mb)
+    mb_df["Pct MMS6M RSr"] = mb_df.groupby("Data")["MMS6M RSr"].rank(pct=True) * 100
+    # Δ Rank condizionato a MAC positivo, calcolato per singola data (stessa logica di Tab 5/6)
+    mb_df["Δ Rank"] = (mb_df["_S_minus_M"].where(mb_df["MAC"] > 0)
+                        .groupby(mb_df["Data"]).rank(ascending=False, method="min"))
+    out["mb_df"] = mb_df
+
+    progress(1.0, "Archiviazione osservazioni...")
     try:
-        tk_s = bt_close[ticker].dropna()
-        end_idx   = tk_s.index.searchsorted(actual_ref)
-        start_idx = max(0, end_idx - periodo_giorni)
-        tk_win = tk_s.iloc[start_idx:end_idx]
-        if len(tk_win) < 10: return np.nan
-        rolling_max = tk_win.expanding().max()
-        drawdown = (tk_win - rolling_max) / rolling_max
-        return float(drawdown.min())
-    except: return np.nan
+        store_observations(run_key, params, mb_df)
+    except Exception as e:
+        out["warnings"].append(f"Archivio osservazioni non aggiornato: {e}")
+    return out
+
+
+# ========================
+# PANNELLI INDICATORI IN CACHE (per processo)
+# ========================
+# Close + pannelli data × ticker di un universo, calcolati una volta e riusati da
+# IC, simulatore e walk-forward: ogni variante/fold costa solo il proprio calcolo.
+PANEL_CACHE_SIZE = 4
+
+
+@st.cache_resource
+def _panel_store():
+    return {"lock": threading.Lock(), "data": {}}
+
+
+def cached_panels(store, tickers, benchmark, start):
+    """Dict close / panels / missing per (ticker, benchmark, inizio download); store = _panel_store()."""
+    key   = job_key("panels", {"tickers": list(tickers), "benchmark": benchmark, "start": str(start)})
+    with store["lock"]:
+        hit = store["data"].pop(key, None)
+        if hit is not None:
+            store["data"][key] = hit          # LRU: in coda = usato di recente
+            return hit
+    close = _download_close(list(tickers) + [benchmark], pd.Timestamp(start))
+    if benchmark not in close.columns:
+        raise ValueError(f"Benchmark {benchmark} non disponibile.")
+    panels = indicator_panels(close, tickers, benchmark)
+    panels["Operatività"] = operativita_panel(close, tickers, benchmark, WEIGHTS)
+    entry = {"close": close, "panels": panels,
+             "missing": [t for t in tickers if t not in close.columns]}
+    with store["lock"]:
+        store["data"][key] = entry
+        while len(store["data"]) > PANEL_CACHE_SIZE:
+            store["data"].pop(next(iter(store["data"])))
+    return entry
+
+
+IC_HORIZONS = {"1W": 5, "1M": 21, "3M": 63, "6M": 126}
+IC_WINDOW   = 126
+
+
+def run_ic_analysis(params, progress, panel_store):
+    """
+    Tab 8 — Information Coefficient degli indicatori di ranking.
+    params: tickers, benchmark, start, end. Pannelli data × ticker, nessun loop per data.
+    """
+    tickers, bm = params["tickers"], params["benchmark"]
+    out = {"warnings": [], "error": None}
+    progress(0.0, "Download prezzi e pannelli indicatori...")
+    try:
+        data = cached_panels(panel_store, tickers, bm, (pd.Timestamp(params["start"]) - timedelta(days=365)).date())
+    except Exception as e:
+        out["error"] = f"Errore download: {e}"
+        return out
+    if data["missing"]:
+        out["warnings"].append(f"Ticker senza dati: {', '.join(data['missing'])}")
+
+    close  = data["close"]
+    panels = {k: data["panels"][k].loc[params["start"]:params["end"]] for k in IC_INDICATORS}
+    progress(0.5, "IC di Spearman per orizzonte...")
+    ft  = forward_tensor(close, max(IC_HORIZONS.values()),
+                         dates=close.loc[params["start"]:params["end"]].index)
+    fwd = {h: fw_excess(ft, tickers, bm, d) for h, d in IC_HORIZONS.items()}
+    out.update(ic_engine(panels, fwd, window=IC_WINDOW))
+    return out
+
+
+SIM_SIGNALS = ["MMS6M RSr", "Δ Rank", "MAC", "Operatività"]
+SIM_RULES   = {"Top 1": ("top", 1), "Top 2": ("top", 2), "Top 3": ("top", 3),
+               "Top 5": ("top", 5), "Soglia > 0": ("soglia", 0.0)}
+
+
+def sim_signal(panels, name):
+    """Pannello segnale (più alto = migliore) per il simulatore."""
+    if name == "Δ Rank":       # Δ Rank 1 = S−M più alto tra i settori con MAC > 0
+        return panels["S minus M"].where(panels["MAC"] > 0)
+    return panels[name]
+
+
+def run_rotation_sim(params, progress, panel_store):
+    """
+    Tab 6 — simulatore rotazione: ogni combinazione segnale × regola × ribilanciamento.
+    params: tickers, benchmark, start, signals, rules, rebalance, cost_bps.
+    """
+    tickers, bm = params["tickers"], params["benchmark"]
+    out = {"warnings": [], "error": None}
+    progress(0.0, "Download prezzi e pannelli indicatori...")
+    try:
+        # ~1 anno di storico in più: i segnali a 6M devono essere già validi all'inizio
+        data = cached_panels(panel_store, tickers, bm, (pd.Timestamp(params["start"]) - timedelta(days=365)).date())
+    except Exception as e:
+        out["error"] = f"Errore download: {e}"
+        return out
+    if data["missing"]:
+        out["warnings"].append(f"Ticker senza dati: {', '.join(data['missing'])}")
+
+    close = data["close"].loc[params["start"]:]
+    tks   = [t for t in tickers if t in close.columns]
+    variants = [(sg, rl, rb) for sg in params["signals"] for rl in params["rules"] for rb in params["rebalance"]]
+    stats, equity, dd = [], {}, {}
+    for i_v, (sg, rl, rb) in enumerate(variants):
+        progress(0.2 + 0.8 * i_v / len(variants), f"Variante {i_v + 1}/{len(variants)}")
+        rule, arg = SIM_RULES[rl]
+        target = select_weights(sim_signal(data["panels"], sg).loc[params["start"]:, tks], rule,
+                                n=arg, threshold=arg)
+        sim  = simulate_rotation(close[tks], target, rebalance=rb, cost_bps=params["cost_bps"])
+        name = f"{sg} · {rl} · {rb}gg"
+        stats.append({"Variante": name, "Segnale": sg, "Regola": rl, "Ribil. (gg)": rb, **sim_stats(sim)})
+        equity[name], dd[name] = sim["Equity"], sim["Drawdown"]
+
+    bm_eq = close[bm].ffill() / close[bm].dropna().iloc[0]
+    bm_sim = pd.DataFrame({"Rend": bm_eq.pct_change().fillna(0.0), "Equity": bm_eq,
+                           "Drawdown": bm_eq / bm_eq.cummax() - 1, "Turnover": 0.0})
+    stats.append({"Variante": f"Benchmark {bm}", "Segnale": "—", "Regola": "Buy & hold",
+                  "Ribil. (gg)": 0, **sim_stats(bm_sim)})
+    equity[f"Benchmark {bm}"] = bm_eq
+    out.update({"stats": pd.DataFrame(stats).sort_values("Sharpe", ascending=False),
+                "equity": pd.DataFrame(equity), "drawdown": pd.DataFrame(dd)})
+    return out
+
+
+def run_walk_forward(params, progress, panel_store):
+    """
+    Tab 8 — walk-forward delle soglie (ROS ±1.5, banda MAC 0.15, fascia 60–80°).
+    params: tickers, benchmark, start, train, test, fw. Soglia ROS sui settori USA,
+    MAC e fascia quintile sull'universo di Tab 8: ogni soglia usa fold costruiti
+    sulle sedute del proprio pannello (calendari USA ed europeo diversi).
+    VOL_SCORE_MAP non è incluso: non esiste uno storico delle etichette volume.
+    """
+    fw_d = BT_FW_DAYS[params["fw"]]
+    dl   = (pd.Timestamp(params["start"]) - timedelta(days=365)).date()
+    out  = {"warnings": [], "error": None}
+    progress(0.0, "Pannelli indicatori (cache)...")
+    try:
+        us = cached_panels(panel_store, SECTORS, BENCHMARK, dl)
+        eu = cached_panels(panel_store, params["tickers"], params["benchmark"], dl)
+    except Exception as e:
+        out["error"] = f"Errore download: {e}"
+        return out
+    if eu["missing"]:
+        out["warnings"].append(f"Ticker senza dati: {', '.join(eu['missing'])}")
+
+    # Soglia ROS: regime su ROS v2 (senza moltiplicatore volume) vs spread forward ciclici − difensivi
+    close_us = us["close"]
+    ros      = compute_rotation_score_series_v2(close_us).loc[params["start"]:]
+    ft_us    = forward_tensor(close_us, fw_d, dates=ros.index)
+    fw_us    = fw_panel(ft_us, fw_d)
+    spread   = (fw_us[[t for t in CYCLICAL if t in fw_us]].mean(axis=1)
+                - fw_us[[t for t in DEFENSIVE if t in fw_us]].mean(axis=1))
+
+    # MAC e fascia quintile: pannelli cross-sectional vs Delta BM forward
+    tks   = [t for t in params["tickers"] if t in eu["close"].columns]
+    pn    = {k: eu["panels"][k].loc[params["start"]:, tks] for k in ("MAC", "MMS6M RSr")}
+    ft_eu = forward_tensor(eu["close"], fw_d, dates=pn["MAC"].index)
+    y_eu  = fw_excess(ft_eu, tks, params["benchmark"], fw_d).to_numpy()
+    calendars = {"USA": ros.index, "Tab 8": pn["MAC"].index}
+    data  = {"Soglia regime ROS":     (ros.to_numpy(), spread.to_numpy(), "USA"),
+             "Banda MAC forte":       (pn["MAC"].to_numpy(), y_eu, "Tab 8"),
+             "Fascia quintile MMS6M": (pn["MMS6M RSr"].rank(axis=1, pct=True).to_numpy() * 100, y_eu,
+                                       "Tab 8")}
+
+    # Fold sulle sedute di ciascun calendario, appaiati per posizione
+    # (stesse lunghezze train/test in sedute: al più l'ultimo fold manca su uno dei due)
+    cal_folds = {c: walk_forward_folds(ix, params["train"], params["test"], purge=fw_d)
+                 for c, ix in calendars.items()}
+    folds = [dict(zip(cal_folds, f)) for f in zip(*cal_folds.values())]
+    if not folds:
+        out["error"] = "Storico insufficiente per almeno un fold: riduci training/test o anticipa l'inizio."
+        return out
+    rows = []
+    for i_f, f in enumerate(folds):
+        progress(0.2 + 0.8 * i_f / len(folds), f"Fold {i_f + 1}/{len(folds)}")
+        rows.append(wf_fold(f, calendars, data))
+    wf = pd.DataFrame(rows)
+
+    summary = []
+    for name, spec in WF_TARGETS.items():
+        fit, oos_fit, oos_fix = wf[name], wf[f"{name} OOS fit"], wf[f"{name} OOS fissa"]
+        both = oos_fit.notna() & oos_fix.notna()
+        summary.append({"Soglia": name, "Valore fisso": spec["fixed"],
+                        "Fit medio": fit.mean(), "Fit min": fit.min(), "Fit max": fit.max(),
+                        "OOS fit": oos_fit.mean(), "OOS fissa": oos_fix.mean(),
+                        "% fold fit > fissa": (oos_fit[both] > oos_fix[both]).mean() if both.any() else np.nan})
+    out.update({"folds": wf, "summary": pd.DataFrame(summary)})
+    return out
+
+
+# ========================
+# ANALOGHI STORICI (Tab 7)
+# ========================
+# Indice kNN sul vettore di stato giornaliero tenuto per processo, con chiave
+# la versione del pannello prezzi: ricostruito solo quando il pannello cambia
+# (nuove sedute o prezzi storici rivisti), riusato negli altri rerun.
+ANALOG_FW = (20, 40)          # stessi orizzonti di spy_perf_20/40 degli episodi
+EP_CONFIRM_DAYS = 5           # conferma anti-whipsaw del dataset backtest_patterns.json
+
+
+def load_pattern_defs():
+    """Definizioni dei pattern A/B/C/D da backtest_patterns.json ({} se assente)."""
+    try:
+        with open("backtest_patterns.json", "r", encoding="utf-8") as f:
+            return json.load(f).get("pattern", {})
+    except (OSError, ValueError):
+        return {}
+
+
+def pattern_backtest(labels, prices, risk_off):
+    """Per pattern: giorni (totali / in Risk Off) e rendimenti forward SPY medi."""
+    ft  = forward_tensor(prices[[BENCHMARK]], max(ANALOG_FW), dates=labels.index)
+    fwd = {h: fw_panel(ft, h, [BENCHMARK])[BENCHMARK] * 100 for h in ANALOG_FW}
+    rows = []
+    for pid in sorted(labels.unique(), key=lambda p: (p == PATTERN_NONE, p)):
+        m = (labels == pid).to_numpy()
+        row = {"Pattern": pid, "Giorni": int(m.sum()), "di cui Risk Off": int((m & risk_off).sum())}
+        for h in ANALOG_FW:
+            r = fwd[h][m].dropna()
+            row[f"SPY +{h}gg medio %"] = r.mean() if not r.empty else np.nan
+            row[f"% positivi +{h}gg"]  = (r > 0).mean() * 100 if not r.empty else np.nan
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+@st.cache_resource
+def _analog_store():
+    return {"lock": threading.Lock(), "version": None, "index": None}
+
+
+def analog_state_index(version, prices, ros, band, band_deriv):
+    """Indice analoghi della versione `version` del pannello `prices`."""
+    store = _analog_store()
+    with store["lock"]:
+        if store["index"] is None or store["version"] != version:
+            feats = analog_features(prices, BENCHMARK, CYCLICAL, DEFENSIVE, ros, band, band_deriv)
+            store["index"], store["version"] = analog_index(feats), version
+        return store["index"]
+
+
+def find_analogs(index, prices, k=10):
+    """Tabella dei k analoghi dell'ultima seduta con i rendimenti forward SPY."""
+    pos, dist = analog_search(index, k=k)
+    dates = index["dates"][pos]
+    ft    = forward_tensor(prices[[BENCHMARK]], max(ANALOG_FW), dates=dates)
+    out   = pd.DataFrame(index["X"][pos], index=dates, columns=ANALOG_FEATURES)
+    out.insert(0, "Distanza", dist)
+    for h in ANALOG_FW:
+        out[f"SPY +{h}gg %"] = fw_panel(ft, h, [BENCHMARK])[BENCHMARK].to_numpy() * 100
+    out.index.name = "Data"
+    return out
+
+
+# ========================
+# EPISODI RISK OFF PER SETTORE (Tab 3)
+# ========================
+def sector_risk_off(close, tickers, benchmark, confirm_days=3):
+    """
+    Episodi Risk Off relativi di ogni settore vs benchmark: forza relativa pesata
+    come il ROS v2, soglia mobile per colonna e per data (0.75 × std a 252 sedute
+    nota a quella data: nessun episodio passato giudicato con la soglia di oggi).
+    Ritorna (pannello RS, soglie data × settore, DataFrame episodi).
+    """
+    panel = relative_strength_panel(close, tickers, benchmark, WEIGHTS_V2)
+    # Stessa finestra/moltiplicatore di compute_adaptive_threshold, per colonna:
+    # il dropna per riga di quell'helper svuoterebbe il frame con un settore tutto NaN
+    thr   = panel.dropna(axis=1, how="all").ffill().rolling(252, min_periods=63).std().mul(0.75)
+    eps   = pd.DataFrame(risk_off_episodes_panel(panel, thr, confirm_days=confirm_days),
+                         columns=["ticker", "start", "confirmed", "end", "open",
+                                  "duration", "rs_min", "rs_min_date"])
+    return panel, thr, eps
+
+
+# ========================
+# CACHE SUI PANNELLI CONDIVISI (Tab 2 / Tab 5)
+# ========================
+# Le analisi su tutto lo storico sono in cache_resource con chiave (pannello,
+# versione mappata, ticker, benchmark): nessun hash del DataFrame a ogni rerun
+# e un solo risultato per processo, condiviso in sola lettura tra le sessioni.
+# Il pannello è riletto dentro la funzione dal loader condiviso.
+ANALYSIS_CACHE = 8
+
+
+def source_panel(source):
+    """Pannello close condiviso: "us" (settori SPDR + SPY) o "euro" (Eurostoxx)."""
+    return load_prices(ALL_TICKERS) if source == "us" else load_euro_prices()
+
+
+def source_version(source):
+    """Versione del pannello mappato (hash del contenuto se non mappato da disco)."""
+    close = source_panel(source)
+    ver   = close.attrs.get("panel_version")
+    return ver if ver else str(pd.util.hash_pandas_object(close).sum())
+
+
+def source_close(source, tickers, benchmark):
+    """Colonne disponibili di tickers + benchmark dal pannello condiviso."""
+    close = source_panel(source)
+    return close[[t for t in dict.fromkeys(list(tickers) + [benchmark]) if t in close.columns]]
+
+
+# ========================
+# STORICO DISPERSIONE (Tab 5)
+# ========================
+SKEW_COLORS = {name: color for _, name, color in SKEW_LABELS}
+DISP_FW     = 21     # orizzonte forward (sedute) per misurare l'utilità dell'etichetta
+
+
+@st.cache_resource(ttl=3600, max_entries=ANALYSIS_CACHE)
+def dispersion_study(source, version, tickers, benchmark, fw=DISP_FW):
+    """
+    Storico skew/std/spread del MMS6M RSr (pannello indicatori) con, per ogni data,
+    IC forward del MMS6M RSr, spread top 3 − bottom 3 e dispersione dei rendimenti
+    in eccesso a `fw` sedute. Ritorna (storico, sintesi per etichetta).
+    """
+    close = source_close(source, tickers, benchmark)
+    panel = indicator_panels(close, tickers, benchmark)["MMS6M RSr"]
+    hist  = dispersion_history(panel)
+    hist["Etichetta"] = skew_label(hist["skew"])
+    fwd   = fw_excess(forward_tensor(close, fw), list(panel.columns), benchmark, fw) * 100
+    rank  = panel.rank(axis=1, ascending=False)
+    n     = panel.notna().sum(axis=1)
+    hist["IC fwd"]         = rank_ic(panel, fwd)
+    hist["Top−Bottom fwd"] = fwd.where(rank <= 3).mean(axis=1) - fwd.where(rank.gt(n - 3, axis=0)).mean(axis=1)
+    hist["Disp. fwd"]      = fwd.where(panel.notna()).std(axis=1)
+    valid = hist.dropna(subset=["Etichetta", "IC fwd"])
+    summary = (valid.groupby("Etichetta")
+                    .agg(**{"Giorni": ("skew", "size"), "IC fwd medio": ("IC fwd", "mean"),
+                            "Top−Bottom fwd %": ("Top−Bottom fwd", "mean"),
+                            "Disp. fwd %": ("Disp. fwd", "mean")})
+                    .reindex([name for _, name, _ in SKEW_LABELS]).dropna(how="all").reset_index())
+    return hist, summary
+
+
+# ========================
+# RELATIVE ROTATION GRAPH (Tab 5)
+# ========================
+@st.cache_resource(ttl=3600, max_entries=ANALYSIS_CACHE)
+def rrg_data(source, version, tickers, benchmark):
+    """Coordinate RRG di tutti i settori su tutte le date (lo slider taglia solo gli array)."""
+    return rrg_panels(source_close(source, tickers, benchmark), tickers, benchmark)
+
+
+# ========================
+# HEATMAP FORZA RELATIVA (Tab 2)
+# ========================
+HEATMAP_INDICATORS = ["RSr 1W", "RSr 1M", "RSr 3M", "RSr 6M", "MMS6M RSr"]
+HEATMAP_PERIODS    = {"6M": 126, "1A": 252, "2A": 504, "3A": 756, "5A": 1260}
+
+
+@st.cache_resource(ttl=3600, max_entries=ANALYSIS_CACHE)
+def heatmap_panels(source, version, tickers, benchmark):
+    """
+    Pannelli RSr data × settore per la heatmap, giornalieri ("1g") e settimanali
+    ("1s", ultimo valore della settimana): orizzonte e risoluzione sono solo lookup.
+    """
+    p     = indicator_panels(source_close(source, tickers, benchmark), tickers, benchmark)
+    daily = {k: p[k] for k in HEATMAP_INDICATORS}
+    return {"1g": daily, "1s": {k: v.resample("W-FRI").last().dropna(how="all") for k, v in daily.items()}}
+
+
+# ========================
+# PERCENTILI STORICI (Tab 5 / Tab 6)
+# ========================
+@st.cache_resource(ttl=3600, max_entries=ANALYSIS_CACHE)
+def latest_percentiles(source, version, tickers, benchmark):
+    """Percentile mobile dell'ultima data per ticker × indicatore (colonne '<ind> %ile')."""
+    pct = percentile_latest(table_panels(source_close(source, tickers, benchmark), tickers, benchmark))
+    return pd.DataFrame({f"{k} %ile": v for k, v in pct.items()})
+
+
+def style_percentile(v):
+    """Scala colori dei percentili: code della distribuzione storica evidenziate."""
+    try:
+        v = float(v)
+        if np.isnan(v): return "color:#444"
+        if v >= 80: return "background-color:#0d2b0d;color:#00ff55;font-weight:bold"
+        if v >= 60: return "color:#88cc88"
+        if v <= 20: return "background-color:#2b0d0d;color:#ff4422;font-weight:bold"
+        if v <= 40: return "color:#cc6644"
+    except Exception: pass
+    return "color:#888"
+
+
+# ========================
+# JOB RUNNER — backtest in background con risultati persistiti
+# ========================
+# I backtest girano su un pool di worker condiviso dal processo Streamlit: il
+# rerun non aspetta il calcolo e i widget restano utilizzabili. Ogni job è
+# identificato dall'hash dei parametri, dell'ultima seduta disponibile e della
+# versione dello schema dei risultati; il risultato è salvato in JOB_STORE_DIR e
+# riletto ai rerun successivi (stessi parametri e stessi dati = nessun ricalcolo).
+# Una nuova seduta completa finestre forward prima incomplete (NaN) e cambia la
+# chiave; JOB_SCHEMA va incrementato a ogni modifica della logica o delle colonne
+# dei risultati. I pickle più vecchi di JOB_STORE_DAYS vengono eliminati.
+# In memoria restano solo gli ultimi JOB_RESULTS_CACHE risultati letti (LRU, il
+# resto si rilegge dal pickle) e gli ultimi JOB_HISTORY job falliti o annullati;
+# un job completato esce dal registro appena il suo pickle è scritto.
+JOB_STORE_DIR     = os.environ.get("MONITOR_JOB_DIR", os.path.join(".cache", "jobs"))
+JOB_WORKERS       = int(os.environ.get("MONITOR_JOB_WORKERS", "2"))
+JOB_STORE_DAYS    = int(os.environ.get("MONITOR_JOB_DAYS", "14"))
+JOB_SCHEMA        = 3
+JOB_RESULTS_CACHE = 4
+JOB_HISTORY       = 16
+
+
+class JobCancelled(Exception):
+    pass
+
+
+@st.cache_resource
+def _job_pool():
+    """Executor e registro dei job, unici per processo (condivisi tra sessioni)."""
+    os.makedirs(JOB_STORE_DIR, exist_ok=True)
+    cutoff = time.time() - JOB_STORE_DAYS * 86400
+    for name in os.listdir(JOB_STORE_DIR):
+        path = os.path.join(JOB_STORE_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+    return {"executor": ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="monitor-job"),
+            "jobs": {}, "results": {}, "lock": threading.RLock()}
+
+
+def job_key(kind, params):
+    blob = json.dumps(params, sort_keys=True, default=str).encode("utf-8")
+    return f"{kind}-{hashlib.sha1(blob).hexdigest()[:16]}"
+
+
+def result_key(kind, params):
+    """Chiave dei risultati persistiti: parametri + ultima seduta dei prezzi + JOB_SCHEMA."""
+    return job_key(kind, {**params, "_asof": DATA_ASOF, "_schema": JOB_SCHEMA})
+
+
+def _job_path(key):
+    return os.path.join(JOB_STORE_DIR, f"{key}.pkl")
+
+
+def _run_job(pool, key, job, fn, kwargs):
+    def progress(frac, msg=""):
+        if job["cancel"].is_set():
+            raise JobCancelled()
+        job["progress"], job["message"] = float(min(max(frac, 0.0), 1.0)), msg
+    try:
+        result = fn(job["params"], progress, **kwargs)
+    except JobCancelled:
+        job["state"] = "cancelled"
+        return
+    except Exception as e:
+        job["state"], job["error"] = "error", f"{type(e).__name__}: {e}"
+        return
+    if result.get("error"):
+        # Errori (download, benchmark mancante...) non vengono persistiti: il job è ripetibile
+        job["state"], job["error"] = "error", result["error"]
+        return
+    tmp = _job_path(key) + ".tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, _job_path(key))
+    with pool["lock"]:
+        _remember_result(pool, key, result)
+        job["state"] = "done"
+        pool["jobs"].pop(key, None)
+
+
+def submit_job(kind, params, fn, **kwargs):
+    """
+    Accoda il job se non è già in corso o già calcolato. Ritorna la chiave.
+    kwargs: argomenti extra di fn, fuori dalla chiave — tra questi le risorse
+    di processo (st.cache_resource) create qui, nel thread dello script: i
+    worker non hanno ScriptRunContext e non chiamano funzioni st.*.
+    """
+    key  = result_key(kind, params)
+    pool = _job_pool()
+    with pool["lock"]:
+        job = pool["jobs"].get(key)
+        if (job and job["state"] == "running") or job_result(key) is not None:
+            return key
+        job = {"kind": kind, "params": params, "state": "running", "progress": 0.0,
+               "message": "In coda...", "error": None, "cancel": threading.Event()}
+        pool["jobs"].pop(key, None)
+        pool["jobs"][key] = job
+        ended = [k for k, j in pool["jobs"].items() if j["state"] != "running"]
+        for k in ended[:max(0, len(ended) - JOB_HISTORY)]:
+            del pool["jobs"][k]
+        pool["executor"].submit(_run_job, pool, key, job, fn, kwargs)
+    return key
+
+
+def _remember_result(pool, key, result):
+    # LRU: in coda = usato di recente (chiamata con pool["lock"] acquisito)
+    pool["results"].pop(key, None)
+    pool["results"][key] = result
+    while len(pool["results"]) > JOB_RESULTS_CACHE:
+        pool["results"].pop(next(iter(pool["results"])))
+
+
+def job_result(key):
+    """Risultato persistito del job, o None se non ancora calcolato."""
+    pool = _job_pool()
+    with pool["lock"]:
+        result = pool["results"].get(key)
+        if result is not None:
+            _remember_result(pool, key, result)
+            return result
+    try:
+        with open(_job_path(key), "rb") as f:
+            result = pickle.load(f)
+    except Exception:          # assente (non calcolato) o illeggibile
+        return None
+    with pool["lock"]:
+        _remember_result(pool, key, result)
+    return result
+
+
+def job_state(key):
+    return _job_pool()["jobs"].get(key)
+
+
+def cancel_job(key):
+    job = _job_pool()["jobs"].get(key)
+    if job is not None:
+        job["cancel"].set()
+
+
+def render_job(key):
+    """
+    Stato del job in UI. Ritorna il risultato se disponibile, altrimenti None.
+    Finché il job è in corso un fragment mostra avanzamento e pulsante Annulla,
+    e al termine fa rerun dell'app per mostrare i risultati.
+    """
+    result = job_result(key)
+    if result is not None:
+        return result
+    job = job_state(key)
+    if job is None:
+        return None
+    if job["state"] == "error":
+        st.error(job["error"])
+        return None
+    if job["state"] == "cancelled":
+        st.info("Backtest annullato.")
+        return None
+
+    @st.fragment(run_every=1.0)
+    def _job_progress():
+        if job["state"] != "running":
+            st.rerun()
+        c_bar, c_btn = st.columns([5, 1])
+        c_bar.progress(job["progress"], text=job["message"])
+        if c_btn.button("Annulla", key=f"cancel_{key}"):
+            cancel_job(key)
+    _job_progress()
+    return None
+
+
+# ========================
+# ARCHIVIO OSSERVAZIONI — backtest multi-data su SQLite
+# ========================
+# Ogni run di Tab 8 accoda le sue osservazioni (data × ticker) in un database
+# SQLite locale. Le tabelle per quintile e gli incroci diventano query GROUP BY
+# sull'archivio accumulato, senza rifare il backtest.
+# Chiave osservazione: universo (ticker + benchmark), forward, data, ticker —
+# run sovrapposte sullo stesso universo non duplicano righe.
+OBS_DB_PATH = os.environ.get("MONITOR_OBS_DB", os.path.join(".cache", "observations.sqlite"))
+
+# colonna mb_df → colonna SQL
+OBS_COLUMNS = {
+    "RSI BM": "rsi_bm", "MMS6M RSr": "mms6m_rsr", "Pct MMS6M RSr": "pct_mms6m",
+    "MAC": "mac", "MMS6M React.": "mms6m_react", "Δ React.": "d_react",
+    "Tact. Thrust": "tt", "Mr Index": "mr", "MME": "mme", "GTE": "gte",
+    "RSr Slope": "rsr_slope", "_S_minus_M": "s_minus_m", "Δ Rank": "d_rank",
+}
+
+
+def _factor_sql(factor):
+    """Codice fascia del fattore (FACTOR_BUCKETS) come espressione CASE SQLite."""
+    col, buckets = FACTOR_BUCKETS[factor]
+    col = OBS_COLUMNS[col]
+    whens = " ".join(f"WHEN {col} {op} {thr!r} THEN {i}"
+                     for i, (_, op, thr) in enumerate(buckets[:-1]))
+    return f"CASE {whens} ELSE {len(buckets) - 1} END", col
+
+
+def _obs_connect():
+    os.makedirs(os.path.dirname(OBS_DB_PATH) or ".", exist_ok=True)
+    con = sqlite3.connect(OBS_DB_PATH, timeout=30)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    cols = ", ".join(f"{c} REAL" for c in OBS_COLUMNS.values())
+    con.executescript(f"""
+        CREATE TABLE IF NOT EXISTS obs (
+            universe TEXT NOT NULL, benchmark TEXT NOT NULL, fw TEXT NOT NULL,
+            data TEXT NOT NULL, ticker TEXT NOT NULL, {cols},
+            rend REAL, delta_bm REAL,
+            PRIMARY KEY (universe, fw, data, ticker)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS obs_fw ON obs (fw, benchmark);
+        CREATE TABLE IF NOT EXISTS run_dates (
+            run_key TEXT NOT NULL, universe TEXT NOT NULL, fw TEXT NOT NULL, data TEXT NOT NULL,
+            PRIMARY KEY (run_key, data)
+        ) WITHOUT ROWID;
+    """)
+    return con
+
+
+def obs_universe(tickers, benchmark):
+    """Identificativo dell'universo: i percentili MMS6M dipendono dall'insieme di ticker."""
+    return job_key("universe", {"tickers": sorted(tickers), "benchmark": benchmark})
+
+
+def store_observations(run_key, params, mb_df):
+    """Accoda (o aggiorna) le osservazioni di una run multi-data."""
+    fw, bm   = params["fw"], params["benchmark"]
+    universe = obs_universe(params["tickers"], bm)
+    src      = ["Data", "Ticker"] + list(OBS_COLUMNS) + [f"Rend +{fw}", f"Delta BM +{fw}"]
+    vals     = mb_df.reindex(columns=src).astype(object)
+    vals     = vals.where(pd.notna(vals), None)
+    rows     = [(universe, bm, fw) + tuple(r) for r in vals.itertuples(index=False, name=None)]
+    sql_cols = ["universe", "benchmark", "fw", "data", "ticker"] + list(OBS_COLUMNS.values()) + ["rend", "delta_bm"]
+    con = _obs_connect()
+    try:
+        with con:
+            con.executemany(
+                f"INSERT OR REPLACE INTO obs ({', '.join(sql_cols)}) "
+                f"VALUES ({', '.join('?' * len(sql_cols))})", rows)
+            con.execute("DELETE FROM run_dates WHERE run_key = ?", (run_key,))
+            con.executemany(
+                "INSERT OR IGNORE INTO run_dates VALUES (?, ?, ?, ?)",
+                [(run_key, universe, fw, d) for d in mb_df["Data"].unique()])
+    finally:
+        con.close()
+
+
+def obs_has_run(run_key):
+    con = _obs_connect()
+    try:
+        return con.execute("SELECT 1 FROM run_dates WHERE run_key = ? LIMIT 1", (run_key,)).fetchone() is not None
+    finally:
+        con.close()
+
+
+def obs_breakdown(fw, factors=("Quintile",), run_key=None, universe=None, n_boot=0, block=1):
+    """
+    Cubo alpha condizionato (stesso output di conditional_alpha_cube) calcolato
+    in SQL sull'archivio. Filtro: singola run, singolo universo, o tutto
+    l'archivio con lo stesso forward. Con n_boot > 0 aggrega anche per data
+    e aggiunge IC/p-value da block bootstrap.
+    """
+    factors = list(factors)
+    where, args = ["o.fw = ?", "o.rend IS NOT NULL"], [fw]
+    keys = []
+    for j, f in enumerate(factors):
+        expr, col = _factor_sql(f)
+        where.append(f"o.{col} IS NOT NULL")
+        keys.append(f"{expr} AS c{j}")
+    if universe is not None:
+        where.append("o.universe = ?")
+        args.append(universe)
+    join = ""
+    if run_key is not None:
+        join = "JOIN run_dates r ON r.universe = o.universe AND r.fw = o.fw AND r.data = o.data"
+        where.append("r.run_key = ?")
+        args.append(run_key)
+    group = [f"c{j}" for j in range(len(factors))] + (["o.data"] if n_boot else [])
+    sql = (f"SELECT {', '.join(keys + ['o.data' if n_boot else '0'])}, COUNT(*), COUNT(delta_bm), "
+           f"SUM(rend), TOTAL(delta_bm), SUM(rend > 0) "
+           f"FROM obs o {join} WHERE {' AND '.join(where)} GROUP BY {', '.join(group)}")
+    con = _obs_connect()
+    try:
+        rows = con.execute(sql, args).fetchall()
+    finally:
+        con.close()
+    k     = len(factors)
+    shape = [len(FACTOR_BUCKETS[f][1]) for f in factors]
+    size  = int(np.prod(shape))
+    codes = np.array([r[:k] for r in rows], dtype=np.int64).reshape(-1, k)
+    vals  = np.array([r[k + 1:] for r in rows], dtype=np.float64).reshape(-1, 5)
+    dates, uniq = pd.factorize(np.array([r[k] for r in rows], dtype=object), sort=True)
+    key   = dates * size + np.ravel_multi_index(codes.T, shape)
+    stats = np.stack([np.bincount(key, weights=vals[:, j], minlength=len(uniq) * size)
+                      for j in range(5)]).reshape(5, len(uniq), size)
+    tot   = stats.sum(axis=1)
+    boot  = bootstrap_cube(stats, n_boot, block) if n_boot and len(uniq) > 1 else None
+    return cube_frame(factors, tot[:2], tot[2:], boot)
+
+
+def obs_summary(fw=None):
+    """Dimensione dell'archivio: osservazioni, date, universi (opzionale: per forward)."""
+    con = _obs_connect()
+    try:
+        sql = "SELECT COUNT(*), COUNT(DISTINCT data), COUNT(DISTINCT universe) FROM obs"
+        row = con.execute(sql + (" WHERE fw = ?" if fw else ""), (fw,) if fw else ()).fetchone()
+    finally:
+        con.close()
+    return {"n": row[0], "dates": row[1], "universes": row[2]}
+
+
 # ========================
 # LOAD SECTORAL DATA
 # ========================
+_profile_mark("load")
 prices       = load_prices(ALL_TICKERS)          # storico lungo, TTL 1h
+DATA_ASOF    = str(prices.index[-1].date()) if len(prices) else ""  # ultima seduta, nelle chiavi dei job
 prices_today = load_prices_today(ALL_TICKERS)    # ultimi 7gg, TTL 5min — per 1D fresco
+macro_prices = load_prices(MACRO_TICKERS)         # VIX, MOVE, IEF/SHY per i pattern episodi
 ohlcv_long   = load_ohlcv_long(tuple(ALL_TICKERS))
 ohlcv        = ohlcv_long                        # usato da VWDS (90gg sufficienti, inclusi in 2A)
 
 # Il calcolo 1D usa prices_today (fresco). 1W/1M/3M/6M usano prices (storico lungo).
+prices_ap       = aligned_panel(prices)
+prices_today_ap = aligned_panel(prices_today)
 returns = pd.DataFrame({
-    "1D": prices_today.apply(lambda x: ret(x, 1)),
-    "1W": prices.apply(lambda x: ret(x, 5)),
-    "1M": prices.apply(lambda x: ret(x, 21)),
-    "3M": prices.apply(lambda x: ret(x, 63)),
-    "6M": prices.apply(lambda x: ret(x, 126)),
+    "1D": ret(prices_today_ap, 1),
+    "1W": ret(prices_ap, 5),
+    "1M": ret(prices_ap, 21),
+    "3M": ret(prices_ap, 63),
+    "6M": ret(prices_ap, 126),
 })
 
 rsr_df = pd.DataFrame(index=returns.index, columns=returns.columns)
@@ -819,14 +2131,14 @@ df["Vol Signal"] = df.index.map(vol_plain)
 # OBV FLOW REGIME
 # ========================
 obv_regime     = {}
-_obv_available = list(ohlcv_long["Close"].columns) if isinstance(ohlcv_long.columns, pd.MultiIndex) else [BENCHMARK]
+_obv_available = ohlcv_tickers(ohlcv_long) or [BENCHMARK]
 for ticker in SECTORS + [BENCHMARK]:
     if ticker not in _obv_available:
         obv_regime[ticker] = "N/D"
         continue
     try:
-        cl = ohlcv_long["Close"][ticker].dropna()
-        vo = ohlcv_long["Volume"][ticker].dropna()
+        cl = ohlcv_series(ohlcv_long, "Close", ticker).dropna()
+        vo = ohlcv_series(ohlcv_long, "Volume", ticker).dropna()
         obv_regime[ticker] = obv_flow_regime(cl, vo) if len(cl) >= 60 else "N/D"
     except Exception:
         obv_regime[ticker] = "N/D"
@@ -850,7 +2162,7 @@ tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8 = st.tabs([
 # ========================
 # TAB 1 — DASHBOARD
 # ========================
-with tab1:
+with tab1, _profile_stage("tab1_dashboard"):
     col1, col2 = st.columns([1.2, 1])
     with col1:
         colors = ['#FF6B6B','#4ECDC4','#45B7D1','#FFA07A','#98D8C8','#F7DC6F',
@@ -940,7 +2252,7 @@ with tab1:
 # ========================
 # TAB 2 — ANDAMENTO
 # ========================
-with tab2:
+with tab2, _profile_stage("tab2_andamento"):
     selected = st.multiselect("ETF", SECTORS, default=SECTORS)
     tf = st.selectbox("Timeframe", ["1W","1M","3M","6M","1Y","3Y","5Y"])
     days   = {"1W":5,"1M":21,"3M":63,"6M":126,"1Y":252,"3Y":756,"5Y":1260}[tf]
@@ -953,13 +2265,50 @@ with tab2:
     fig.update_layout(paper_bgcolor="#000", plot_bgcolor="#000", font_color="white", yaxis_title="Variazione %")
     st.plotly_chart(fig, width="stretch")
 
+    # ── Heatmap settore × data della forza relativa (pannello in memoria)
+    st.markdown("---")
+    hm_c1, hm_c2, hm_c3, hm_c4 = st.columns([2, 2, 1, 1])
+    with hm_c1:
+        hm_univ = st.radio("Universo", ["SPDR vs SPY", "Eurostoxx vs EXSA.DE"], horizontal=True, key="hm_univ")
+    with hm_c2:
+        hm_ind = st.selectbox("Indicatore", HEATMAP_INDICATORS, index=4, key="hm_ind")
+    with hm_c3:
+        hm_res = st.radio("Risoluzione", ["1g", "1s"], horizontal=True, key="hm_res")
+    with hm_c4:
+        hm_per = st.selectbox("Periodo", list(HEATMAP_PERIODS), index=2, key="hm_per")
+    if hm_univ == "SPDR vs SPY":
+        hm_src, hm_tk, hm_bm, hm_names = "us", SECTORS, BENCHMARK, {}
+    else:
+        hm_src, hm_tk, hm_bm, hm_names = "euro", EURO_SECTORS, EURO_BENCHMARK, EURO_NAMES
+    hm_close = source_panel(hm_src)
+    if hm_bm not in hm_close.columns:
+        st.warning(f"Benchmark {hm_bm} non disponibile.")
+    else:
+        hm = heatmap_panels(hm_src, source_version(hm_src), hm_tk, hm_bm)[hm_res][hm_ind]
+        hm = hm.loc[hm.index >= hm.index[-1] - pd.Timedelta(days=HEATMAP_PERIODS[hm_per] * 365 // 252)]
+        hm = hm[hm.iloc[-1].sort_values(ascending=False).index]          # settori ordinati per valore attuale
+        z  = hm.T.to_numpy() * 100
+        lim = float(np.nanpercentile(np.abs(z), 98)) if np.isfinite(z).any() else 1.0
+        fig_hm = go.Figure(go.Heatmap(
+            z=z, x=hm.index, y=[hm_names.get(t, t) for t in hm.columns],
+            colorscale=[[0, "#cc2200"], [0.5, "#000000"], [1, "#00cc44"]], zmid=0, zmin=-lim, zmax=lim,
+            colorbar=dict(title="%", ticksuffix="%", thickness=10),
+            hovertemplate="%{y}<br>%{x|%d/%m/%Y}<br>%{z:+.2f}%<extra></extra>"))
+        fig_hm.update_layout(
+            height=max(320, 22 * hm.shape[1] + 80), paper_bgcolor="#000000", plot_bgcolor="#000000",
+            font_color="white", margin=dict(l=120, r=20, t=30, b=40),
+            title=dict(text=f"{hm_ind} vs {hm_bm} — {'giornaliero' if hm_res == '1g' else 'settimanale'}",
+                       font=dict(size=10, color="#666"), x=0, xanchor="left"),
+            yaxis=dict(autorange="reversed"), xaxis=dict(gridcolor="#1a1a1a"))
+        st.plotly_chart(fig_hm, width="stretch")
+
 
 
 
 # ========================
 # TAB 3 — ROTAZIONE SETTORIALE v2
 # ========================
-with tab3:
+with tab3, _profile_stage("tab3_rotazione"):
 
     CYCLICALS  = ["XLK","XLY","XLF","XLI","XLE","XLB"]
     DEFENSIVES = ["XLP","XLV","XLU","XLRE"]
@@ -1199,6 +2548,38 @@ with tab3:
             f'<span>Multiplier: <b style="color:#ff9900">×{vol_mult}</b></span></div>',
             unsafe_allow_html=True)
 
+    # ── Pattern A/B/C/D corrente (classificatore giornaliero su tutto lo storico)
+    pattern_defs = load_pattern_defs()
+    if pattern_defs:
+        pt_feats  = pattern_features(rotation_series_v2, macro_prices)
+        pt_labels = classify_patterns(pt_feats, pattern_defs)
+        pt_now, pt_last = pt_labels.iloc[-1], pt_feats.iloc[-1]
+        pt_color = {"A": "#ff4422", "B": "#ffaa00", "C": "#44aaff", "D": "#ffff44"}.get(pt_now, "#888888")
+        pt_name  = pattern_defs[pt_now]["nome"] if pt_now in pattern_defs else "nessun pattern"
+        _fmt = lambda v: f"{v:.2f}" if pd.notna(v) else "n/d"
+        st.markdown(
+            f'<div style="background:#0d0d0d;border:1px solid #222;border-left:3px solid {pt_color};'
+            f'border-radius:6px;padding:8px 16px;margin:6px 0;font-size:0.82em;color:#888;display:flex;gap:28px;flex-wrap:wrap;">'
+            f'<span>Pattern corrente: <b style="color:{pt_color}">{pt_now} · {pt_name}</b></span>'
+            f'<span>VIX: <b style="color:#ddd">{_fmt(pt_last["vix"])}</b></span>'
+            f'<span>MOVE: <b style="color:#ddd">{_fmt(pt_last["move"])}</b></span>'
+            f'<span>IEF-SHY: <b style="color:#ddd">{_fmt(pt_last["ief_shy"])}</b></span>'
+            f'<span>RS min {PATTERN_RS_WINDOW}s: <b style="color:#ddd">{_fmt(pt_last["rs_min"])}</b></span></div>',
+            unsafe_allow_html=True)
+        with st.expander("🧭 Pattern A/B/C/D — backtest giornaliero", expanded=False):
+            st.markdown(
+                f'<div style="color:#555;font-size:0.78em;margin-bottom:8px;">'
+                f'Ogni seduta etichettata con le soglie di backtest_patterns.json (primo pattern soddisfatto, '
+                f'"causa esogena" non osservabile). RS min = minimo ROS v2 delle ultime {PATTERN_RS_WINDOW} sedute; '
+                f'Risk Off = ROS v2 &lt; -{_threshold_v2_now:.1f}. Rendimenti SPY forward dalla seduta.</div>',
+                unsafe_allow_html=True)
+            pt_bt = pattern_backtest(pt_labels, prices,
+                                     (rotation_series_v2 < -abs(_threshold_v2_now)).to_numpy())
+            st.dataframe(pt_bt.style.format({c: "{:+.2f}" for c in pt_bt.columns if "medio" in c}
+                                            | {c: "{:.0f}%" for c in pt_bt.columns if "positivi" in c},
+                                            na_rep="—"),
+                         use_container_width=True, hide_index=True)
+
     # ── Expander: Episodi Risk Off
     with st.expander("🔬 Episodi Risk Off — analisi storica", expanded=False):
         confirm_sel = st.radio("Giorni conferma anti-whipsaw", [2,3,5], index=1, horizontal=True,
@@ -1249,6 +2630,59 @@ with tab3:
                     f'<span>RS minimo medio: <b style="color:#ffaa00">{sum(minimi)/len(minimi):.2f}</b></span></div>',
                     unsafe_allow_html=True)
 
+    # ── Expander: Episodi Risk Off per settore (ogni settore vs il proprio benchmark)
+    with st.expander("🧩 Episodi Risk Off per settore", expanded=False):
+        sec_univ = st.radio("Universo", ["SPDR vs SPY", "Eurostoxx vs EXSA.DE"], horizontal=True,
+                            key="sec_ep_univ")
+        if sec_univ == "SPDR vs SPY":
+            sec_close, sec_tk, sec_bm, sec_names = prices, SECTORS, BENCHMARK, {}
+        else:
+            sec_close, sec_tk, sec_bm, sec_names = load_euro_prices(), EURO_SECTORS, EURO_BENCHMARK, EURO_NAMES
+        if sec_bm not in sec_close.columns:
+            st.warning(f"Benchmark {sec_bm} non disponibile.")
+        else:
+            sec_panel, sec_thr, sec_eps = sector_risk_off(sec_close, sec_tk, sec_bm, confirm_days=confirm_sel)
+            sec_thr_now = sec_thr.ffill().iloc[-1] if len(sec_thr) else pd.Series(dtype=float)
+            st.markdown(
+                f'<div style="color:#555;font-size:0.78em;margin-bottom:8px;">'
+                f'RS settore = rendimento relativo pesato 15/25/35/25 vs {sec_bm} (%) · soglia per settore = '
+                f'0.75 × std RS a 252 sedute, alla data di ogni seduta · '
+                f'Conferma: <b>{confirm_sel}</b> giorni · In Risk Off ora: '
+                f'<b style="color:#ff4422">{int(sec_eps["open"].sum())}</b>/{sec_panel.shape[1]}</div>',
+                unsafe_allow_html=True)
+            rows_sec = []
+            for t in sec_panel.columns:
+                e_t  = sec_eps[sec_eps["ticker"] == t]
+                cur  = e_t[e_t["open"]]
+                last = sec_panel[t].dropna()
+                rows_sec.append({"Ticker": t, "Nome": sec_names.get(t, t),
+                                 "Stato": "🔴 RISK OFF" if not cur.empty else "—",
+                                 "RS attuale": float(last.iloc[-1]) if not last.empty else np.nan,
+                                 "Soglia": -abs(float(sec_thr_now.get(t, np.nan))),
+                                 "Inizio": cur["start"].iloc[0].strftime("%d/%m/%Y") if not cur.empty else "",
+                                 "Durata (gg)": int(cur["duration"].iloc[0]) if not cur.empty else 0,
+                                 "RS min": float(cur["rs_min"].iloc[0]) if not cur.empty else np.nan,
+                                 "Episodi storici": len(e_t)})
+            sec_df = pd.DataFrame(rows_sec).sort_values(["Stato", "RS attuale"], ascending=[False, True])
+            st.dataframe(sec_df.style.apply(
+                             lambda r: ["background-color:#1a0000; color:#ff4422"] * len(r)
+                             if "RISK OFF" in str(r["Stato"]) else ["color:#aaaaaa"] * len(r), axis=1)
+                             .format({"RS attuale": "{:+.2f}", "Soglia": "{:.2f}", "RS min": "{:.2f}"}, na_rep="—"),
+                         use_container_width=True, hide_index=True)
+            if not sec_eps.empty:
+                ep_tab = sec_eps.sort_values("start", ascending=False)
+                st.dataframe(pd.DataFrame({
+                    "Ticker":      ep_tab["ticker"],
+                    "Nome":        ep_tab["ticker"].map(lambda t: sec_names.get(t, t)),
+                    "Inizio":      ep_tab["start"].dt.strftime("%d/%m/%Y"),
+                    "Confermato":  ep_tab["confirmed"].dt.strftime("%d/%m/%Y"),
+                    "Fine":        ep_tab["end"].map(lambda d: "in corso" if pd.isna(d) else d.strftime("%d/%m/%Y")),
+                    "Durata (gg)": ep_tab["duration"],
+                    "RS minimo":   ep_tab["rs_min"],
+                    "Data minimo": ep_tab["rs_min_date"].dt.strftime("%d/%m/%Y"),
+                }), use_container_width=True, hide_index=True, height=320,
+                    column_config={"RS minimo": st.column_config.NumberColumn(format="%.2f")})
+
     # ── Cross-asset OBV Flow Chart
     st.markdown("---")
     st.markdown(
@@ -1275,12 +2709,8 @@ with tab3:
         obv_loaded = 0
         for i, ticker in enumerate(obv_tickers_sel):
             try:
-                if isinstance(ohlcv_long.columns, pd.MultiIndex):
-                    cl = ohlcv_long["Close"][ticker].dropna()
-                    vo = ohlcv_long["Volume"][ticker].dropna()
-                else:
-                    cl = ohlcv_long["Close"].dropna()
-                    vo = ohlcv_long["Volume"].dropna()
+                cl = ohlcv_series(ohlcv_long, "Close", ticker).dropna()
+                vo = ohlcv_series(ohlcv_long, "Volume", ticker).dropna()
                 if cl.empty or vo.empty or len(cl) < 60:
                     continue
                 result = compute_obv_flow(cl, vo)
@@ -1380,13 +2810,18 @@ with tab3:
 # ========================
 # TAB 4 — BUBBLE CHART S&P 500
 # ========================
-with tab4:
+with tab4, _profile_stage("tab4_sp500"):
     tf_options = {"1W": 5, "1M": 21, "3M": 63, "6M": 126,
                   "YTD": (datetime.today() - datetime(datetime.today().year, 1, 1)).days}
     tf_sel  = st.radio("Timeframe", options=list(tf_options.keys()), index=1, horizontal=True)
     tf_days = tf_options[tf_sel]
     with st.spinner(f"Caricamento dati S&P 500 ({tf_sel})… prima volta ~30s, poi in cache"):
         sp500_df = load_sp500_data(tf_days)
+    sp_list_upd, sp_list_err = sp500_list_status()
+    if sp_list_upd is not None:
+        st.caption(f"Costituenti S&P 500: lista del {sp_list_upd:%Y-%m-%d %H:%M}"
+                   + (f" · aggiornamento fallito ({sp_list_err}), in uso l'ultima lista valida"
+                      if sp_list_err else ""))
     if sp500_df.empty:
         st.error("Impossibile caricare i dati S&P 500. Riprova tra qualche minuto.")
     else:
@@ -1461,14 +2896,70 @@ with tab4:
             st.dataframe(display_stats.style.map(style_pct, subset=["% Positive"]),
                          use_container_width=True, hide_index=True)
 
+        # ── Breadth storico: serie giornaliere per settore e aggregato, membri alla data.
+        # Solo se lista e pannello sono disponibili: nessun download bloccante a ogni rerun
+        with st.expander("📈 Breadth storico S&P 500", expanded=False):
+            br_state = sp500_breadth()
+            if br_state is None:
+                st.info("Pannello S&P 500 non disponibile o troppo corto per la breadth storica.")
+            else:
+                br_groups = list(dict.fromkeys(g for g, _ in br_state["counts"].columns))
+                br_group  = st.selectbox("Universo", br_groups, key="br_group")
+                br = breadth_frame(br_state, br_group)
+                br = br[br.index >= br.index[-1] - pd.DateOffset(years=BREADTH_YEARS)]
+                last = br.iloc[-1]
+                st.markdown(
+                    f'<div style="color:#888;font-size:0.85em;margin-bottom:6px;">'
+                    f'{br_group} al {br.index[-1]:%Y-%m-%d} · '
+                    f'&gt;MM50 <b style="color:#fff">{last["% > MM50"]:.0f}%</b> · '
+                    f'&gt;MM200 <b style="color:#fff">{last["% > MM200"]:.0f}%</b> · '
+                    f'A/D <b style="color:#00cc44">{int(last["Avanzano"])}↑</b> '
+                    f'<b style="color:#ff3322">{int(last["Scendono"])}↓</b> · '
+                    f'Nuovi max/min <b style="color:#00cc44">{int(last["Nuovi massimi"])}</b>/'
+                    f'<b style="color:#ff3322">{int(last["Nuovi minimi"])}</b></div>',
+                    unsafe_allow_html=True)
 
-
+                br_colors = {"% >0 1W": "#44aaff", "% >0 1M": "#00ffcc", "% >0 3M": "#bb44ff",
+                             "% > MM50": "#ff9900", "% > MM200": "#ffff44"}
+                fig_br = go.Figure()
+                fig_br.add_hline(y=50, line_color="#444", line_width=1, line_dash="dot")
+                for m, color in br_colors.items():
+                    fig_br.add_trace(go.Scatter(x=br.index, y=br[m], mode="lines", name=m,
+                        line=dict(color=color, width=1.2 if "MM" in m else 0.9)))
+                fig_br.update_layout(height=320, margin=dict(l=40,r=20,t=30,b=40),
+                    paper_bgcolor="#000000", plot_bgcolor="#000000", font_color="white",
+                    legend=dict(orientation="h", y=1.08, x=1, xanchor="right", font=dict(size=9)),
+                    title=dict(text=f"% titoli — {br_group}", font=dict(size=10, color="#666"), x=0, xanchor="left"),
+                    yaxis=dict(gridcolor="#1a1a1a", range=[0, 100], ticksuffix="%"),
+                    xaxis=dict(gridcolor="#1a1a1a"))
+                st.plotly_chart(fig_br, use_container_width=True)
+
+                fig_ad = go.Figure()
+                fig_ad.add_trace(go.Bar(x=br.index, y=br["Nuovi massimi"], name="Nuovi massimi",
+                    marker_color="#00cc44", yaxis="y2"))
+                fig_ad.add_trace(go.Bar(x=br.index, y=-br["Nuovi minimi"], name="Nuovi minimi",
+                    marker_color="#ff3322", yaxis="y2"))
+                fig_ad.add_trace(go.Scatter(x=br.index, y=br["A/D line"], mode="lines", name="Linea A/D",
+                    line=dict(color="#ff9900", width=1.3)))
+                fig_ad.update_layout(height=300, margin=dict(l=40,r=40,t=30,b=40), barmode="relative",
+                    paper_bgcolor="#000000", plot_bgcolor="#000000", font_color="white",
+                    legend=dict(orientation="h", y=1.08, x=1, xanchor="right", font=dict(size=9)),
+                    title=dict(text="Linea avanzate/declinanti e nuovi massimi/minimi 52 sett.",
+                               font=dict(size=10, color="#666"), x=0, xanchor="left"),
+                    yaxis=dict(gridcolor="#1a1a1a", title=""),
+                    yaxis2=dict(overlaying="y", side="right", showgrid=False, title=""),
+                    xaxis=dict(gridcolor="#1a1a1a"))
+                st.plotly_chart(fig_ad, use_container_width=True)
+                st.caption("Membri alla data dallo storico costituenti locale: le entrate usano la "
+                           "\"Date added\" di Wikipedia, le uscite sono registrate solo dal primo "
+                           "aggiornamento della lista su questo server. Prima di allora i titoli usciti "
+                           "dall'indice mancano: la parte iniziale della serie ha ancora survivorship bias.")
 
 
 # ========================
 # TAB 5 — SETTORIALI EUROSTOXX 600
 # ========================
-with tab5:
+with tab5, _profile_stage("tab5_eurostoxx"):
     st.markdown(
         '<h3 style="color:#ff9900;margin-bottom:2px;">🇪🇺 Settoriali STOXX Europe 600</h3>'
         '<p style="color:#555;font-size:0.82em;margin-top:0;">'
@@ -1515,10 +3006,8 @@ with tab5:
     _disp     = compute_cross_sector_dispersion(euro_ind)
     _skew_val = _disp["skew"]
     if not np.isnan(_skew_val):
-        if   _skew_val < -0.5: _skew_label, _skew_color = "DISPERSIONE FAVOREVOLE", "#00ff55"
-        elif _skew_val <  0:   _skew_label, _skew_color = "LIEVE DISPERSIONE",       "#88cc88"
-        elif _skew_val <  0.5: _skew_label, _skew_color = "MOMENTUM EQUILIBRATO",    "#ffaa00"
-        else:                  _skew_label, _skew_color = "MOMENTUM CONCENTRATO",    "#ff4422"
+        _skew_label = skew_label([_skew_val])[0]
+        _skew_color = SKEW_COLORS[_skew_label]
     else:
         _skew_label, _skew_color = "N/D", "#888"
 
@@ -1553,6 +3042,41 @@ with tab5:
             </div>
         </div>""", unsafe_allow_html=True)
 
+    # ── Storico dispersione: etichetta nel tempo e resa forward per etichetta
+    with st.expander("📈 Storico dispersione cross-settoriale", expanded=False):
+        disp_univ = st.radio("Universo", ["Eurostoxx vs EXSA.DE", "SPDR vs SPY"], horizontal=True,
+                             key="disp_univ")
+        if disp_univ == "SPDR vs SPY":
+            d_hist, d_sum = dispersion_study("us", source_version("us"), SECTORS, BENCHMARK)
+        else:
+            d_hist, d_sum = dispersion_study("euro", source_version("euro"),
+                                             [t for t in available_euro if t != EURO_BENCHMARK], EURO_BENCHMARK)
+        d_plot = d_hist.dropna(subset=["skew"])
+        fig_disp = go.Figure()
+        for (lo, hi), (_, _, color) in zip([(-9, -0.5), (-0.5, 0), (0, 0.5), (0.5, 9)], SKEW_LABELS):
+            fig_disp.add_hrect(y0=lo, y1=hi, fillcolor=color, opacity=0.06, line_width=0)
+        fig_disp.add_trace(go.Scatter(x=d_plot.index, y=d_plot["skew"], mode="lines",
+            line=dict(color="#ff9900", width=1.3), name="Skew"))
+        fig_disp.add_trace(go.Scatter(x=d_plot.index, y=d_plot["std"] * 100, mode="lines",
+            line=dict(color="#666666", width=1), name="Std %", yaxis="y2"))
+        fig_disp.update_layout(height=300, margin=dict(l=40,r=40,t=30,b=40),
+            paper_bgcolor="#000000", plot_bgcolor="#000000", font_color="white",
+            legend=dict(orientation="h", y=1.08, x=1, xanchor="right", font=dict(size=9)),
+            title=dict(text="Skewness MMS6M RSr — storico", font=dict(size=10, color="#666"), x=0, xanchor="left"),
+            yaxis=dict(gridcolor="#1a1a1a", title="", range=[-2.5, 2.5]),
+            yaxis2=dict(overlaying="y", side="right", showgrid=False, title=""),
+            xaxis=dict(gridcolor="#1a1a1a"))
+        st.plotly_chart(fig_disp, use_container_width=True)
+        st.markdown(
+            f'<div style="color:#555;font-size:0.78em;margin-bottom:6px;">'
+            f'Resa a {DISP_FW} sedute per etichetta: IC di Spearman del MMS6M RSr sul rendimento in eccesso, '
+            f'spread medio top 3 − bottom 3 e dispersione cross-settoriale dei rendimenti forward.</div>',
+            unsafe_allow_html=True)
+        st.dataframe(d_sum.style.map(lambda v: f"color:{SKEW_COLORS.get(v, '#888')};font-weight:bold",
+                                     subset=["Etichetta"])
+                     .format({"IC fwd medio": "{:+.3f}", "Top−Bottom fwd %": "{:+.2f}", "Disp. fwd %": "{:.2f}"}),
+                     use_container_width=True, hide_index=True)
+
     # ── Controlli UI
     c1, c2 = st.columns([2, 2])
     with c1:
@@ -1565,18 +3089,17 @@ with tab5:
 
     # ── Bar chart RSr
     tf_days_map = {"1D":1,"1W":5,"1M":21,"3M":63,"6M":126,"YTD":None,"1A":252}
+    d = tf_days_map[euro_tf]
+    if d is None:                                   # YTD: per anno di calendario
+        r_all = euro_prices_clean.apply(lambda x: safe_ret(x, None))
+    else:
+        r_all = ret(aligned_panel(euro_today_clean if d == 1 else euro_prices_clean), d)
+    rb = r_all.get(EURO_BENCHMARK, np.nan)
     bar_data = []
     for tk in EURO_SECTORS:
         if tk not in euro_prices_clean.columns:
             continue
-        d = tf_days_map[euro_tf]
-        if d == 1:
-            s = euro_today_clean[tk].dropna() if tk in euro_today_clean.columns else pd.Series(dtype=float)
-            b = euro_today_clean[EURO_BENCHMARK].dropna() if EURO_BENCHMARK in euro_today_clean.columns else pd.Series(dtype=float)
-        else:
-            s = euro_prices_clean[tk].dropna()
-            b = euro_prices_clean[EURO_BENCHMARK].dropna()
-        rs = safe_ret(s, d); rb = safe_ret(b, d)
+        rs = r_all.get(tk, np.nan)
         rsr_val = float((1 + rs/100) / (1 + rb/100) - 1) if not (np.isnan(rs) or np.isnan(rb)) else np.nan
         bar_data.append({"Ticker": tk, "Nome": EURO_NAMES.get(tk, tk), "RSr": rsr_val})
 
@@ -1659,15 +3182,76 @@ with tab5:
         )
         st.plotly_chart(fig_sc, use_container_width=True)
 
+    # ── Relative Rotation Graph: traiettorie RS-Ratio / RS-Momentum
+    st.markdown("---")
+    rg_c1, rg_c2, rg_c3 = st.columns([2, 2, 1])
+    with rg_c1:
+        st.markdown("#### Relative Rotation Graph — traiettorie")
+        rrg_univ = st.radio("Universo", ["Eurostoxx vs EXSA.DE", "SPDR vs SPY"], horizontal=True, key="rrg_univ")
+    with rg_c2:
+        rrg_tail = st.slider("Coda (sedute)", min_value=5, max_value=126, value=21, step=1, key="rrg_tail")
+    with rg_c3:
+        rrg_step = st.radio("Passo", ["1g", "5g"], horizontal=True, key="rrg_step")
+    if rrg_univ == "SPDR vs SPY":
+        rrg = rrg_data("us", source_version("us"), SECTORS, BENCHMARK)
+        rrg_names = {}
+    else:
+        rrg = rrg_data("euro", source_version("euro"), EURO_SECTORS, EURO_BENCHMARK)
+        rrg_names = EURO_NAMES
+    step = 5 if rrg_step == "5g" else 1
+    tail_r = rrg["ratio"][::-1][:rrg_tail:step][::-1]          # passo ancorato all'ultima seduta
+    tail_m = rrg["momentum"][::-1][:rrg_tail:step][::-1]
+    fig_rrg = go.Figure()
+    fig_rrg.add_hline(y=100, line_color="#333", line_width=1.5)
+    fig_rrg.add_vline(x=100, line_color="#333", line_width=1.5)
+    quad_now = rrg_quadrant(rrg["ratio"][-1], rrg["momentum"][-1])
+    for j, tk in enumerate(rrg["tickers"]):
+        x, y = tail_r[:, j], tail_m[:, j]
+        ok = ~(np.isnan(x) | np.isnan(y))
+        if not ok.any():
+            continue
+        color = RRG_QUADRANTS.get(quad_now[j], "#888888")
+        name  = rrg_names.get(tk, tk)
+        fig_rrg.add_trace(go.Scatter(x=x[ok], y=y[ok], mode="lines+markers",
+            line=dict(color=color, width=1), marker=dict(size=3, color=color), opacity=0.55,
+            hoverinfo="skip", showlegend=False))
+        fig_rrg.add_trace(go.Scatter(x=[x[ok][-1]], y=[y[ok][-1]], mode="markers+text",
+            marker=dict(size=10, color=color, line=dict(color="#111", width=1)),
+            text=[tk], textposition="top center", textfont=dict(size=8, color="#ccc"),
+            hovertemplate=f"<b>{name}</b><br>RS-Ratio: %{{x:.2f}}<br>RS-Momentum: %{{y:.2f}}<extra></extra>",
+            showlegend=False))
+    for ql, qc, qx, qy, qax, qay in [("LEADER", RRG_QUADRANTS["LEADER"], 0.98, 0.98, "right", "top"),
+                                      ("IMPROVING", RRG_QUADRANTS["IMPROVING"], 0.02, 0.98, "left", "top"),
+                                      ("WEAKENING", RRG_QUADRANTS["WEAKENING"], 0.98, 0.02, "right", "bottom"),
+                                      ("LAGGARD", RRG_QUADRANTS["LAGGARD"], 0.02, 0.02, "left", "bottom")]:
+        fig_rrg.add_annotation(x=qx, y=qy, xref="paper", yref="paper", text=ql, showarrow=False,
+            font=dict(color=qc, size=10, family="Courier New"), opacity=0.45, xanchor=qax, yanchor=qay)
+    fig_rrg.update_layout(
+        height=520, paper_bgcolor="#000", plot_bgcolor="#000", font=dict(color="white", size=10),
+        title=dict(text=f"RRG — ultime {rrg_tail} sedute · colore: quadrante attuale",
+                   font=dict(size=10, color="#666"), x=0, xanchor="left"),
+        xaxis=dict(title="RS-Ratio", gridcolor="#1a1a1a", zeroline=False),
+        yaxis=dict(title="RS-Momentum", gridcolor="#1a1a1a", zeroline=False),
+        margin=dict(l=60, r=40, t=50, b=60))
+    st.plotly_chart(fig_rrg, use_container_width=True)
+
     # ── Tabella indicatori
     st.markdown("---")
     st.markdown("#### Tabella indicatori — formattazione condizionale")
 
+    euro_pct  = st.checkbox(f"Percentili storici ({PCT_WINDOW} sedute) — posizione di ogni indicatore nella "
+                            "storia del settore", value=False, key="euro_pct")
     disp      = euro_ind.sort_values(euro_sort, ascending=False).copy()
     disp_show = disp[["Nome",
                        "RSr 1W", "RSr 1M", "RSr 3M", "RSr 6M",
                        "MMS6M RSr", "MAC", "MMS6M React.", "Δ React.",
                        "RSI BM", "MME", "GTE", "Δ Rank"]].copy()
+    pct_cols = []
+    if euro_pct:
+        _pct = latest_percentiles("euro", source_version("euro"),
+                                  [t for t in available_euro if t != EURO_BENCHMARK], EURO_BENCHMARK)
+        pct_cols  = list(_pct.columns)
+        disp_show = disp_show.join(_pct)
 
     fp = lambda x: f"{x*100:+.2f}%" if not pd.isna(x) else "—"
     fm = lambda x: f"{x:+.4f}"      if not pd.isna(x) else "—"
@@ -1776,6 +3360,8 @@ with tab5:
         .map(_c_mme,          subset=["MME"])
         .map(_c_gte,          subset=["GTE"])
         .map(_c_delta_rank,   subset=["Δ Rank"])
+        .map(style_percentile, subset=pct_cols)
+        .format({c: "{:.0f}" for c in pct_cols}, na_rep="—")
         .format({
             "RSr 1W": fp, "RSr 1M": fp, "RSr 3M": fp, "RSr 6M": fp,
             "MMS6M RSr": fp,
@@ -1823,7 +3409,7 @@ with tab5:
 # ========================
 # TAB 6 — ROTATION BACKTEST
 # ========================
-with tab6:
+with tab6, _profile_stage("tab6_rotation_bt"):
     st.markdown(
         '<h3 style="color:#ff9900;margin-bottom:2px;">🔁 Rotation Backtest</h3>'
         '<p style="color:#555;font-size:0.82em;margin-top:0;">'
@@ -1851,40 +3437,23 @@ with tab6:
     fw1, fw2 = st.columns(2)
     with fw1: bt_fw1 = st.selectbox("TF forward 1", ["1M","3M","6M"], index=1, key="bt_fw1")
     with fw2: bt_fw2 = st.selectbox("TF forward 2", ["3M","6M","1A"], index=1, key="bt_fw2")
-    fw_days_map = {"1M":21,"3M":63,"6M":126,"1A":252}
+    bt_tickers = [t.strip().upper() for t in bt_tickers_raw.strip().splitlines() if t.strip()]
+    bt_params  = {"tickers": bt_tickers, "benchmark": bt_benchmark,
+                  "ref_date": pd.Timestamp(bt_ref_date).strftime("%Y-%m-%d"),
+                  "fw1": bt_fw1, "fw2": bt_fw2}
+    bt_key     = result_key("rotation_bt", bt_params)
 
     if st.button("Calcola Backtest", type="primary", key="bt_run"):
-        bt_tickers = [t.strip().upper() for t in bt_tickers_raw.strip().splitlines() if t.strip()]
         if not bt_tickers:
             st.error("Inserisci almeno un ticker.")
-            st.stop()
-
-        bt_all = bt_tickers + [bt_benchmark]
-        ref_dt = pd.Timestamp(bt_ref_date)
-        fwd1_d = fw_days_map[bt_fw1]
-        fwd2_d = fw_days_map[bt_fw2]
-
-        with st.spinner("Download prezzi..."):
-            try:
-                raw_bt = yf.download(bt_all,
-                    start=ref_dt - timedelta(days=3*365),
-                    end=datetime.today(), auto_adjust=True, progress=False)
-                bt_close = raw_bt["Close"] if isinstance(raw_bt.columns, pd.MultiIndex) else raw_bt
-                bt_close = bt_close.dropna(how="all")
-            except Exception as e:
-                st.error(f"Errore download: {e}")
-                st.stop()
-
-        not_found = [t for t in bt_all if t not in bt_close.columns]
-        if not_found:
-            st.warning(f"Ticker non trovati: {', '.join(not_found)}")
-        if bt_benchmark not in bt_close.columns:
-            st.error(f"Benchmark {bt_benchmark} non disponibile.")
-            st.stop()
+        else:
+            submit_job("rotation_bt", bt_params, run_rotation_backtest)
+    bt_result = render_job(bt_key)
 
-        actual_ref = bt_close.index[bt_close.index.searchsorted(ref_dt)]
-        if actual_ref > bt_close.index[-1]:
-            actual_ref = bt_close.index[-1]
+    if bt_result is not None:
+        for w in bt_result["warnings"]:
+            st.warning(w)
+        res, actual_ref, rsi_bm_bt = bt_result["res"], bt_result["actual_ref"], bt_result["rsi_bm"]
 
         st.markdown(
             f'<div style="background:#0d0d0d;border:1px solid #222;border-radius:6px;'
@@ -1893,139 +3462,6 @@ with tab6:
             f'{actual_ref.strftime("%d/%m/%Y")}</b></div>',
             unsafe_allow_html=True)
 
-        bt_hist = bt_close[bt_close.index <= actual_ref].copy()
-        bm_hist = bt_hist[bt_benchmark].dropna()
-
-        # RSI benchmark alla data
-        rsi_bm_bt = compute_rsi(bm_hist)
-
-        def rsr_at(tk, days):
-            try:
-                s = bt_hist[tk].dropna(); b = bm_hist
-                if len(s) <= days or len(b) <= days: return np.nan
-                rs = float(s.iloc[-1] / s.iloc[-days-1] - 1)
-                rb = float(b.iloc[-1] / b.iloc[-days-1] - 1)
-                return float((1 + rs) / (1 + rb) - 1)
-            except Exception: return np.nan
-
-        def abs_at(tk, days):
-            try:
-                s = bt_hist[tk].dropna()
-                if len(s) <= days: return np.nan
-                return float(s.iloc[-1] / s.iloc[-days-1] - 1)
-            except Exception: return np.nan
-
-        def fw(tk, days):
-            try:
-                s  = bt_close[tk].dropna()
-                i  = s.index.searchsorted(actual_ref)
-                if i + days >= len(s): return np.nan
-                p0, p1 = float(s.iloc[i]), float(s.iloc[i+days])
-                if pd.isna(p0) or p0 == 0: return np.nan
-                return p1 / p0 - 1
-            except Exception: return np.nan
-
-        wts  = [0.20, 0.35, 0.25, 0.20]
-        rows = []
-        for tk in bt_tickers:
-            if tk not in bt_close.columns:
-                continue
-            r1d = rsr_at(tk, 1);  r1w = rsr_at(tk, 5)
-            r1m = rsr_at(tk, 21); r3m = rsr_at(tk, 63); r6m = rsr_at(tk, 126)
-            vr  = [r1w, r1m, r3m, r6m]
-            mms6m_rsr = (sum(v*w for v,w in zip(vr,wts))
-                         if not any(np.isnan(v) for v in vr) else np.nan)
-
-            va = [abs_at(tk, d) for d in [5, 21, 63, 126]]
-            mms6m_abs = (sum(v*w for v,w in zip(va,wts))
-                         if not any(np.isnan(v) for v in va) else np.nan)
-
-            # MMS6M con regressione
-            mms_r_l, mms_r_v, mms_r_d = compute_mms6m_regression(r1w, r1m, r3m, r6m)
-            mms_a_l, mms_a_v, mms_a_d = (compute_mms6m_regression(*va)
-                if not any(np.isnan(v) for v in va) else (np.nan, np.nan, np.nan))
-
-            breve = (r1m*0.50 + r1w*0.35 + r1d*0.15
-                     if not any(np.isnan(v) for v in [r1m,r1w,r1d]) else np.nan)
-            medio = (r1m*0.35 + r3m*0.25 + r6m*0.20 + r1w*0.20
-                     if not any(np.isnan(v) for v in [r1m,r3m,r6m,r1w]) else np.nan)
-            tt = (breve - medio) if not (np.isnan(breve) or np.isnan(medio)) else np.nan
-            mr = (breve / (abs(medio) + 2)) if not (np.isnan(breve) or np.isnan(medio)) else np.nan
-
-            # MaxDD 3M e 6M — su storico fino alla data di riferimento
-            maxdd_3m_bt = calcola_maxdd_assoluto(tk, bt_close, actual_ref, periodo_giorni=63)
-            maxdd_6m_bt = calcola_maxdd_assoluto_6m(tk, bt_close, actual_ref, periodo_giorni=126)
-
-            # MME — efficienza assoluta strutturale
-            mme_bt = mms_a_l / (abs(maxdd_6m_bt) + 0.0001) if not np.isnan(maxdd_6m_bt) else np.nan
-
-            # GTE — qualità impulso relativo normalizzata su rischio 3M
-            if not any(np.isnan(v) for v in [r1w, r1m, r3m]):
-                gemini_3m_bt = (r1w + (r1m - r1w) / 3 + (r3m - r1m) / 8) / 3
-                gte_bt = gemini_3m_bt / (abs(maxdd_3m_bt) + 0.0001) if not np.isnan(maxdd_3m_bt) else np.nan
-            else:
-                gte_bt = np.nan
-
-            # MAC — Marginal Absolute Contribution (stessa logica di compute_euro_indicators)
-            if not any(np.isnan(v) for v in [r1w, r1m, r3m, r6m]) and not np.isnan(maxdd_3m_bt):
-                marg_1w_bt = r1w
-                marg_1m_bt = r1m - r1w
-                marg_3m_bt = r3m - r1m
-                marg_6m_bt = r6m - r3m
-                mac_num_bt = marg_1w_bt * 0.4 + marg_1m_bt * 0.3 + marg_3m_bt * 0.2 + marg_6m_bt * 0.1
-                mac_bt = mac_num_bt / (abs(maxdd_3m_bt) + 0.0001)
-            else:
-                mac_bt = np.nan
-
-            # _S_minus_M per Δ Rank cross-settoriale (calcolato dopo il loop)
-            s_minus_m_bt = mms_a_v - mms_a_l if not (np.isnan(mms_a_v) or np.isnan(mms_a_l)) else np.nan
-
-            # AMSR Score — riusa maxdd_3m_bt già calcolato
-            try:
-                tk_s       = bt_close[tk].dropna()
-                ret_abs_1m = float(tk_s.iloc[-1] / tk_s.iloc[-22] - 1) if len(tk_s) > 21 else np.nan
-                ret_abs_3m = float(tk_s.iloc[-1] / tk_s.iloc[-64] - 1) if len(tk_s) > 63 else np.nan
-            except Exception:
-                ret_abs_1m, ret_abs_3m = np.nan, np.nan
-            amsr_score = ((ret_abs_1m + ret_abs_3m - abs(maxdd_3m_bt))
-                          if not np.isnan(maxdd_3m_bt) else np.nan)
-
-            # Rendimenti forward
-            ret_fw1 = fw(tk, fwd1_d)
-            ret_fw2 = fw(tk, fwd2_d)
-            bm_fw1  = fw(bt_benchmark, fwd1_d)
-            bm_fw2  = fw(bt_benchmark, fwd2_d)
-            d1 = (ret_fw1 - bm_fw1) if not (np.isnan(ret_fw1) or np.isnan(bm_fw1)) else np.nan
-            d2 = (ret_fw2 - bm_fw2) if not (np.isnan(ret_fw2) or np.isnan(bm_fw2)) else np.nan
-
-            rows.append({
-                "Ticker":        tk,
-                "RSI BM":        rsi_bm_bt,
-                "MMS6M RSr":     mms6m_rsr,
-                "MAC":           mac_bt,
-                "MMS6M React.":  mms_r_v,
-                "Δ React.":      mms_r_d,
-                "Tact. Thrust":  tt,
-                "Mr Index":      mr,
-                "MME":           mme_bt,
-                "GTE":           gte_bt,
-                "_S_minus_M":    s_minus_m_bt,
-                "AMSR Score":    amsr_score,
-                f"Rend +{bt_fw1}":     ret_fw1, f"Rend +{bt_fw2}":     ret_fw2,
-                f"Delta BM +{bt_fw1}": d1,      f"Delta BM +{bt_fw2}": d2,
-            })
-
-        if not rows:
-            st.warning("Nessun dato calcolato.")
-            st.stop()
-
-        res = (pd.DataFrame(rows).set_index("Ticker")
-               .sort_values("MMS6M RSr", ascending=False))
-        res["Rank MMS6M"] = res["MMS6M RSr"].rank(ascending=False, na_option="bottom").astype(int)
-        # Δ Rank condizionato a MAC positivo (stessa logica di Tab 5)
-        res["Δ Rank"] = res["_S_minus_M"].where(res["MAC"] > 0).rank(ascending=False, na_option="keep", method="min")
-        
-
         fw1c = f"Rend +{bt_fw1}"; fw2c = f"Rend +{bt_fw2}"
         d1c  = f"Delta BM +{bt_fw1}"; d2c  = f"Delta BM +{bt_fw2}"
 
@@ -2159,6 +3595,13 @@ with tab6:
 
         fm2 = lambda x: f"{x:+.4f}" if not pd.isna(x) else "—"
 
+        bt_pct = bt_result.get("pct")
+        bt_pct_cols = []
+        if bt_pct is not None and st.checkbox(f"Percentili storici ({PCT_WINDOW} sedute fino alla data)",
+                                              value=False, key="bt_pct"):
+            res = res.join(bt_pct)
+            bt_pct_cols = list(bt_pct.columns)
+
         st.dataframe(
             res.drop(columns=["_S_minus_M"], errors="ignore").style
             .map(_c_rsi_bm,       subset=["RSI BM"])
@@ -2174,6 +3617,8 @@ with tab6:
             .map(_c_amsr,         subset=["AMSR Score"])
             .map(_c_fw,           subset=[fw1c, fw2c])
             .map(_c_dbm,          subset=[d1c,  d2c])
+            .map(style_percentile, subset=bt_pct_cols)
+            .format({c: "{:.0f}" for c in bt_pct_cols}, na_rep="—")
             .format({
                 "RSI BM":       lambda x: f"{x:.1f}" if not pd.isna(x) else "—",
                 "MMS6M RSr":    fp2,
@@ -2230,7 +3675,26 @@ with tab6:
                     f'<div style="color:{col_};font-size:1.15em;font-weight:bold">{val}</div>'
                     f'</div>', unsafe_allow_html=True)
 
-    else:
+        # Curva Delta BM forward 1–252 sedute dal tensore forward
+        fw_cv = bt_result.get("fw_curve")
+        if fw_cv is not None and not fw_cv.dropna(how="all").empty:
+            pos_tk = [t for t in res.index[res["MMS6M RSr"] > 0] if t in fw_cv.columns]
+            neg_tk = [t for t in res.index[~(res["MMS6M RSr"] > 0)] if t in fw_cv.columns]
+            fig_cv = go.Figure()
+            for lbl, tks, clr in [("MMS6M RSr > 0", pos_tk, "#00ff55"), ("MMS6M RSr ≤ 0", neg_tk, "#ff4422")]:
+                if tks:
+                    cv = fw_cv[tks].mean(axis=1) * 100
+                    fig_cv.add_trace(go.Scatter(x=cv.index, y=cv.values, mode="lines",
+                                                name=f"{lbl} ({len(tks)})", line=dict(color=clr)))
+            fig_cv.add_hline(y=0, line_color="#444")
+            fig_cv.update_layout(height=300, margin=dict(l=40, r=20, t=30, b=40),
+                paper_bgcolor="#000000", plot_bgcolor="#000000", font_color="white",
+                title=dict(text="Delta BM medio per orizzonte forward (sedute)",
+                           font=dict(size=10, color="#666"), x=0, xanchor="left"),
+                yaxis=dict(gridcolor="#1a1a1a", title="%"), xaxis=dict(gridcolor="#1a1a1a"))
+            st.plotly_chart(fig_cv, use_container_width=True)
+
+    elif job_state(bt_key) is None:
         st.markdown("""
         <div style="background:#080808;border:1px solid #1a1a1a;border-radius:10px;
                     padding:24px;margin-top:8px;color:#555;font-size:0.88em;line-height:1.8;">
@@ -2242,34 +3706,115 @@ with tab6:
         5. La tabella mostra indicatori alla data e rendimenti forward effettivi
         </div>
         """, unsafe_allow_html=True)
+
+    # ── Simulatore rotazione: cosa avrebbe reso seguire i segnali della dashboard
+    st.markdown("---")
+    with st.expander("🧮 Simulatore rotazione — equity, turnover e drawdown dei segnali", expanded=False):
+        sim_c1, sim_c2, sim_c3 = st.columns(3)
+        with sim_c1:
+            sim_univ  = st.radio("Universo", ["Ticker sopra", "Settori USA"], horizontal=True, key="sim_univ")
+            sim_start = st.date_input("Inizio simulazione", value=datetime(2019, 1, 1).date(),
+                                      min_value=datetime(2008, 1, 1).date(),
+                                      max_value=datetime.today().date() - timedelta(days=90), key="sim_start")
+        with sim_c2:
+            sim_signals = st.multiselect("Segnali", SIM_SIGNALS, default=["MMS6M RSr", "Δ Rank"], key="sim_signals")
+            sim_rules   = st.multiselect("Selezione", list(SIM_RULES), default=["Top 3", "Soglia > 0"], key="sim_rules")
+        with sim_c3:
+            sim_reb  = st.multiselect("Ribilanciamento (sedute)", [5, 10, 21, 42, 63], default=[21], key="sim_reb")
+            sim_cost = st.number_input("Costi (bps per unità di turnover)", 0.0, 100.0, 10.0, 1.0, key="sim_cost")
+
+        sim_tk, sim_bm = (SECTORS, BENCHMARK) if sim_univ == "Settori USA" else (bt_tickers, bt_benchmark)
+        sim_params = {"tickers": sim_tk, "benchmark": sim_bm, "start": str(sim_start),
+                      "signals": sim_signals, "rules": sim_rules, "rebalance": sim_reb, "cost_bps": sim_cost}
+        sim_key    = result_key("rotation_sim", sim_params)
+        n_var      = len(sim_signals) * len(sim_rules) * len(sim_reb)
+        if st.button(f"Simula {n_var} varianti", key="sim_run", disabled=n_var == 0):
+            submit_job("rotation_sim", sim_params, run_rotation_sim, panel_store=_panel_store())
+        sim_result = render_job(sim_key)
+
+        if sim_result is not None:
+            for w in sim_result["warnings"]:
+                st.warning(w)
+            fp_s = lambda x: f"{x*100:+.2f}%" if not pd.isna(x) else "—"
+            st.dataframe(
+                sim_result["stats"].drop(columns=["Segnale", "Regola", "Ribil. (gg)"]).style.format({
+                    "CAGR": fp_s, "Vol": lambda x: f"{x*100:.1f}%", "Sharpe": "{:.2f}",
+                    "Max DD": fp_s, "Turnover annuo": "{:.1f}x"}),
+                use_container_width=True, hide_index=True)
+
+            best    = [v for v in sim_result["stats"]["Variante"] if not v.startswith("Benchmark")][:5]
+            sim_sel = st.multiselect("Curve", list(sim_result["equity"].columns),
+                                     default=best + [c for c in sim_result["equity"].columns
+                                                     if c.startswith("Benchmark")], key="sim_sel")
+            fig_eq = go.Figure()
+            for v in sim_sel:
+                eq_v = sim_result["equity"][v].dropna()
+                fig_eq.add_trace(go.Scatter(x=eq_v.index, y=eq_v.values, mode="lines", name=v,
+                                            line=dict(dash="dot" if v.startswith("Benchmark") else "solid")))
+            fig_eq.update_layout(height=340, margin=dict(l=40, r=20, t=30, b=40),
+                paper_bgcolor="#000000", plot_bgcolor="#000000", font_color="white",
+                title=dict(text="Equity (base 1, netta costi)", font=dict(size=10, color="#666"), x=0, xanchor="left"),
+                yaxis=dict(gridcolor="#1a1a1a", title=""), xaxis=dict(gridcolor="#1a1a1a"))
+            st.plotly_chart(fig_eq, use_container_width=True)
+
+            fig_dd = go.Figure()
+            for v in [v for v in sim_sel if v in sim_result["drawdown"].columns]:
+                dd_v = sim_result["drawdown"][v] * 100
+                fig_dd.add_trace(go.Scatter(x=dd_v.index, y=dd_v.values, mode="lines", name=v))
+            fig_dd.update_layout(height=220, margin=dict(l=40, r=20, t=30, b=40), showlegend=False,
+                paper_bgcolor="#000000", plot_bgcolor="#000000", font_color="white",
+                title=dict(text="Drawdown %", font=dict(size=10, color="#666"), x=0, xanchor="left"),
+                yaxis=dict(gridcolor="#1a1a1a", title=""), xaxis=dict(gridcolor="#1a1a1a"))
+            st.plotly_chart(fig_dd, use_container_width=True)
 # ========================
 # TAB 7 — BACKTEST RS
 # ========================
-with tab7:
-    import json
+with tab7, _profile_stage("tab7_backtest_rs"):
     st.markdown(
-        '<h3 style="color:#ff9900;margin-bottom:4px;">🧪 Backtest Rotation Score — Episodi Risk Off</h3>'
-        '<p style="color:#555;font-size:0.82em;margin-top:0;">'
-        'Dataset storico 2021–2026 · 5 episodi identificati · Soglia dinamica ~-3.5 · Conferma 5 giorni</p>',
+        '<h3 style="color:#ff9900;margin-bottom:4px;">🧪 Backtest Rotation Score — Episodi Risk Off</h3>',
         unsafe_allow_html=True)
+    bt_source = st.radio("Dataset episodi", ["File JSON", "Rigenerato dai prezzi"], horizontal=True,
+                         key="bt_source")
     try:
         with open("backtest_patterns.json", "r", encoding="utf-8") as f:
             bt = json.load(f)
         bt_ok = True
     except FileNotFoundError:
         st.warning("⚠️ File backtest_patterns.json non trovato nel repo.")
-        bt_ok = False
+        bt, bt_ok = {}, False
     except Exception as e:
         st.error(f"Errore lettura backtest_patterns.json: {e}")
-        bt_ok = False
+        bt, bt_ok = {}, False
+
+    if bt_source == "Rigenerato dai prezzi":
+        # Stesse regole di compute_risk_off_episodes (Tab 3); il file curato fa da
+        # template per definizioni, pattern e note degli episodi già noti.
+        bt = build_episode_dataset(rotation_series_v2, prices, BENCHMARK, CYCLICAL, DEFENSIVE,
+                                   _threshold_v2_now, confirm_days=EP_CONFIRM_DAYS, template=bt,
+                                   macro=macro_prices)
+        bt_ok = bool(bt["episodi"])
+        if not bt_ok:
+            st.info("Nessun episodio Risk Off chiuso con SPY +40gg disponibile nello storico scaricato.")
+        else:
+            st.download_button("⬇️ Scarica backtest_patterns.json rigenerato",
+                               json.dumps(bt, ensure_ascii=False, indent=2).encode("utf-8"),
+                               file_name="backtest_patterns.json", mime="application/json",
+                               key="bt_download")
+    if bt_ok:
+        _ep = bt["episodi"]
+        st.markdown(
+            f'<p style="color:#555;font-size:0.82em;margin-top:0;">'
+            f'Dataset storico {_ep[0]["rs_inizio"][:4]}–{bt["metadata"]["aggiornato"][:4]} · '
+            f'{len(_ep)} episodi identificati · {bt["metadata"].get("note", "")}</p>',
+            unsafe_allow_html=True)
 
     if bt_ok:
         stats = bt["statistiche_aggregate"]
         k1, k2, k3, k4, k5 = st.columns(5)
         kpi_bt = [
             (k1, "Win Rate",           stats["win_rate"],                              "#00ff55"),
-            (k2, "Payoff medio +40gg", f"+{stats['spy_perf_40_media_positivi']:.1f}%", "#00ff55"),
-            (k3, "Payoff medio +20gg", f"+{stats['spy_perf_20_media_positivi']:.1f}%", "#88cc88"),
+            (k2, "Payoff medio +40gg", f"{stats['spy_perf_40_media_positivi']:+.1f}%", "#00ff55"),
+            (k3, "Payoff medio +20gg", f"{stats['spy_perf_20_media_positivi']:+.1f}%", "#88cc88"),
             (k4, "Durata media ep.",   f"{stats['durata_media_gg']:.0f} gg",           "#ff9900"),
             (k5, "RS min medio",       f"{stats['rs_min_medio']:.2f}",                 "#ff4422"),
         ]
@@ -2335,7 +3880,8 @@ with tab7:
             .map(style_pattern_col, subset=["Pattern"]).map(style_esito_col, subset=["Esito"])
             .map(style_delta, subset=["Δ RS→SPY(gg)"]).map(style_rs_min_bt, subset=["RS min"])
             .map(style_top_qualita, subset=["Top qualità"])
-            .format({"RS min": "{:.2f}", "SPY +20gg": "{:+.2f}%", "SPY +40gg": "{:+.2f}%", "IEF-SHY": "{:.2f}"}),
+            .format({"RS min": "{:.2f}", "SPY +20gg": "{:+.2f}%", "SPY +40gg": "{:+.2f}%", "IEF-SHY": "{:.2f}"},
+                    na_rep="n/d"),
             use_container_width=True, hide_index=True)
 
         st.markdown("---")
@@ -2376,13 +3922,121 @@ with tab7:
         st.markdown(f'<div style="background:#0a0a0a;border:1px solid #1a1a1a;border-radius:6px;'
                     f'padding:8px 16px;margin-top:16px;font-size:0.75em;color:#444;">'
                     f'📅 Dati aggiornati al: <b style="color:#ff9900">{bt["metadata"]["aggiornato"]}</b> · '
-                    f'Per aggiornare: modifica <b>backtest_patterns.json</b> nel repo e fai commit</div>',
+                    f'Per aggiornare: rigenera dai prezzi, scarica il JSON e fai commit di <b>backtest_patterns.json</b></div>',
                     unsafe_allow_html=True)
 
+    # ── Analoghi storici: kNN sullo stato giornaliero (tutto lo storico, non solo i 5 episodi)
+    st.markdown("---")
+    st.markdown("### 🔎 Analoghi storici — stato di mercato")
+    st.markdown('<p style="color:#555;font-size:0.82em;margin-top:0;">'
+                'Date passate più vicine all\'ultima seduta su ROS v2, banda adattiva, derivata banda, '
+                f'RSI {BENCHMARK}, dispersione settoriale e spread RSI ciclici−difensivi (z-score, distanza euclidea). '
+                'Escluse le ultime 40 sedute; vicini distanziati di almeno 10 sedute.</p>',
+                unsafe_allow_html=True)
+    an_k = st.selectbox("Numero analoghi", [5, 10, 20], index=1, key="analog_k")
+    an_index = analog_state_index(source_version("us"), prices, rotation_series_v2,
+                                  adaptive_threshold_series, band_deriv_series)
+    if len(an_index["dates"]) < 100:
+        st.info("Storico insufficiente per la ricerca analoghi.")
+    else:
+        analogs = find_analogs(an_index, prices, k=an_k)
+        now = pd.Series(an_index["X"][-1], index=ANALOG_FEATURES)
+        st.caption(f"Stato al {an_index['dates'][-1]:%Y-%m-%d}: " +
+                   " · ".join(f"{c} {v:+.2f}" for c, v in now.items()))
+        ka1, ka2, ka3, ka4 = st.columns(4)
+        for col, h in zip((ka1, ka2), ANALOG_FW):
+            r = analogs[f"SPY +{h}gg %"].dropna()
+            med = float(r.median()) if not r.empty else float("nan")
+            col.markdown(f'<div style="background:#0d0d0d;border:1px solid #222;border-radius:8px;padding:10px 14px;margin-bottom:10px;">'
+                         f'<div style="color:#555;font-size:0.72em;letter-spacing:0.06em">SPY +{h}gg mediana analoghi</div>'
+                         f'<div style="color:{"#00ff55" if med >= 0 else "#ff4422"};font-size:1.15em;font-weight:bold">{med:+.2f}%</div></div>',
+                         unsafe_allow_html=True)
+        for col, h in zip((ka3, ka4), ANALOG_FW):
+            r = analogs[f"SPY +{h}gg %"].dropna()
+            col.markdown(f'<div style="background:#0d0d0d;border:1px solid #222;border-radius:8px;padding:10px 14px;margin-bottom:10px;">'
+                         f'<div style="color:#555;font-size:0.72em;letter-spacing:0.06em">SPY +{h}gg positivi</div>'
+                         f'<div style="color:#ff9900;font-size:1.15em;font-weight:bold">{(r > 0).sum()}/{len(r)}</div></div>',
+                         unsafe_allow_html=True)
+
+        fig_an = go.Figure()
+        ros_hist = rotation_series_v2.loc[an_index["dates"][0]:]
+        fig_an.add_trace(go.Scatter(x=ros_hist.index, y=ros_hist, mode="lines",
+            line=dict(color="#888888", width=1.2), name="ROS v2"))
+        fig_an.add_trace(go.Scatter(x=analogs.index, y=analogs["ROS v2"], mode="markers",
+            marker=dict(color="#ff9900", size=9, symbol="diamond"), name="Analoghi"))
+        fig_an.add_trace(go.Scatter(x=[an_index["dates"][-1]], y=[now["ROS v2"]], mode="markers",
+            marker=dict(color="#00ff55", size=11, symbol="star"), name="Oggi"))
+        fig_an.add_hline(y=0.0, line_dash="solid", line_color="#444444")
+        fig_an.update_layout(height=300, margin=dict(l=40,r=20,t=30,b=40),
+            paper_bgcolor="#000000", plot_bgcolor="#000000", font_color="white", showlegend=False,
+            title=dict(text="ROS v2 — date analoghe", font=dict(size=10, color="#666"), x=0, xanchor="left"),
+            yaxis=dict(gridcolor="#1a1a1a", title=""), xaxis=dict(gridcolor="#1a1a1a"))
+        st.plotly_chart(fig_an, use_container_width=True)
+
+        st.dataframe(
+            analogs.reset_index().style.format({"Data": "{:%Y-%m-%d}", "Distanza": "{:.2f}",
+                **{c: "{:+.2f}" for c in ANALOG_FEATURES},
+                **{f"SPY +{h}gg %": "{:+.2f}" for h in ANALOG_FW}}, na_rep="—"),
+            use_container_width=True, hide_index=True)
+
+    # ── Lead/lag ROS → SPY: funzione di cross-correlazione su tutta la storia + versione mobile
+    st.markdown("---")
+    st.markdown("### ⏱ Lead/lag ROS → SPY")
+    st.markdown('<p style="color:#555;font-size:0.82em;margin-top:0;">'
+                f'Correlazione tra la variazione giornaliera del ROS al giorno t e il rendimento {BENCHMARK} '
+                'al giorno t+k (FFT su tutto lo storico). Lag positivo = il ROS anticipa SPY.</p>',
+                unsafe_allow_html=True)
+    ll_c1, ll_c2, ll_c3 = st.columns(3)
+    with ll_c1:
+        ll_ros = st.radio("Serie", ["ROS v2", "ROS v1"], horizontal=True, key="ll_ros")
+    with ll_c2:
+        ll_lag = st.slider("Lag massimo (sedute)", min_value=5, max_value=120, value=60, step=5, key="ll_lag")
+    with ll_c3:
+        ll_win = st.selectbox("Finestra mobile", [126, 252, 504], index=1, key="ll_win")
+    ll_x = (rotation_series_v2 if ll_ros == "ROS v2" else rotation_series_v1).diff()
+    ll_y = np.log(prices[BENCHMARK].dropna()).diff()
+    ll_cc = xcorr_fft(ll_x, ll_y, ll_lag)
+    ll_n  = int(ll_x.dropna().index.intersection(ll_y.dropna().index).size)
+    ll_band = 1.96 / np.sqrt(max(ll_n, 1))
+    ll_pos = ll_cc[ll_cc.index > 0]
+    ll_peak = int(ll_pos.abs().idxmax()) if ll_pos.notna().any() else None
+
+    fig_ll = go.Figure()
+    fig_ll.add_trace(go.Bar(x=ll_cc.index, y=ll_cc,
+        marker_color=["#ff9900" if abs(v) > ll_band else "#444444" for v in ll_cc.fillna(0)]))
+    fig_ll.add_hline(y=ll_band, line_dash="dot", line_color="#666666")
+    fig_ll.add_hline(y=-ll_band, line_dash="dot", line_color="#666666")
+    fig_ll.add_vline(x=0, line_color="#333333")
+    fig_ll.update_layout(height=300, margin=dict(l=40,r=20,t=30,b=40),
+        paper_bgcolor="#000000", plot_bgcolor="#000000", font_color="white", showlegend=False,
+        title=dict(text=f"Cross-correlazione Δ{ll_ros} → {BENCHMARK} · banda ±1.96/√n (n={ll_n})",
+                   font=dict(size=10, color="#666"), x=0, xanchor="left"),
+        yaxis=dict(gridcolor="#1a1a1a", title=""), xaxis=dict(gridcolor="#1a1a1a", title="lag (sedute)"))
+    st.plotly_chart(fig_ll, use_container_width=True)
+    if ll_peak is not None:
+        st.caption(f"Lag positivo con |correlazione| massima: {ll_peak} sedute ({ll_cc[ll_peak]:+.3f}); "
+                   f"lag significativi (> banda): {int((ll_pos.abs() > ll_band).sum())}/{len(ll_pos)}.")
+
+    ll_roll = rolling_xcorr(ll_x, ll_y, range(1, ll_lag + 1), ll_win).dropna(how="all")
+    if not ll_roll.empty:
+        ll_peak_roll = ll_roll.abs().idxmax(axis=1)
+        fig_llr = go.Figure()
+        fig_llr.add_trace(go.Heatmap(z=ll_roll.T.to_numpy(), x=ll_roll.index, y=list(ll_roll.columns),
+            colorscale=[[0, "#cc2200"], [0.5, "#000000"], [1, "#00cc44"]], zmid=0,
+            colorbar=dict(thickness=10), hovertemplate="%{x|%d/%m/%Y}<br>lag %{y}<br>%{z:+.3f}<extra></extra>"))
+        fig_llr.add_trace(go.Scatter(x=ll_peak_roll.index, y=ll_peak_roll, mode="lines",
+            line=dict(color="#ff9900", width=1), name="Lag di picco"))
+        fig_llr.update_layout(height=320, margin=dict(l=40,r=20,t=30,b=40),
+            paper_bgcolor="#000000", plot_bgcolor="#000000", font_color="white", showlegend=False,
+            title=dict(text=f"Correlazione mobile {ll_win} sedute per lag · linea: lag di picco",
+                       font=dict(size=10, color="#666"), x=0, xanchor="left"),
+            yaxis=dict(gridcolor="#1a1a1a", title="lag"), xaxis=dict(gridcolor="#1a1a1a"))
+        st.plotly_chart(fig_llr, use_container_width=True)
+
 # ========================
 # TAB 8 — BACKTEST MULTI-DATA
 # ========================
-with tab8:
+with tab8, _profile_stage("tab8_multidata"):
     st.markdown(
         '<h3 style="color:#ff9900;margin-bottom:2px;">📂 Backtest Multi-Data — Validazione empirica</h3>'
         '<p style="color:#555;font-size:0.82em;margin-top:0;">'
@@ -2410,380 +4064,115 @@ with tab8:
                                        value="\n".join(EURO_SECTORS),
                                        height=120, key="mb_tickers")
 
-    if st.button("Avvia Backtest Multi-Data", type="primary", key="mb_run"):
-        mb_tickers = [t.strip().upper() for t in mb_tickers_raw.strip().splitlines() if t.strip()]
-        mb_all     = mb_tickers + [mb_bm]
-        fw_d       = {"1M":21,"3M":63,"6M":126}[mb_fw]
-
-        # Genera lista date
-        date_range = []
-        d      = pd.Timestamp(mb_start)
-        end_ts = pd.Timestamp(mb_end)
-        while d <= end_ts:
-            date_range.append(d)
-            d += pd.Timedelta(days=mb_step)
-
-        if len(date_range) > 60:
-            st.warning(f"Troppe date ({len(date_range)}). Aumenta il passo o riduci l'intervallo.")
-            st.stop()
-
-        with st.spinner(f"Download prezzi ({len(date_range)} date)..."):
-            try:
-                raw_mb = yf.download(mb_all,
-                    start=pd.Timestamp(mb_start) - timedelta(days=3*365),
-                    end=datetime.today(), auto_adjust=True, progress=False)
-                mb_close = raw_mb["Close"] if isinstance(raw_mb.columns, pd.MultiIndex) else raw_mb
-                mb_close = mb_close.dropna(how="all")
-            except Exception as e:
-                st.error(f"Errore download: {e}")
-                st.stop()
-
-        rows_mb      = []
-        progress_bar = st.progress(0)
-
-        for i_d, ref_ts in enumerate(date_range):
-            progress_bar.progress((i_d + 1) / len(date_range))
-
-            idx_pos = mb_close.index.searchsorted(ref_ts)
-            if idx_pos >= len(mb_close):
-                continue
-            actual = mb_close.index[idx_pos]
-            hist   = mb_close[mb_close.index <= actual]
-            bm_h   = hist[mb_bm].dropna() if mb_bm in hist.columns else pd.Series(dtype=float)
-
-            rsi_bm_mb = compute_rsi(bm_h)
-
-            def _rsr_mb(tk, days):
-                try:
-                    s = hist[tk].dropna(); b = bm_h
-                    if len(s) <= days or len(b) <= days: return np.nan
-                    rs = float(s.iloc[-1] / s.iloc[-days-1] - 1)
-                    rb = float(b.iloc[-1] / b.iloc[-days-1] - 1)
-                    return float((1 + rs) / (1 + rb) - 1)
-                except Exception: return np.nan
-
-            def _abs_mb(tk, days):
-                try:
-                    s = hist[tk].dropna()
-                    if len(s) <= days: return np.nan
-                    return float(s.iloc[-1] / s.iloc[-days-1] - 1)
-                except Exception: return np.nan
-
-            def _fw_mb(tk, days):
-                try:
-                    s  = mb_close[tk].dropna()
-                    ii = s.index.searchsorted(actual)
-                    if ii + days >= len(s): return np.nan
-                    p0, p1 = float(s.iloc[ii]), float(s.iloc[ii+days])
-                    return p1/p0 - 1 if p0 and not pd.isna(p0) else np.nan
-                except Exception: return np.nan
-
-            wts = [0.20, 0.35, 0.25, 0.20]
-
-        # Pendenza profilo RSr su 4 TF (regressione log-lineare)
-        _log_days   = np.log(np.array([5., 21., 63., 126.]))
-        _log_days_c = _log_days - _log_days.mean()
-        _denom_slope = float(np.dot(_log_days_c, _log_days_c))
-
-        def _slope_mb(r1w, r1m, r3m, r6m):
-            vals = np.array([r1w, r1m, r3m, r6m])
-            if np.any(np.isnan(vals)): return np.nan
-            return float(np.dot(_log_days_c, vals) / _denom_slope)
-
-        for i_d, ref_ts in enumerate(date_range):
-            progress_bar.progress((i_d + 1) / len(date_range))
-
-            idx_pos = mb_close.index.searchsorted(ref_ts)
-            if idx_pos >= len(mb_close):
-                continue
-            actual = mb_close.index[idx_pos]
-            hist   = mb_close[mb_close.index <= actual]
-            bm_h   = hist[mb_bm].dropna() if mb_bm in hist.columns else pd.Series(dtype=float)
-
-            rsi_bm_mb = compute_rsi(bm_h)
+    mb_tickers = [t.strip().upper() for t in mb_tickers_raw.strip().splitlines() if t.strip()]
+    mb_params  = {"tickers": mb_tickers, "benchmark": mb_bm,
+                  "start": str(mb_start), "end": str(mb_end), "step": mb_step, "fw": mb_fw}
+    mb_key     = result_key("multidate_bt", mb_params)
 
-            def _rsr_mb(tk, days):
-                try:
-                    s = hist[tk].dropna(); b = bm_h
-                    if len(s) <= days or len(b) <= days: return np.nan
-                    rs = float(s.iloc[-1] / s.iloc[-days-1] - 1)
-                    rb = float(b.iloc[-1] / b.iloc[-days-1] - 1)
-                    return float((1 + rs) / (1 + rb) - 1)
-                except Exception: return np.nan
-
-            def _abs_mb(tk, days):
-                try:
-                    s = hist[tk].dropna()
-                    if len(s) <= days: return np.nan
-                    return float(s.iloc[-1] / s.iloc[-days-1] - 1)
-                except Exception: return np.nan
-
-            def _fw_mb(tk, days):
-                try:
-                    s  = mb_close[tk].dropna()
-                    ii = s.index.searchsorted(actual)
-                    if ii + days >= len(s): return np.nan
-                    p0, p1 = float(s.iloc[ii]), float(s.iloc[ii+days])
-                    return p1/p0 - 1 if p0 and not pd.isna(p0) else np.nan
-                except Exception: return np.nan
-
-            for tk in mb_tickers:
-                if tk not in mb_close.columns:
-                    continue
-                r1w = _rsr_mb(tk, 5);  r1m = _rsr_mb(tk, 21)
-                r3m = _rsr_mb(tk, 63); r6m = _rsr_mb(tk, 126)
-                vr  = [r1w, r1m, r3m, r6m]
-                mms_rsr = (sum(v*w for v,w in zip(vr,wts))
-                           if not any(np.isnan(v) for v in vr) else np.nan)
-
-                a1w = _abs_mb(tk, 5);  a1m = _abs_mb(tk, 21)
-                a3m = _abs_mb(tk, 63); a6m = _abs_mb(tk, 126)
-                va  = [a1w, a1m, a3m, a6m]
-                mms_abs = (sum(v*w for v,w in zip(va,wts))
-                           if not any(np.isnan(v) for v in va) else np.nan)
-
-                mms_r_l, mms_r_v, mms_r_d = compute_mms6m_regression(r1w, r1m, r3m, r6m)
-                mms_a_l, mms_a_v, mms_a_d = (compute_mms6m_regression(*va)
-                    if not any(np.isnan(v) for v in va) else (np.nan, np.nan, np.nan))
-
-                ret_fw   = _fw_mb(tk, fw_d)
-                bm_fw    = _fw_mb(mb_bm, fw_d)
-                delta_bm = ((ret_fw - bm_fw)
-                            if not (np.isnan(ret_fw) or np.isnan(bm_fw)) else np.nan)
-
-                maxdd_3m_mb = calcola_maxdd_assoluto(tk, mb_close, actual, periodo_giorni=63)
-                maxdd_6m_mb = calcola_maxdd_assoluto_6m(tk, mb_close, actual, periodo_giorni=126)
-
-                mme_mb = mms_a_l / (abs(maxdd_6m_mb) + 0.0001) if not np.isnan(maxdd_6m_mb) else np.nan
-
-                r1w_mb = _rsr_mb(tk, 5); r1m_mb = _rsr_mb(tk, 21); r3m_mb = _rsr_mb(tk, 63)
-                if not any(np.isnan(v) for v in [r1w_mb, r1m_mb, r3m_mb]):
-                    gemini_3m_mb = (r1w_mb + (r1m_mb - r1w_mb) / 3 + (r3m_mb - r1m_mb) / 8) / 3
-                    gte_mb = gemini_3m_mb / (abs(maxdd_3m_mb) + 0.0001) if not np.isnan(maxdd_3m_mb) else np.nan
-                else:
-                    gte_mb = np.nan
-
-                # MAC — Marginal Absolute Contribution (stessa logica delle altre sezioni)
-                if not any(np.isnan(v) for v in [r1w, r1m, r3m, r6m]) and not np.isnan(maxdd_3m_mb):
-                    marg_1w_mb = r1w
-                    marg_1m_mb = r1m - r1w
-                    marg_3m_mb = r3m - r1m
-                    marg_6m_mb = r6m - r3m
-                    mac_num_mb = marg_1w_mb * 0.4 + marg_1m_mb * 0.3 + marg_3m_mb * 0.2 + marg_6m_mb * 0.1
-                    mac_mb = mac_num_mb / (abs(maxdd_3m_mb) + 0.0001)
-                else:
-                    mac_mb = np.nan
-
-                # RSr Slope — pendenza profilo RSr su 4 TF
-                rsr_slope_mb = _slope_mb(
-                    np.clip(r1w, -0.5, 0.5),
-                    np.clip(r1m, -0.5, 0.5),
-                    np.clip(r3m, -0.5, 0.5),
-                    np.clip(r6m, -0.5, 0.5))
-                # Tact. Thrust e Mr Index (no r1d in Tab8 — approssimazione senza daily)
-                r6m_mb = _rsr_mb(tk, 126)
-                breve_mb = (r1m_mb*0.60 + r1w_mb*0.40
-                            if not any(np.isnan(v) for v in [r1m_mb, r1w_mb]) else np.nan)
-                medio_mb = (r1m_mb*0.35 + r3m_mb*0.25 + r6m_mb*0.20 + r1w_mb*0.20
-                            if not any(np.isnan(v) for v in [r1m_mb, r3m_mb, r6m_mb, r1w_mb]) else np.nan)
-                tt_mb = (breve_mb - medio_mb) if not (np.isnan(breve_mb) or np.isnan(medio_mb)) else np.nan
-                mr_mb = (breve_mb / (abs(medio_mb) + 2)) if not (np.isnan(breve_mb) or np.isnan(medio_mb)) else np.nan
-                rows_mb.append({
-                    "Data":          actual.strftime("%Y-%m-%d"),
-                    "Ticker":        tk,
-                    "RSI BM":        round(rsi_bm_mb, 1) if not np.isnan(rsi_bm_mb) else np.nan,
-                    "MMS6M RSr":     mms_rsr,
-                    "MAC":           mac_mb,
-                    "MMS6M React.":  mms_r_v,
-                    "Δ React.":      mms_r_d,
-                    "Tact. Thrust":  tt_mb,
-                    "Mr Index":      mr_mb,
-                    "MME":           mme_mb,
-                    "GTE":           gte_mb,
-                    "RSr Slope":     rsr_slope_mb,
-                    "_S_minus_M":    mms_a_v - mms_a_l if not (np.isnan(mms_a_v) or np.isnan(mms_a_l)) else np.nan,
-                    f"Rend +{mb_fw}":     ret_fw,
-                    f"Delta BM +{mb_fw}": delta_bm,
-                })
-
-        progress_bar.empty()
-
-        if not rows_mb:
-            st.warning("Nessun dato calcolato.")
-            st.stop()
-
-        mb_df = pd.DataFrame(rows_mb)
-        mb_df["Pct MMS6M RSr"] = mb_df.groupby("Data")["MMS6M RSr"].rank(pct=True) * 100
-        # Δ Rank condizionato a MAC positivo, calcolato per singola data (stessa logica di Tab 5/6)
-        mb_df["Δ Rank"] = (mb_df["_S_minus_M"].where(mb_df["MAC"] > 0)
-                            .groupby(mb_df["Data"]).rank(ascending=False, method="min"))
+    if st.button("Avvia Backtest Multi-Data", type="primary", key="mb_run"):
+        n_dates = len(mb_date_range(mb_start, mb_end, mb_step))
+        if n_dates > 60:
+            st.warning(f"Troppe date ({n_dates}). Aumenta il passo o riduci l'intervallo.")
+        else:
+            submit_job("multidate_bt", mb_params, run_multidate_backtest,
+                       run_key=mb_key, procs=_mb_process_pool())
+    mb_result = render_job(mb_key)
+
+    if mb_result is not None:
+        for w in mb_result["warnings"]:
+            st.warning(w)
+        mb_df = mb_result["mb_df"]
         st.success(
             f"Completato: {len(mb_df)} osservazioni · "
             f"{mb_df['Data'].nunique()} date · "
             f"{mb_df['Ticker'].nunique()} settori")
 
-        # Analisi per quintile
+        # Analisi per quintile — query sull'archivio osservazioni (SQLite)
+        try:
+            if not obs_has_run(mb_key):   # risultato persistito prima dell'archivio
+                store_observations(mb_key, mb_params, mb_df)
+        except Exception as e:
+            st.warning(f"Archivio osservazioni non aggiornato: {e}")
+        obs_all   = obs_summary(mb_fw)
+        mb_scope  = st.radio(
+            "Base statistica",
+            ["Questa run", "Archivio · stesso universo", "Archivio · tutti gli universi"],
+            horizontal=True, key="mb_scope",
+            help=f"Archivio forward {mb_fw}: {obs_all['n']} osservazioni · "
+                 f"{obs_all['dates']} date · {obs_all['universes']} universi")
+        scope_kw = {"Archivio · stesso universo": {"universe": obs_universe(mb_tickers, mb_bm)},
+                    "Archivio · tutti gli universi": {}}.get(mb_scope)
+        col_bs1, col_bs2 = st.columns([1, 3])
+        mb_boot = col_bs1.selectbox(
+            "Bootstrap IC 95%", [0, 1000, 2000, 5000], index=0, key="mb_boot",
+            format_func=lambda b: "Off" if b == 0 else f"{b} ricampionamenti")
+        # Blocchi di date consecutive che coprono la finestra forward (rendimenti sovrapposti)
+        mb_block = -(-BT_FW_DAYS[mb_fw] // mb_step)
+        if mb_boot:
+            col_bs2.caption(f"Block bootstrap sulle date di riferimento · blocchi di {mb_block} date · "
+                            f"p-value bilaterale su Delta BM medio (H0 = 0)")
+
+        def _obs_table(factors):
+            # Run corrente: cubo numpy su mb_df in memoria; archivio: stesso cubo in SQL
+            try:
+                if scope_kw is None:
+                    t = conditional_alpha_cube(mb_df, factors, f"Rend +{mb_fw}", f"Delta BM +{mb_fw}",
+                                               n_boot=mb_boot, block=mb_block)
+                else:
+                    t = obs_breakdown(mb_fw, factors, n_boot=mb_boot, block=mb_block, **scope_kw)
+            except Exception as e:
+                st.error(f"Archivio osservazioni non disponibile: {e}")
+                return None
+            t["Rend medio"]     = t["Rend medio"].map(lambda x: f"{x*100:+.2f}%" if not pd.isna(x) else "—")
+            t["Delta BM medio"] = t["Delta BM medio"].map(lambda x: f"{x*100:+.2f}%" if not pd.isna(x) else "—")
+            t["Hit rate"]       = t["Hit rate"].map(lambda x: f"{x*100:.1f}%")
+            if "p Delta BM" in t:
+                t["IC Delta BM"] = [f"[{lo*100:+.2f}%, {hi*100:+.2f}%]" if not pd.isna(lo) else "—"
+                                    for lo, hi in zip(t.pop("Delta BM IC-"), t.pop("Delta BM IC+"))]
+                t["p"]           = t.pop("p Delta BM").map(
+                    lambda x: "—" if pd.isna(x) else ("<0.001" if x < 0.001 else f"{x:.3f}"))
+                t["IC Hit"]      = [f"[{lo*100:.0f}%, {hi*100:.0f}%]" if not pd.isna(lo) else "—"
+                                    for lo, hi in zip(t.pop("Hit IC-"), t.pop("Hit IC+"))]
+            return t
+
         st.markdown("#### Analisi per quintile MMS6M RSr  ·  finding atteso: fascia 60–80°")
-        fw_col   = f"Rend +{mb_fw}"
-        db_col   = f"Delta BM +{mb_fw}"
-        mb_valid = mb_df.dropna(subset=["Pct MMS6M RSr", fw_col]).copy()
-        bins     = [0, 20, 40, 60, 80, 100]
-        labels   = ["0–20°","20–40°","40–60°","60–80°","80–100°"]
-        mb_valid["Quintile"] = pd.cut(mb_valid["Pct MMS6M RSr"], bins=bins, labels=labels)
-        quintile_stats = (
-            mb_valid.groupby("Quintile", observed=True)
-            .agg(
-                N         =(fw_col, "count"),
-                Rend_medio=(fw_col, "mean"),
-                Delta_BM  =(db_col, "mean"),
-                Hit_rate  =(fw_col, lambda x: (x > 0).mean()),
-            )
-            .reset_index()
-        )
-        quintile_stats["Rend_medio"] = quintile_stats["Rend_medio"].map(lambda x: f"{x*100:+.2f}%")
-        quintile_stats["Delta_BM"]   = quintile_stats["Delta_BM"].map(lambda x: f"{x*100:+.2f}%")
-        quintile_stats["Hit_rate"]   = quintile_stats["Hit_rate"].map(lambda x: f"{x*100:.1f}%")
-        quintile_stats.columns       = ["Quintile","N","Rend medio","Delta BM medio","Hit rate"]
+        quintile_stats = _obs_table(["Quintile"])
 
         def _style_q(row):
             if "60–80" in str(row["Quintile"]):
                 return ["background-color:#0d2b0d;color:#00ff55;font-weight:bold"] * len(row)
             return ["color:#888"] * len(row)
 
-        st.dataframe(quintile_stats.style.apply(_style_q, axis=1),
-                     use_container_width=True, hide_index=True)
+        if quintile_stats is not None:
+            st.dataframe(quintile_stats.style.apply(_style_q, axis=1),
+                         use_container_width=True, hide_index=True)
 
         # Analisi RSI regime x quintile
         st.markdown("#### Analisi incrociata RSI regime × Quintile MMS6M")
+        cross_stats = _obs_table(["RSI Regime", "Quintile"])
+        if cross_stats is not None:
+            st.dataframe(cross_stats[["RSI Regime", "Quintile", "N", "Delta BM medio"]
+                                     + [c for c in ("IC Delta BM", "p") if c in cross_stats]],
+                         use_container_width=True, hide_index=True)
 
-        def _rsi_bucket(v):
-            if pd.isna(v): return "N/D"
-            if v >= 70:    return "Uptrend maturo (≥70)"
-            if v >= 55:    return "Uptrend fresco (55–69)"
-            if v >= 45:    return "Laterale (45–54)"
-            if v >= 30:    return "Ribasso attivo (30–44)"
-            return              "Bottom (≤29)"
-
-        mb_valid2 = mb_df.dropna(subset=["Pct MMS6M RSr","RSI BM", fw_col]).copy()
-        mb_valid2["Quintile"]   = pd.cut(mb_valid2["Pct MMS6M RSr"], bins=bins, labels=labels)
-        mb_valid2["RSI Regime"] = mb_valid2["RSI BM"].apply(_rsi_bucket)
-        cross_stats = (
-            mb_valid2.groupby(["RSI Regime","Quintile"], observed=True)
-            .agg(N=(fw_col,"count"), Delta_BM=(db_col,"mean"))
-            .reset_index()
-        )
-        cross_stats["Delta_BM"] = cross_stats["Delta_BM"].map(
-            lambda x: f"{x*100:+.2f}%" if not pd.isna(x) else "—")
-        st.dataframe(cross_stats, use_container_width=True, hide_index=True)
-        
-        # Analisi TT x Quintile
-        st.markdown("#### Analisi Tact. Thrust × Quintile MMS6M RSr")
-        mb_valid3 = mb_df.dropna(subset=["Pct MMS6M RSr", "Tact. Thrust", fw_col]).copy()
-        mb_valid3["Quintile"] = pd.cut(mb_valid3["Pct MMS6M RSr"], bins=bins, labels=labels)
-        mb_valid3["TT sign"]  = mb_valid3["Tact. Thrust"].apply(lambda x: "TT+" if x > 0 else "TT-")
-        tt_stats = (
-            mb_valid3.groupby(["Quintile", "TT sign"], observed=True)
-            .agg(
-                N        =(fw_col, "count"),
-                Rend_medio=(fw_col, "mean"),
-                Delta_BM =(db_col, "mean"),
-                Hit_rate =(fw_col, lambda x: (x > 0).mean()),
-            )
-            .reset_index()
-        )
-        tt_stats["Rend_medio"] = tt_stats["Rend_medio"].map(lambda x: f"{x*100:+.2f}%")
-        tt_stats["Delta_BM"]   = tt_stats["Delta_BM"].map(lambda x: f"{x*100:+.2f}%")
-        tt_stats["Hit_rate"]   = tt_stats["Hit_rate"].map(lambda x: f"{x*100:.1f}%")
-        tt_stats.columns       = ["Quintile","TT","N","Rend medio","Delta BM medio","Hit rate"]
-        st.dataframe(tt_stats, use_container_width=True, hide_index=True)
-
-        # Analisi Mr Index x Quintile
-        st.markdown("#### Analisi Mr Index × Quintile MMS6M RSr")
-        mb_valid4 = mb_df.dropna(subset=["Pct MMS6M RSr", "Mr Index", fw_col]).copy()
-        mb_valid4["Quintile"] = pd.cut(mb_valid4["Pct MMS6M RSr"], bins=bins, labels=labels)
-        mb_valid4["Mr sign"]  = mb_valid4["Mr Index"].apply(lambda x: "Mr+" if x > 0 else "Mr-")
-        mr_stats = (
-            mb_valid4.groupby(["Quintile", "Mr sign"], observed=True)
-            .agg(
-                N        =(fw_col, "count"),
-                Rend_medio=(fw_col, "mean"),
-                Delta_BM =(db_col, "mean"),
-                Hit_rate =(fw_col, lambda x: (x > 0).mean()),
-            )
-            .reset_index()
-        )
-        mr_stats["Rend_medio"] = mr_stats["Rend_medio"].map(lambda x: f"{x*100:+.2f}%")
-        mr_stats["Delta_BM"]   = mr_stats["Delta_BM"].map(lambda x: f"{x*100:+.2f}%")
-        mr_stats["Hit_rate"]   = mr_stats["Hit_rate"].map(lambda x: f"{x*100:.1f}%")
-        mr_stats.columns       = ["Quintile","Mr","N","Rend medio","Delta BM medio","Hit rate"]
-        st.dataframe(mr_stats, use_container_width=True, hide_index=True)
-        # Analisi RSr Slope x Quintile
-        st.markdown("#### Analisi RSr Slope × Quintile MMS6M RSr")
-        mb_valid5 = mb_df.dropna(subset=["Pct MMS6M RSr", "RSr Slope", fw_col]).copy()
-        mb_valid5["Quintile"]     = pd.cut(mb_valid5["Pct MMS6M RSr"], bins=bins, labels=labels)
-        mb_valid5["Slope sign"]   = mb_valid5["RSr Slope"].apply(
-            lambda x: "Acc." if x > 0 else "Dec.")
-        slope_stats = (
-            mb_valid5.groupby(["Quintile", "Slope sign"], observed=True)
-            .agg(
-                N         =(fw_col, "count"),
-                Rend_medio=(fw_col, "mean"),
-                Delta_BM  =(db_col, "mean"),
-                Hit_rate  =(fw_col, lambda x: (x > 0).mean()),
-            )
-            .reset_index()
-        )
-        slope_stats["Rend_medio"] = slope_stats["Rend_medio"].map(lambda x: f"{x*100:+.2f}%")
-        slope_stats["Delta_BM"]   = slope_stats["Delta_BM"].map(lambda x: f"{x*100:+.2f}%")
-        slope_stats["Hit_rate"]   = slope_stats["Hit_rate"].map(lambda x: f"{x*100:.1f}%")
-        slope_stats.columns       = ["Quintile","Slope","N","Rend medio","Delta BM medio","Hit rate"]
-        st.dataframe(slope_stats, use_container_width=True, hide_index=True)
-
-        # Analisi MAC × Quintile
-        st.markdown("#### Analisi MAC × Quintile MMS6M RSr")
-        mb_valid_mac = mb_df.dropna(subset=["Pct MMS6M RSr", "MAC", fw_col]).copy()
-        mb_valid_mac["Quintile"] = pd.cut(mb_valid_mac["Pct MMS6M RSr"], bins=bins, labels=labels)
-        mb_valid_mac["MAC fascia"] = mb_valid_mac["MAC"].apply(
-            lambda x: "MAC>0.15" if x > 0.15 else ("MAC 0-0.15" if x >= 0 else "MAC<0")
-        )
-        mac_stats = (
-            mb_valid_mac.groupby(["Quintile", "MAC fascia"], observed=True)
-            .agg(
-                N=(fw_col, "count"),
-                Rend_medio=(fw_col, "mean"),
-                Delta_BM=(db_col, "mean"),
-                Hit_rate=(fw_col, lambda x: (x > 0).mean()),
-            )
-            .reset_index()
-        )
-        mac_stats["Rend_medio"] = mac_stats["Rend_medio"].map(lambda x: f"{x*100:+.2f}%")
-        mac_stats["Delta_BM"]   = mac_stats["Delta_BM"].map(lambda x: f"{x*100:+.2f}%")
-        mac_stats["Hit_rate"]   = mac_stats["Hit_rate"].map(lambda x: f"{x*100:.1f}%")
-        mac_stats.columns       = ["Quintile", "MAC", "N", "Rend medio", "Delta BM medio", "Hit rate"]
-        st.dataframe(mac_stats, use_container_width=True, hide_index=True)
-
-        # Analisi Δ React. × Quintile
-        st.markdown("#### Analisi Δ Reattiva × Quintile MMS6M RSr")
-        mb_valid_dr = mb_df.dropna(subset=["Pct MMS6M RSr", "Δ React.", fw_col]).copy()
-        mb_valid_dr["Quintile"] = pd.cut(mb_valid_dr["Pct MMS6M RSr"], bins=bins, labels=labels)
-        mb_valid_dr["Δ React. sign"] = mb_valid_dr["Δ React."].apply(
-            lambda x: "Δ+" if x > 0 else "Δ-"
-        )
-        dr_stats = (
-            mb_valid_dr.groupby(["Quintile", "Δ React. sign"], observed=True)
-            .agg(
-                N=(fw_col, "count"),
-                Rend_medio=(fw_col, "mean"),
-                Delta_BM=(db_col, "mean"),
-                Hit_rate=(fw_col, lambda x: (x > 0).mean()),
-            )
-            .reset_index()
-        )
-        dr_stats["Rend_medio"] = dr_stats["Rend_medio"].map(lambda x: f"{x*100:+.2f}%")
-        dr_stats["Delta_BM"]   = dr_stats["Delta_BM"].map(lambda x: f"{x*100:+.2f}%")
-        dr_stats["Hit_rate"]   = dr_stats["Hit_rate"].map(lambda x: f"{x*100:.1f}%")
-        dr_stats.columns       = ["Quintile", "Δ React.", "N", "Rend medio", "Delta BM medio", "Hit rate"]
-        st.dataframe(dr_stats, use_container_width=True, hide_index=True)
+        for by, title in [("TT",       "Tact. Thrust × Quintile MMS6M RSr"),
+                          ("Mr",       "Mr Index × Quintile MMS6M RSr"),
+                          ("Slope",    "RSr Slope × Quintile MMS6M RSr"),
+                          ("MAC",      "MAC × Quintile MMS6M RSr"),
+                          ("Δ React.", "Δ Reattiva × Quintile MMS6M RSr")]:
+            st.markdown(f"#### Analisi {title}")
+            by_stats = _obs_table(["Quintile", by])
+            if by_stats is not None:
+                st.dataframe(by_stats, use_container_width=True, hide_index=True)
+
+        # Incrocio libero: qualsiasi combinazione di fattori
+        st.markdown("#### Incrocio personalizzato")
+        mb_factors = st.multiselect("Fattori", list(FACTOR_BUCKETS),
+                                    default=["Quintile", "RSI Regime", "MAC"], key="mb_factors")
+        if mb_factors:
+            custom_stats = _obs_table(mb_factors)
+            if custom_stats is not None:
+                st.dataframe(custom_stats, use_container_width=True, hide_index=True)
 
         # Download CSV
         st.markdown("---")
@@ -2842,7 +4231,7 @@ with tab8:
             f'Osservazioni: {len(mb_df)}</div>',
             unsafe_allow_html=True)
 
-    else:
+    elif job_state(mb_key) is None:
         st.markdown("""
         <div style="background:#080808;border:1px solid #1a1a1a;border-radius:10px;
                     padding:24px;margin-top:8px;color:#555;font-size:0.88em;line-height:1.8;">
@@ -2857,3 +4246,75 @@ with tab8:
         Per intervalli lunghi usa passo 63gg.
         </div>
         """, unsafe_allow_html=True)
+
+    # ── Information Coefficient: quale indicatore predice il rendimento relativo
+    st.markdown("---")
+    st.markdown("#### Information Coefficient indicatori  ·  Spearman cross-sectional giornaliero")
+    ic_params = {"tickers": mb_tickers, "benchmark": mb_bm, "start": str(mb_start), "end": str(mb_end)}
+    ic_key    = result_key("ic_analysis", ic_params)
+    if st.button("Calcola IC", key="ic_run"):
+        submit_job("ic_analysis", ic_params, run_ic_analysis, panel_store=_panel_store())
+    ic_result = render_job(ic_key)
+    if ic_result is not None:
+        for w in ic_result["warnings"]:
+            st.warning(w)
+        col_ic1, col_ic2 = st.columns(2)
+        with col_ic1:
+            st.caption("Decadimento — IC medio per orizzonte (vs Delta BM forward)")
+            st.dataframe(ic_result["decay"].style.format("{:+.3f}"), use_container_width=True)
+        with col_ic2:
+            st.caption("IC IR — media / deviazione standard dell'IC giornaliero")
+            st.dataframe(ic_result["ir"].style.format("{:+.2f}"), use_container_width=True)
+
+        ic_h = st.selectbox("Orizzonte", list(IC_HORIZONS), index=2, key="ic_h")
+        ic_ind = st.multiselect("Indicatori", IC_INDICATORS,
+                                default=["MMS6M RSr", "MAC", "Δ React."], key="ic_ind")
+        fig_ic = go.Figure()
+        for k in ic_ind:
+            s_ic = ic_result["rolling_mean"][ic_h][k].dropna()
+            fig_ic.add_trace(go.Scatter(x=s_ic.index, y=s_ic.values, mode="lines", name=k))
+        fig_ic.add_hline(y=0, line_color="#444")
+        fig_ic.update_layout(height=320, margin=dict(l=40, r=20, t=30, b=40),
+            paper_bgcolor="#000000", plot_bgcolor="#000000", font_color="white",
+            title=dict(text=f"IC medio rolling {IC_WINDOW} sedute · forward {ic_h}",
+                       font=dict(size=10, color="#666"), x=0, xanchor="left"),
+            yaxis=dict(gridcolor="#1a1a1a", title=""), xaxis=dict(gridcolor="#1a1a1a"))
+        st.plotly_chart(fig_ic, use_container_width=True)
+        last_ir = ic_result["rolling_ir"][ic_h].dropna(how="all").iloc[-1:]
+        if not last_ir.empty:
+            st.caption(f"IC IR rolling all'ultima data ({last_ir.index[-1]:%Y-%m-%d}): " +
+                       " · ".join(f"{k} {v:+.2f}" for k, v in last_ir.iloc[-1].dropna().items()))
+
+    # ── Walk-forward: soglie rifittate su training mobile, verificate out-of-sample
+    st.markdown("---")
+    st.markdown("#### Walk-forward soglie  ·  ROS ±1.5 · MAC 0.15 · fascia 60–80°")
+    col_wf1, col_wf2, col_wf3 = st.columns(3)
+    wf_train = col_wf1.selectbox("Training (sedute)", [252, 504, 756], index=1, key="wf_train")
+    wf_test  = col_wf2.selectbox("Test (sedute)", [63, 126, 252], index=0, key="wf_test")
+    wf_fw    = col_wf3.selectbox("Forward", ["1M", "3M"], index=0, key="wf_fw")
+    wf_params = {"tickers": mb_tickers, "benchmark": mb_bm, "start": str(mb_start),
+                 "train": wf_train, "test": wf_test, "fw": wf_fw}
+    wf_key    = result_key("walk_forward", wf_params)
+    if st.button("Avvia walk-forward", key="wf_run"):
+        submit_job("walk_forward", wf_params, run_walk_forward, panel_store=_panel_store())
+    wf_result = render_job(wf_key)
+    if wf_result is not None:
+        for w in wf_result["warnings"]:
+            st.warning(w)
+        wf_sum = wf_result["summary"].copy()
+        for c in ["Valore fisso", "Fit medio", "Fit min", "Fit max"]:
+            wf_sum[c] = [WF_TARGETS[n]["fmt"](v) if not pd.isna(v) else "—"
+                         for n, v in zip(wf_sum["Soglia"], wf_sum[c])]
+        for c in ["OOS fit", "OOS fissa"]:
+            wf_sum[c] = wf_sum[c].map(lambda x: f"{x*100:+.3f}%" if not pd.isna(x) else "—")
+        wf_sum["% fold fit > fissa"] = wf_sum["% fold fit > fissa"].map(
+            lambda x: f"{x*100:.0f}%" if not pd.isna(x) else "—")
+        st.dataframe(wf_sum, use_container_width=True, hide_index=True)
+        st.caption(f"{len(wf_result['folds'])} fold · OOS = metrica sul test successivo con la soglia "
+                   f"fittata vs quella fissa. ROS: spread forward {wf_fw} ciclici − difensivi "
+                   f"medio della posizione aperta a ogni seduta (non per seduta); MAC/fascia: Delta BM medio del gruppo "
+                   f"rispetto alla media. VOL_SCORE_MAP escluso: nessuno storico delle etichette volume.")
+        with st.expander("Dettaglio fold"):
+            st.dataframe(wf_result["folds"], use_container_width=True, hide_index=True)
+
+_profile_finish()
@@ -0,0 +1,1771 @@
+"""
+Indicatori puri (numpy/pandas, nessuna dipendenza da Streamlit).
+
+Modulo separato da app.py perché deve essere importabile dai processi worker
+del backtest multi-data: le funzioni definite nello script Streamlit non sono
+serializzabili per un ProcessPoolExecutor.
+"""
+import os
+import re
+import json
+import time
+import warnings
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory
+
+
+# ========================
+# HELPER — RSI (Wilder corretto)
+# ========================
+def compute_rsi(series: pd.Series, period: int = 14) -> float:
+    """
+    RSI Wilder corretto — identico a TradingView e alla formula Excel YAHOO_RSI.
+    Smoothing: media_precedente × (period-1) + valore_attuale) / period
+    """
+    s = series.dropna()
+    if len(s) < period + 1:
+        return np.nan
+
+    delta = s.diff().dropna()
+    gain  = delta.clip(lower=0)
+    loss  = (-delta.clip(upper=0))
+
+    # Prima media SMA sui primi 'period' valori (seed di Wilder)
+    avg_gain = float(gain.iloc[:period].mean())
+    avg_loss = float(loss.iloc[:period].mean())
+
+    # Smoothing di Wilder sui valori successivi
+    for i in range(period, len(gain)):
+        avg_gain = (avg_gain * (period - 1) + float(gain.iloc[i])) / period
+        avg_loss = (avg_loss * (period - 1) + float(loss.iloc[i])) / period
+
+    if avg_loss == 0:
+        return 100.0
+
+    rs = avg_gain / avg_loss
+    return round(100 - (100 / (1 + rs)), 2)
+
+
+def rsi_series(series: pd.Series, period: int = 14) -> pd.Series:
+    """
+    RSI di Wilder per ogni data, stesso seed SMA e smoothing di compute_rsi
+    (non arrotondato). Lo smoothing di Wilder è una EWM con alpha = 1/period
+    partita dal seed: nessun loop per data.
+    """
+    s = series.dropna()
+    if len(s) < period + 1:
+        return pd.Series(np.nan, index=series.index)
+    delta = s.diff().iloc[1:]
+    gain  = delta.clip(lower=0)
+    loss  = -delta.clip(upper=0)
+
+    def _wilder(x):
+        seeded = x.iloc[period - 1:].copy()
+        seeded.iloc[0] = x.iloc[:period].mean()
+        return seeded.ewm(alpha=1 / period, adjust=False).mean()
+
+    avg_gain, avg_loss = _wilder(gain), _wilder(loss)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsi = 100 - 100 / (1 + avg_gain / avg_loss)
+    rsi[avg_loss == 0] = 100.0
+    return rsi.reindex(series.index).ffill()
+
+
+# ========================
+# HELPER — MMS6M CON REGRESSIONE LINEARE
+# ========================
+def compute_mms6m_regression(r1w, r1m, r3m, r6m,
+                               pesi_lenta=(0.20, 0.35, 0.25, 0.20),  coeff_lenta=0.05,
+                               pesi_veloce=(0.30, 0.40, 0.25, 0.05), coeff_veloce=0.22):
+    """
+    MMS6M con correzione pendenza regressione lineare su 3 punti (1W, 1M, 3M).
+    Lenta  (coeff 0.05) = regime strutturale.
+    Veloce (coeff 0.22) = rotazione nascente.
+    Delta veloce-lenta  = accelerazione.
+    """
+    if any(np.isnan(v) for v in [r1w, r1m, r3m, r6m]):
+        return np.nan, np.nan, np.nan
+    base_lenta  = (r1w*pesi_lenta[0]  + r1m*pesi_lenta[1]  +
+                   r3m*pesi_lenta[2]  + r6m*pesi_lenta[3])
+    base_veloce = (r1w*pesi_veloce[0] + r1m*pesi_veloce[1] +
+                   r3m*pesi_veloce[2] + r6m*pesi_veloce[3])
+    x      = np.array([0.25, 1.0, 3.0])
+    y      = np.array([r1w,  r1m, r3m])
+    xm, ym = x.mean(), y.mean()
+    slope  = np.dot(x - xm, y - ym) / np.dot(x - xm, x - xm)
+    mms_lenta  = base_lenta  + slope * coeff_lenta
+    mms_veloce = base_veloce + slope * coeff_veloce
+    return mms_lenta, mms_veloce, mms_veloce - mms_lenta
+
+
+# ========================
+# PANNELLO ALLINEATO — calendario comune + maschera di validità
+# ========================
+# Un'unica matrice data × ticker sul calendario comune, con:
+#   count[t, j]  = sedute valide del ticker j fino alla riga t (inclusa)
+#   packed[k, j] = k-esimo prezzo valido del ticker j (NaN oltre la fine)
+# "N sedute fa" resta contato sulle sedute del singolo ticker, come nei vecchi
+# helper con dropna(), ma ogni lookback/lookahead è un gather packed[count-1-N, j]
+# per tutte le righe e tutti i ticker insieme, senza ricostruire serie.
+def aligned_panel(close):
+    """Pannello allineato (dict numpy) dal DataFrame close data × ticker (float32 resta float32)."""
+    dtype = np.float32 if len(close.columns) and (close.dtypes == np.float32).all() else np.float64
+    vals  = close.to_numpy(dtype=dtype, na_value=np.nan)
+    valid = ~np.isnan(vals)
+    count = valid.cumsum(axis=0)
+    n_valid = count[-1] if len(vals) else np.zeros(vals.shape[1], dtype=int)
+    r, c   = np.nonzero(valid)
+    packed = np.full((int(n_valid.max(initial=0)), vals.shape[1]), np.nan, dtype=dtype)
+    packed[count[r, c] - 1, c] = vals[r, c]
+    return {"index": close.index, "columns": list(close.columns),
+            "col": {t: j for j, t in enumerate(close.columns)},
+            "valid": valid, "count": count, "n_valid": n_valid, "packed": packed}
+
+
+def ap_row(ap, dates):
+    """Riga del calendario comune dell'ultima data ≤ dates (-1 se precedente all'inizio)."""
+    return ap["index"].searchsorted(dates, side="right") - 1
+
+
+def _ap_gather(ap, k):
+    """packed[k[..., j], j]; NaN dove k è fuori dalla serie del ticker."""
+    j  = np.broadcast_to(np.arange(k.shape[-1]), k.shape)
+    ok = (k >= 0) & (k < ap["n_valid"])
+    out = np.full(k.shape, np.nan, dtype=ap["packed"].dtype)
+    out[ok] = ap["packed"][k[ok], j[ok]]
+    return out
+
+
+def ap_returns(ap, rows, days):
+    """
+    Rendimento a `days` sedute del ticker all'ultima seduta valida ≤ riga.
+    rows scalare → array per ticker; rows array → matrice righe × ticker.
+    """
+    p = ap["count"][rows] - 1
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return _ap_gather(ap, p) / _ap_gather(ap, p - days) - 1
+
+
+def ap_maxdd(ap, rows, window):
+    """
+    Max drawdown sulle `window` sedute del ticker precedenti la riga (esclusa),
+    come la finestra iloc[end-window:end] sulla serie senza NaN; NaN sotto 10 sedute.
+    rows scalare → array per ticker; rows array → matrice righe × ticker.
+    """
+    end = ap["count"][rows] - ap["valid"][rows]                      # sedute valide prima della riga
+    k   = end[..., None] - window + np.arange(window)
+    w   = np.moveaxis(_ap_gather(ap, np.moveaxis(k, -1, 0)), 0, -1)  # ... × ticker × window
+    with np.errstate(invalid="ignore", divide="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        peak = np.fmax.accumulate(w, axis=-1)
+        dd   = np.nanmin((w - peak) / peak, axis=-1)
+    dd[(~np.isnan(w)).sum(axis=-1) < 10] = np.nan
+    return dd
+
+
+# ========================
+# PANNELLO COMPATTO — OHLCV colonnare float32
+# ========================
+# Alternativa opzionale al DataFrame MultiIndex float64 di yfinance: un array
+# float32 ticker × data per campo (storia di ogni ticker contigua), un indice
+# date condiviso e un dizionario ticker → riga. Metà memoria per la cache.
+OHLCV_FIELDS = ["Open", "High", "Low", "Close", "Volume"]
+
+
+def compact_panel(raw, fields=OHLCV_FIELDS):
+    """Download yfinance (MultiIndex campo × ticker) → pannello compatto."""
+    raw     = raw.dropna(how="all")
+    tickers = list(raw["Close"].columns)
+    return {"index": raw.index, "tickers": tickers,
+            "col": {t: j for j, t in enumerate(tickers)},
+            "fields": {f: np.ascontiguousarray(raw[f].reindex(columns=tickers)
+                                               .to_numpy(dtype=np.float32, na_value=np.nan).T)
+                       for f in fields if f in raw.columns.get_level_values(0)}}
+
+
+def compact_field(cp, field, tickers=None):
+    """Campo come DataFrame data × ticker (vista float32, senza copia se tickers è None)."""
+    arr = cp["fields"][field]
+    if tickers is None:
+        return pd.DataFrame(arr.T, index=cp["index"], columns=cp["tickers"], copy=False)
+    tickers = [t for t in tickers if t in cp["col"]]
+    return pd.DataFrame(arr[[cp["col"][t] for t in tickers]].T, index=cp["index"], columns=tickers)
+
+
+def compact_series(cp, field, ticker):
+    """Serie di un campo per un ticker (vista sulla riga contigua)."""
+    return pd.Series(cp["fields"][field][cp["col"][ticker]], index=cp["index"], name=ticker)
+
+
+def compact_nbytes(cp):
+    """Byte occupati dagli array dei campi."""
+    return sum(a.nbytes for a in cp["fields"].values())
+
+
+# ========================
+# RISK OFF EPISODES
+# ========================
+def compute_risk_off_episodes(series, threshold, confirm_days=3):
+    if series.empty:
+        return []
+    neg_threshold = -abs(threshold)
+    episodes, in_episode, ep_start, ep_confirmed = [], False, None, None
+    consec_below, consec_above = 0, 0
+    for date, val in series.items():
+        is_below = val < neg_threshold
+        if not in_episode:
+            if is_below:
+                consec_below += 1
+                if consec_below == 1:
+                    ep_start = date
+                if consec_below >= confirm_days:
+                    in_episode, ep_confirmed, consec_above = True, date, 0
+            else:
+                consec_below, ep_start = 0, None
+        else:
+            if not is_below:
+                consec_above += 1
+                if consec_above >= confirm_days:
+                    ep_slice = series[ep_start:date]
+                    episodes.append({"start": ep_start, "confirmed": ep_confirmed, "end": date,
+                                     "open": False, "duration": (date - ep_start).days,
+                                     "rs_min": round(float(ep_slice.min()), 2), "rs_min_date": ep_slice.idxmin()})
+                    in_episode, consec_below, consec_above, ep_start = False, 0, 0, None
+            else:
+                consec_above = 0
+    if in_episode and ep_start is not None:
+        ep_slice = series[ep_start:]
+        episodes.append({"start": ep_start, "confirmed": ep_confirmed, "end": None, "open": True,
+                          "duration": (series.index[-1] - ep_start).days,
+                          "rs_min": round(float(ep_slice.min()), 2), "rs_min_date": ep_slice.idxmin()})
+    return episodes
+
+
+# ========================
+# RISK OFF EPISODES — pannello (tutte le colonne in un passaggio)
+# ========================
+RS_DAYS = {"1W": 5, "1M": 21, "3M": 63, "6M": 126}
+
+
+def relative_strength_panel(close, tickers, benchmark, weights):
+    """Forza relativa pesata 1W/1M/3M/6M vs benchmark in % (formula ROS v2 per ticker)."""
+    tickers = [t for t in tickers if t in close.columns]
+    out = 0
+    for k, d in RS_DAYS.items():
+        r = close.pct_change(d, fill_method=None)
+        out = out + r[tickers].sub(r[benchmark], axis=0) * weights[k]
+    return out * 100
+
+
+def _run_length(on, off):
+    """Sedute consecutive True di `on` fino a ogni riga; `off` azzera, le righe né on né off (NaN) non contano."""
+    c = np.cumsum(on, axis=0)
+    return c - np.maximum.accumulate(np.where(off, c, 0), axis=0)
+
+
+def risk_off_episodes_panel(panel, thresholds, confirm_days=3):
+    """
+    compute_risk_off_episodes su ogni colonna di `panel` in un passaggio vettoriale.
+    thresholds: scalare, Series per colonna o DataFrame data × colonna.
+    L'automa a isteresi equivale a "ultimo evento": ingresso alla confirm_days-esima
+    seduta consecutiva sotto soglia, uscita alla confirm_days-esima sopra, stato
+    per ffill. Le date NaN di una colonna sono saltate (come la serie dropna).
+    Ritorna la lista episodi (chiavi di compute_risk_off_episodes + "ticker").
+    """
+    cols = list(panel.columns)
+    X    = panel.to_numpy(dtype=np.float64)
+    if isinstance(thresholds, pd.DataFrame):
+        thr = thresholds.reindex(index=panel.index, columns=cols).to_numpy(dtype=np.float64)
+    elif isinstance(thresholds, pd.Series):
+        thr = thresholds.reindex(cols).to_numpy(dtype=np.float64)
+    else:
+        thr = float(thresholds)
+    valid = ~np.isnan(X)
+    with np.errstate(invalid="ignore"):
+        below = valid & (X < -np.abs(thr))
+    above = valid & ~below
+    enter = below & (_run_length(below, above) == confirm_days)
+    leave = above & (_run_length(above, below) == confirm_days)
+    state = pd.DataFrame(np.where(enter, 1.0, np.where(leave, 0.0, np.nan))).ffill().fillna(0).to_numpy(bool)
+    prev  = np.vstack([np.zeros((1, len(cols)), dtype=bool), state[:-1]])
+    last_above = np.maximum.accumulate(np.where(above, np.arange(len(X))[:, None], -1), axis=0)
+
+    idx, episodes = panel.index, []
+    for j, t in enumerate(cols):
+        conf = np.flatnonzero(state[:, j] & ~prev[:, j])
+        ends = np.flatnonzero(~state[:, j] & prev[:, j])
+        if len(conf) == 0:
+            continue
+        rows_b  = np.flatnonzero(below[:, j])
+        s       = panel[t].dropna()
+        for n, c in enumerate(conf):
+            start = idx[rows_b[np.searchsorted(rows_b, last_above[c, j] + 1)]]
+            if n < len(ends):
+                end = idx[ends[n]]
+                sl  = s[start:end]
+                episodes.append({"ticker": t, "start": start, "confirmed": idx[c], "end": end,
+                                 "open": False, "duration": (end - start).days,
+                                 "rs_min": round(float(sl.min()), 2), "rs_min_date": sl.idxmin()})
+            else:
+                sl = s[start:]
+                episodes.append({"ticker": t, "start": start, "confirmed": idx[c], "end": None,
+                                 "open": True, "duration": (s.index[-1] - start).days,
+                                 "rs_min": round(float(sl.min()), 2), "rs_min_date": sl.idxmin()})
+    return episodes
+
+
+# ========================
+# TENSORE RENDIMENTI FORWARD (data × ticker × orizzonte)
+# ========================
+FW_MAX_H = 252
+
+
+def forward_tensor(close, max_h=FW_MAX_H, dates=None, ap=None):
+    """
+    Rendimenti forward a 1..max_h sedute per ogni (data, ticker), con un solo
+    gather sul pannello allineato (ap: aligned_panel(close) già calcolato).
+    Convenzione come il lookup originale: alla data si usa la seduta valida
+    corrente o successiva (searchsorted), poi si avanza di h sedute del ticker.
+    values[t, n, h-1] = rendimento a h sedute; NaN oltre la fine della serie.
+    """
+    index = close.index if dates is None else pd.DatetimeIndex(dates)
+    if close.empty:
+        return {"index": index, "columns": list(close.columns),
+                "values": np.full((len(index), close.shape[1], max_h), np.nan)}
+    ap    = aligned_panel(close) if ap is None else ap
+    r     = close.index.searchsorted(index)                             # prima riga ≥ data
+    start = np.where((r > 0)[:, None], ap["count"][np.maximum(r - 1, 0)], 0)
+    k     = start[:, :, None] + np.arange(max_h + 1)                    # data × ticker × (0..max_h)
+    g     = np.moveaxis(_ap_gather(ap, np.moveaxis(k, 1, -1)), -1, 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        vals = np.where(g[:, :, :1] != 0, g[:, :, 1:] / g[:, :, :1] - 1, np.nan)
+    return {"index": index, "columns": list(close.columns), "values": vals}
+
+
+def fw_panel(ft, h, tickers=None):
+    """Rendimento forward a h sedute (data × ticker) dal tensore."""
+    cols = ft["columns"] if tickers is None else [t for t in tickers if t in ft["columns"]]
+    j    = [ft["columns"].index(t) for t in cols]
+    return pd.DataFrame(ft["values"][:, j, h - 1], index=ft["index"], columns=cols)
+
+
+def fw_excess(ft, tickers, benchmark, h):
+    """Rendimento forward a h sedute meno quello del benchmark (data × ticker)."""
+    return fw_panel(ft, h, tickers).sub(fw_panel(ft, h, [benchmark])[benchmark], axis=0)
+
+
+def fw_curve(ft, tickers, benchmark, row=0):
+    """Curva Delta BM forward 1..max_h per una data (orizzonte × ticker)."""
+    j  = [ft["columns"].index(t) for t in tickers if t in ft["columns"]]
+    ex = ft["values"][row, j, :] - ft["values"][row, ft["columns"].index(benchmark), :]
+    return pd.DataFrame(ex.T, index=np.arange(1, ft["values"].shape[2] + 1),
+                        columns=[ft["columns"][k] for k in j])
+
+
+# ========================
+# BACKTEST MULTI-DATA — input per data calcolati una volta, righe per blocco
+# ========================
+# multidate_inputs costruisce una sola volta (pannello allineato, tensore forward,
+# RSI del benchmark) gli array data × ticker di tutte le date di riferimento;
+# multidate_block ne legge solo le righe del proprio blocco di date. Con il pool
+# di processi gli input stanno in shared memory e i worker non rifanno il setup.
+MB_LOOKBACKS = (5, 21, 63, 126)
+
+
+def multidate_inputs(mb_close, ref_dates, benchmark, fw_d):
+    """
+    Dict di array per data di riferimento (data effettiva = prima seduta ≥ data,
+    date oltre la fine del pannello scartate):
+      day (D,) giorni dall'epoch · rsi_bm (D,) RSI del benchmark alla data ·
+      ret (4, D, T) rendimenti a MB_LOOKBACKS sedute · dd (2, D, T) max drawdown
+      3M/6M · fw (D, T) rendimento forward a fw_d sedute.
+    """
+    pos = mb_close.index.searchsorted(pd.DatetimeIndex(ref_dates))
+    rr  = pos[pos < len(mb_close)]
+    ap  = aligned_panel(mb_close)
+    ft  = forward_tensor(mb_close, fw_d, dates=mb_close.index[rr], ap=ap)
+    if benchmark in mb_close.columns:
+        rsi_bm = np.round(rsi_series(mb_close[benchmark]).to_numpy(dtype=np.float64)[rr], 2)
+    else:
+        rsi_bm = np.full(len(rr), np.nan)
+    return {"day":    mb_close.index[rr].values.astype("datetime64[D]").astype(np.int64).astype(np.float64),
+            "rsi_bm": rsi_bm,
+            "ret":    np.stack([ap_returns(ap, rr, d) for d in MB_LOOKBACKS]).astype(np.float64),
+            "dd":     np.stack([ap_maxdd(ap, rr, 63), ap_maxdd(ap, rr, 126)]).astype(np.float64),
+            "fw":     ft["values"][:, :, fw_d - 1].astype(np.float64)}
+
+
+def multidate_block(inp, columns, lo, hi, tickers, benchmark, fw):
+    """
+    Indicatori + rendimento forward per ogni (data, ticker) delle date lo:hi
+    di multidate_inputs; columns = colonne del pannello da cui sono calcolati.
+    """
+    rows_mb = []
+    wts     = [0.20, 0.35, 0.25, 0.20]
+    col     = {t: j for j, t in enumerate(columns)}
+    j_bm    = col.get(benchmark)
+
+    # Pendenza profilo RSr su 4 TF (regressione log-lineare)
+    _log_days   = np.log(np.array([5., 21., 63., 126.]))
+    _log_days_c = _log_days - _log_days.mean()
+    _denom_slope = float(np.dot(_log_days_c, _log_days_c))
+
+    def _slope_mb(r1w, r1m, r3m, r6m):
+        vals = np.array([r1w, r1m, r3m, r6m])
+        if np.any(np.isnan(vals)): return np.nan
+        return float(np.dot(_log_days_c, vals) / _denom_slope)
+
+    for i_d in range(lo, hi):
+        day       = str(np.datetime64(int(inp["day"][i_d]), "D"))
+        rsi_bm_mb = float(inp["rsi_bm"][i_d])
+
+        def _rsr_mb(tk, days):
+            if j_bm is None: return np.nan
+            k = MB_LOOKBACKS.index(days)
+            rs = inp["ret"][k, i_d, col[tk]]; rb = inp["ret"][k, i_d, j_bm]
+            return float((1 + rs) / (1 + rb) - 1)
+
+        def _abs_mb(tk, days):
+            return float(inp["ret"][MB_LOOKBACKS.index(days), i_d, col[tk]])
+
+        for tk in tickers:
+            if tk not in col:
+                continue
+            j   = col[tk]
+            r1w = _rsr_mb(tk, 5);  r1m = _rsr_mb(tk, 21)
+            r3m = _rsr_mb(tk, 63); r6m = _rsr_mb(tk, 126)
+            vr  = [r1w, r1m, r3m, r6m]
+            mms_rsr = (sum(v*w for v,w in zip(vr,wts))
+                       if not any(np.isnan(v) for v in vr) else np.nan)
+
+            a1w = _abs_mb(tk, 5);  a1m = _abs_mb(tk, 21)
+            a3m = _abs_mb(tk, 63); a6m = _abs_mb(tk, 126)
+            va  = [a1w, a1m, a3m, a6m]
+
+            mms_r_l, mms_r_v, mms_r_d = compute_mms6m_regression(r1w, r1m, r3m, r6m)
+            mms_a_l, mms_a_v, mms_a_d = (compute_mms6m_regression(*va)
+                if not any(np.isnan(v) for v in va) else (np.nan, np.nan, np.nan))
+
+            ret_fw   = float(inp["fw"][i_d, j])
+            bm_fw    = float(inp["fw"][i_d, j_bm]) if j_bm is not None else np.nan
+            delta_bm = ((ret_fw - bm_fw)
+                        if not (np.isnan(ret_fw) or np.isnan(bm_fw)) else np.nan)
+
+            maxdd_3m_mb = float(inp["dd"][0, i_d, j])
+            maxdd_6m_mb = float(inp["dd"][1, i_d, j])
+
+            mme_mb = mms_a_l / (abs(maxdd_6m_mb) + 0.0001) if not np.isnan(maxdd_6m_mb) else np.nan
+
+            if not any(np.isnan(v) for v in [r1w, r1m, r3m]):
+                gemini_3m_mb = (r1w + (r1m - r1w) / 3 + (r3m - r1m) / 8) / 3
+                gte_mb = gemini_3m_mb / (abs(maxdd_3m_mb) + 0.0001) if not np.isnan(maxdd_3m_mb) else np.nan
+            else:
+                gte_mb = np.nan
+
+            # MAC — Marginal Absolute Contribution (stessa logica delle altre sezioni)
+            if not any(np.isnan(v) for v in [r1w, r1m, r3m, r6m]) and not np.isnan(maxdd_3m_mb):
+                marg_1w_mb = r1w
+                marg_1m_mb = r1m - r1w
+                marg_3m_mb = r3m - r1m
+                marg_6m_mb = r6m - r3m
+                mac_num_mb = marg_1w_mb * 0.4 + marg_1m_mb * 0.3 + marg_3m_mb * 0.2 + marg_6m_mb * 0.1
+                mac_mb = mac_num_mb / (abs(maxdd_3m_mb) + 0.0001)
+            else:
+                mac_mb = np.nan
+
+            # RSr Slope — pendenza profilo RSr su 4 TF
+            rsr_slope_mb = _slope_mb(
+                np.clip(r1w, -0.5, 0.5),
+                np.clip(r1m, -0.5, 0.5),
+                np.clip(r3m, -0.5, 0.5),
+                np.clip(r6m, -0.5, 0.5))
+            # Tact. Thrust e Mr Index (no r1d in Tab8 — approssimazione senza daily)
+            breve_mb = (r1m*0.60 + r1w*0.40
+                        if not any(np.isnan(v) for v in [r1m, r1w]) else np.nan)
+            medio_mb = (r1m*0.35 + r3m*0.25 + r6m*0.20 + r1w*0.20
+                        if not any(np.isnan(v) for v in [r1m, r3m, r6m, r1w]) else np.nan)
+            tt_mb = (breve_mb - medio_mb) if not (np.isnan(breve_mb) or np.isnan(medio_mb)) else np.nan
+            mr_mb = (breve_mb / (abs(medio_mb) + 2)) if not (np.isnan(breve_mb) or np.isnan(medio_mb)) else np.nan
+            rows_mb.append({
+                "Data":          day,
+                "Ticker":        tk,
+                "RSI BM":        round(rsi_bm_mb, 1) if not np.isnan(rsi_bm_mb) else np.nan,
+                "MMS6M RSr":     mms_rsr,
+                "MAC":           mac_mb,
+                "MMS6M React.":  mms_r_v,
+                "Δ React.":      mms_r_d,
+                "Tact. Thrust":  tt_mb,
+                "Mr Index":      mr_mb,
+                "MME":           mme_mb,
+                "GTE":           gte_mb,
+                "RSr Slope":     rsr_slope_mb,
+                "_S_minus_M":    mms_a_v - mms_a_l if not (np.isnan(mms_a_v) or np.isnan(mms_a_l)) else np.nan,
+                f"Rend +{fw}":     ret_fw,
+                f"Delta BM +{fw}": delta_bm,
+            })
+    return rows_mb
+
+
+def multidate_rows(mb_close, ref_dates, tickers, benchmark, fw, fw_d):
+    """Righe del backtest multi-data per ref_dates (setup e righe nello stesso processo)."""
+    inp = multidate_inputs(mb_close, ref_dates, benchmark, fw_d)
+    return multidate_block(inp, list(mb_close.columns), 0, len(inp["day"]), tickers, benchmark, fw)
+
+
+# ========================
+# INPUT IN SHARED MEMORY (worker del backtest multi-data)
+# ========================
+# Gli array di multidate_inputs vengono copiati una sola volta in un unico blocco
+# float64 di shared memory; i worker li mappano senza copia e leggono solo le
+# righe del proprio blocco di date.
+_ATTACHED = {}   # nome blocco → (SharedMemory, dict di array) nel processo worker
+
+
+def share_arrays(arrays):
+    """Copia un dict di array in un blocco di shared memory. Ritorna (blocco, meta) — il chiamante fa unlink()."""
+    fields, off = {}, 0
+    for k, a in arrays.items():
+        fields[k] = (off, tuple(np.shape(a)))
+        off += int(np.size(a))
+    shm = shared_memory.SharedMemory(create=True, size=max(1, off * 8))
+    buf = np.ndarray((off,), dtype=np.float64, buffer=shm.buf)
+    for k, a in arrays.items():
+        o, shape = fields[k]
+        buf[o:o + int(np.prod(shape, dtype=np.int64))] = np.asarray(a, dtype=np.float64).ravel()
+    return shm, {"name": shm.name, "size": off, "fields": fields}
+
+
+def attach_arrays(meta):
+    """Dict di array a copia zero sul blocco condiviso (cache per processo)."""
+    if meta["name"] not in _ATTACHED:
+        for shm_old, _ in _ATTACHED.values():
+            shm_old.close()
+        _ATTACHED.clear()
+        shm = shared_memory.SharedMemory(name=meta["name"])
+        buf = np.ndarray((meta["size"],), dtype=np.float64, buffer=shm.buf)
+        _ATTACHED[meta["name"]] = (shm, {k: buf[o:o + int(np.prod(shape, dtype=np.int64))].reshape(shape)
+                                         for k, (o, shape) in meta["fields"].items()})
+    return _ATTACHED[meta["name"]][1]
+
+
+def multidate_block_shared(meta, columns, lo, hi, tickers, benchmark, fw):
+    """Entry point dei worker: multidate_block sugli input condivisi."""
+    return multidate_block(attach_arrays(meta), columns, lo, hi, tickers, benchmark, fw)
+
+
+# ========================
+# PANNELLI MEMORY-MAPPED SU DISCO (condivisi tra sessioni e processi)
+# ========================
+# Stessa struttura del blocco in shared memory, ma in un file .npy immutabile
+# <nome>-<versione>.npy + .json (colonne); <nome>.current contiene la versione
+# attiva ed è sostituito atomicamente. Ogni sessione/processo mappa il file in
+# sola lettura (np.load mmap_mode="r"): le pagine stanno una volta sola nella
+# page cache, chi ha mappato una versione vecchia la legge finché non rimappa.
+def write_panel(df, path, meta=None):
+    """Pubblica df come nuova versione del pannello `path` (senza estensione), con meta JSON opzionale."""
+    dtype = np.float32 if len(df.columns) and (df.dtypes == np.float32).all() else np.float64
+    buf   = np.empty((len(df), df.shape[1] + 1), dtype=dtype)
+    buf[:, 0]  = df.index.values.astype("datetime64[D]").astype(np.int64)
+    buf[:, 1:] = df.to_numpy(dtype=dtype, na_value=np.nan)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    ver = f"{time.time_ns()}-{os.getpid()}"
+    np.save(f"{path}-{ver}.npy", buf)
+    with open(f"{path}-{ver}.json", "w") as f:
+        json.dump({"columns": [str(c) for c in df.columns], "meta": meta or {}}, f)
+    with open(f"{path}.current.tmp{os.getpid()}", "w") as f:
+        f.write(ver)
+    old = panel_version(path)
+    os.replace(f"{path}.current.tmp{os.getpid()}", f"{path}.current")
+    if old:                               # chi l'ha già mappata continua a leggerla
+        for ext in (".npy", ".json"):
+            try:
+                os.remove(f"{path}-{old}{ext}")
+            except OSError:
+                pass
+
+
+def panel_version(path):
+    """Versione attiva del pannello, None se non pubblicato."""
+    try:
+        with open(f"{path}.current") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def panel_meta(path):
+    """Meta della versione attiva ({} se assente)."""
+    ver = panel_version(path)
+    try:
+        with open(f"{path}-{ver}.json") as f:
+            return json.load(f).get("meta", {})
+    except (OSError, ValueError, TypeError):
+        return {}
+
+
+def panel_age(path):
+    """Secondi dalla pubblicazione della versione attiva (inf se assente)."""
+    try:
+        return time.time() - os.path.getmtime(f"{path}.current")
+    except OSError:
+        return float("inf")
+
+
+def map_panel(path):
+    """DataFrame in sola lettura sul file mappato della versione attiva (None se assente)."""
+    ver = panel_version(path)
+    if ver is None:
+        return None
+    try:
+        buf = np.load(f"{path}-{ver}.npy", mmap_mode="r")
+        with open(f"{path}-{ver}.json") as f:
+            cols = json.load(f)["columns"]
+    except (OSError, ValueError):         # versione sostituita nel frattempo
+        return None
+    idx = pd.DatetimeIndex(np.asarray(buf[:, 0]).astype(np.int64).astype("datetime64[D]"))
+    df  = pd.DataFrame(buf[:, 1:], index=idx, columns=cols, copy=False)
+    df.attrs["panel_version"] = ver
+    return df
+
+
+# ========================
+# CUBO ALPHA CONDIZIONATO (Tab 8)
+# ========================
+# Ogni fattore è una colonna di mb_df più una lista ordinata di fasce
+# (etichetta, operatore, soglia) valutate come un CASE SQL: prima condizione
+# vera vince, l'ultima fascia (operatore None) è il "resto".
+# La stessa definizione genera i codici numpy e le espressioni SQL dell'archivio.
+FACTOR_BUCKETS = {
+    "Quintile":   ("Pct MMS6M RSr", [("0–20°", "<=", 20), ("20–40°", "<=", 40), ("40–60°", "<=", 60),
+                                     ("60–80°", "<=", 80), ("80–100°", None, None)]),
+    "RSI Regime": ("RSI BM",        [("Bottom (≤29)", "<", 30), ("Ribasso attivo (30–44)", "<", 45),
+                                     ("Laterale (45–54)", "<", 55), ("Uptrend fresco (55–69)", "<", 70),
+                                     ("Uptrend maturo (≥70)", None, None)]),
+    "TT":         ("Tact. Thrust",  [("TT-", "<=", 0), ("TT+", None, None)]),
+    "Mr":         ("Mr Index",      [("Mr-", "<=", 0), ("Mr+", None, None)]),
+    "Slope":      ("RSr Slope",     [("Dec.", "<=", 0), ("Acc.", None, None)]),
+    "MAC":        ("MAC",           [("MAC<0", "<", 0), ("MAC 0-0.15", "<=", 0.15), ("MAC>0.15", None, None)]),
+    "Δ React.":   ("Δ React.",      [("Δ-", "<=", 0), ("Δ+", None, None)]),
+}
+
+_OPS = {"<": np.less, "<=": np.less_equal}
+
+
+def factor_codes(values, buckets):
+    """Codice fascia (0..k-1) per ogni valore; i NaN vanno filtrati prima."""
+    values = np.asarray(values, dtype=np.float64)
+    codes  = np.full(len(values), len(buckets) - 1, dtype=np.int64)
+    for i in range(len(buckets) - 2, -1, -1):     # a ritroso: vince la prima condizione vera
+        _, op, thr = buckets[i]
+        codes[_OPS[op](values, thr)] = i
+    return codes
+
+
+def cube_frame(factors, counts, sums, boot=None):
+    """
+    Celle non vuote del cubo in DataFrame: una colonna etichetta per fattore,
+    poi N, Rend medio, Delta BM medio, Hit rate (+ colonne bootstrap se `boot`).
+    counts: (n, n_delta); sums: (rend, delta, hit) — array piatti lunghi prod(k).
+    """
+    n, n_d        = counts
+    s_r, s_d, s_h = sums
+    shape = [len(FACTOR_BUCKETS[f][1]) for f in factors]
+    cells = np.flatnonzero(n > 0)
+    idx   = np.unravel_index(cells, shape)
+    out   = {f: [FACTOR_BUCKETS[f][1][c][0] for c in idx[j]] for j, f in enumerate(factors)}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out["N"]              = n[cells].astype(np.int64)
+        out["Rend medio"]     = s_r[cells] / n[cells]
+        out["Delta BM medio"] = np.where(n_d[cells] > 0, s_d[cells] / n_d[cells], np.nan)
+        out["Hit rate"]       = s_h[cells] / n[cells]
+    if boot is not None:
+        for k, v in boot.items():
+            out[k] = v[cells]
+    return pd.DataFrame(out)
+
+
+def _cube_rows(mb_df, factors, ret_col, delta_col):
+    """Righe valide del cubo: (codice data, codice cella, rend, delta, n date, n celle)."""
+    cols  = [FACTOR_BUCKETS[f][0] for f in factors]
+    r     = mb_df[ret_col].to_numpy(dtype=np.float64)
+    valid = ~np.isnan(r)
+    for c in cols:
+        valid &= ~np.isnan(mb_df[c].to_numpy(dtype=np.float64))
+    shape = [len(FACTOR_BUCKETS[f][1]) for f in factors]
+    codes = [factor_codes(mb_df[c].to_numpy(dtype=np.float64)[valid], FACTOR_BUCKETS[f][1])
+             for f, c in zip(factors, cols)]
+    cell  = np.ravel_multi_index(codes, shape) if codes else np.zeros(int(valid.sum()), dtype=np.int64)
+    dates, uniq = pd.factorize(mb_df["Data"].to_numpy()[valid], sort=True)
+    return (dates, cell, r[valid], mb_df[delta_col].to_numpy(dtype=np.float64)[valid],
+            len(uniq), int(np.prod(shape)))
+
+
+def date_cell_stats(dates, cell, r, d, n_dates, size):
+    """
+    Aggregati per (data, cella): array (5, n_dates, size) con
+    n, n_delta, somma rend, somma delta, somma hit.
+    """
+    key  = dates * size + cell
+    m    = n_dates * size
+    d_ok = ~np.isnan(d)
+    return np.stack([
+        np.bincount(key, minlength=m),
+        np.bincount(key, weights=d_ok, minlength=m),
+        np.bincount(key, weights=r, minlength=m),
+        np.bincount(key, weights=np.where(d_ok, d, 0.0), minlength=m),
+        np.bincount(key, weights=r > 0, minlength=m),
+    ]).astype(np.float64).reshape(5, n_dates, size)
+
+
+def bootstrap_cube(stats, n_boot=2000, block=1, seed=0, ci=0.95):
+    """
+    Block bootstrap sulle date di riferimento (blocchi circolari di `block` date
+    consecutive, per rispettare la sovrapposizione delle finestre forward).
+    Tutti i ricampionamenti sono una matrice B × D di pesi (quante volte ogni
+    data è estratta): le statistiche ricampionate sono prodotti matriciali.
+    Ritorna, per cella, IC del Delta BM medio e dell'hit rate e p-value
+    bilaterale del Delta BM medio (H0: media = 0).
+    Nota: con poche date per cella gli IC sono ottimistici — leggere insieme a N.
+    """
+    _, n_dates, size = stats.shape
+    rng     = np.random.default_rng(seed)
+    block   = int(min(max(block, 1), n_dates))
+    n_blk   = -(-n_dates // block)
+    starts  = rng.integers(0, n_dates, size=(n_boot, n_blk))
+    idx     = ((starts[:, :, None] + np.arange(block)) % n_dates).reshape(n_boot, -1)[:, :n_dates]
+    weights = np.bincount((np.arange(n_boot)[:, None] * n_dates + idx).ravel(),
+                          minlength=n_boot * n_dates).reshape(n_boot, n_dates).astype(np.float64)
+    n, n_d, _, s_d, s_h = (weights @ stats[k] for k in range(5))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        delta = np.where(n_d > 0, s_d / n_d, np.nan)
+        hit   = np.where(n > 0, s_h / n, np.nan)
+    q = [(1 - ci) / 2 * 100, (1 + ci) / 2 * 100]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)    # celle senza osservazioni
+        d_lo, d_hi = np.nanpercentile(delta, q, axis=0)
+        h_lo, h_hi = np.nanpercentile(hit, q, axis=0)
+        # correzione +1 (Davison–Hinkley): p mai nullo con B ricampionamenti finiti
+        valid = (~np.isnan(delta)).sum(axis=0) + 1
+        p_neg = ((delta <= 0).sum(axis=0) + 1) / valid
+        p_pos = ((delta >= 0).sum(axis=0) + 1) / valid
+    return {"Delta BM IC-": d_lo, "Delta BM IC+": d_hi,
+            "p Delta BM": np.minimum(1.0, 2 * np.minimum(p_neg, p_pos)),
+            "Hit IC-": h_lo, "Hit IC+": h_hi}
+
+
+def conditional_alpha_cube(mb_df, factors, ret_col, delta_col, n_boot=0, block=1):
+    """
+    N, rendimento medio, Delta BM medio e hit rate per ogni combinazione di fasce
+    dei fattori indicati (chiavi di FACTOR_BUCKETS), in un solo passaggio
+    vettoriale: codice di cella combinato + np.bincount.
+    Con n_boot > 0 aggiunge IC e p-value da bootstrap_cube.
+    """
+    factors = list(factors)
+    dates, cell, r, d, n_dates, size = _cube_rows(mb_df, factors, ret_col, delta_col)
+    stats = date_cell_stats(dates, cell, r, d, n_dates, size)
+    tot   = stats.sum(axis=1)
+    boot  = bootstrap_cube(stats, n_boot, block) if n_boot and n_dates > 1 else None
+    return cube_frame(factors, tot[:2], tot[2:], boot)
+
+
+# ========================
+# PANNELLI INDICATORI (data × ticker) — stessa logica di multidate_rows
+# ========================
+# Ogni indicatore di ranking calcolato per tutte le date in una volta, con
+# gather sul pannello allineato. Convenzioni identiche al loop per data: rendimenti
+# posizionali sulla serie senza NaN del singolo ticker (ultimo valore noto alla
+# data), max drawdown sulle `w` sedute precedenti la data (esclusa).
+IC_INDICATORS = ["MMS6M RSr", "MAC", "MMS6M React.", "Δ React.", "Tact. Thrust",
+                 "Mr Index", "MME", "GTE", "RSr Slope"]
+
+
+def _col_returns(s, days):
+    """Rendimento a `days` sedute sulla serie senza NaN, riallineato con ffill."""
+    v = s.dropna()
+    return (v / v.shift(days) - 1).reindex(s.index).ffill()
+
+
+def indicator_panels(close, tickers, benchmark):
+    """Dict indicatore → DataFrame data × ticker (più 'S minus M' assoluto e RSr per orizzonte)."""
+    tickers = [t for t in tickers if t in close.columns]
+    ap      = aligned_panel(close[tickers + [benchmark]])
+    rows    = np.arange(len(close))
+    days    = {"1w": 5, "1m": 21, "3m": 63, "6m": 126}
+
+    def _frame(a):
+        return pd.DataFrame(a[:, :len(tickers)], index=close.index, columns=tickers)
+
+    rets    = {k: ap_returns(ap, rows, d) for k, d in days.items()}
+    ra      = {k: _frame(rets[k]) for k in days}
+    rr      = {k: (1 + ra[k]).div(1 + rets[k][:, -1], axis=0) - 1 for k in days}
+    dd3     = _frame(ap_maxdd(ap, rows, 63))
+    dd6     = _frame(ap_maxdd(ap, rows, 126))
+
+    # Regressione su 3 punti (1W, 1M, 3M): la pendenza è lineare nei rendimenti
+    x = np.array([0.25, 1.0, 3.0])
+    c = (x - x.mean()) / np.dot(x - x.mean(), x - x.mean())
+
+    def _mms_reg(r, pesi, coeff):
+        slope = r["1w"] * c[0] + r["1m"] * c[1] + r["3m"] * c[2]
+        base  = r["1w"] * pesi[0] + r["1m"] * pesi[1] + r["3m"] * pesi[2] + r["6m"] * pesi[3]
+        return base + slope * coeff
+
+    lenta_r, veloce_r = _mms_reg(rr, (0.20, 0.35, 0.25, 0.20), 0.05), _mms_reg(rr, (0.30, 0.40, 0.25, 0.05), 0.22)
+    lenta_a, veloce_a = _mms_reg(ra, (0.20, 0.35, 0.25, 0.20), 0.05), _mms_reg(ra, (0.30, 0.40, 0.25, 0.05), 0.22)
+
+    log_c = np.log(np.array([5., 21., 63., 126.]))
+    log_c = log_c - log_c.mean()
+    slope = sum(rr[k].clip(-0.5, 0.5) * w for k, w in zip(days, log_c)) / float(np.dot(log_c, log_c))
+
+    breve = rr["1m"] * 0.60 + rr["1w"] * 0.40
+    medio = rr["1m"] * 0.35 + rr["3m"] * 0.25 + rr["6m"] * 0.20 + rr["1w"] * 0.20
+    mac   = ((rr["1w"] * 0.4 + (rr["1m"] - rr["1w"]) * 0.3 + (rr["3m"] - rr["1m"]) * 0.2
+              + (rr["6m"] - rr["3m"]) * 0.1) / (dd3.abs() + 0.0001))
+    gemini = (rr["1w"] + (rr["1m"] - rr["1w"]) / 3 + (rr["3m"] - rr["1m"]) / 8) / 3
+    return {
+        "MMS6M RSr":    rr["1w"] * 0.20 + rr["1m"] * 0.35 + rr["3m"] * 0.25 + rr["6m"] * 0.20,
+        "MAC":          mac,
+        "MMS6M React.": veloce_r,
+        "Δ React.":     veloce_r - lenta_r,
+        "Tact. Thrust": breve - medio,
+        "Mr Index":     breve / (medio.abs() + 2),
+        "MME":          lenta_a / (dd6.abs() + 0.0001),
+        "GTE":          gemini / (dd3.abs() + 0.0001),
+        "RSr Slope":    slope,
+        "S minus M":    veloce_a - lenta_a,
+        "RSr 1W":       rr["1w"],
+        "RSr 1M":       rr["1m"],
+        "RSr 3M":       rr["3m"],
+        "RSr 6M":       rr["6m"],
+    }
+
+
+# ========================
+# INFORMATION COEFFICIENT — Spearman cross-sectional per data
+# ========================
+def rank_ic(x, y, min_obs=5):
+    """
+    IC di Spearman per ogni riga (data) tra due pannelli data × ticker:
+    rank per riga sulle coppie valide, poi correlazione di Pearson per riga.
+    """
+    x, y  = x.align(y, join="inner")
+    mask  = x.notna() & y.notna()
+    rx    = x.where(mask).rank(axis=1).to_numpy()
+    ry    = y.where(mask).rank(axis=1).to_numpy()
+    n     = mask.sum(axis=1).to_numpy()
+    with np.errstate(invalid="ignore", divide="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        rx = rx - np.nanmean(rx, axis=1, keepdims=True)
+        ry = ry - np.nanmean(ry, axis=1, keepdims=True)
+        ic = np.nansum(rx * ry, axis=1) / np.sqrt(np.nansum(rx * rx, axis=1) * np.nansum(ry * ry, axis=1))
+    ic[n < min_obs] = np.nan
+    return pd.Series(ic, index=x.index)
+
+
+def ic_engine(panels, fwd, window=126):
+    """
+    panels: indicatore → data × ticker; fwd: orizzonte (sedute) → data × ticker.
+    Ritorna IC giornalieri per orizzonte, IC medio rolling, IC IR rolling,
+    profilo di decadimento (IC medio per orizzonte) e IC IR complessivo.
+    """
+    ic = {h: pd.DataFrame({k: rank_ic(p, f) for k, p in panels.items()}) for h, f in fwd.items()}
+    rolling_mean = {h: d.rolling(window, min_periods=window // 2).mean() for h, d in ic.items()}
+    rolling_ir   = {h: rolling_mean[h] / d.rolling(window, min_periods=window // 2).std()
+                    for h, d in ic.items()}
+    decay = pd.DataFrame({h: d.mean() for h, d in ic.items()})
+    ir    = pd.DataFrame({h: d.mean() / d.std() for h, d in ic.items()})
+    return {"ic": ic, "rolling_mean": rolling_mean, "rolling_ir": rolling_ir,
+            "decay": decay, "ir": ir}
+
+
+# ========================
+# DISPERSIONE CROSS-SETTORIALE — storico giornaliero
+# ========================
+# Stessi momenti di compute_cross_sector_dispersion (skew campionaria corretta,
+# std ddof=1, spread max−min), calcolati per riga sull'intero pannello.
+SKEW_LABELS = [(-0.5, "DISPERSIONE FAVOREVOLE", "#00ff55"),
+               (0.0,  "LIEVE DISPERSIONE",      "#88cc88"),
+               (0.5,  "MOMENTUM EQUILIBRATO",   "#ffaa00"),
+               (np.inf, "MOMENTUM CONCENTRATO", "#ff4422")]
+
+
+def dispersion_history(panel, min_n=5):
+    """DataFrame data × (skew, std, spread, n) dei valori cross-settoriali di `panel`."""
+    x = panel.to_numpy(dtype=np.float64)
+    n = (~np.isnan(x)).sum(axis=1).astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mean = np.nanmean(x, axis=1, keepdims=True)
+        std  = np.nanstd(x, axis=1, ddof=1)
+        z3   = np.nansum(((x - mean) / std[:, None]) ** 3, axis=1)
+        skew = np.where(std != 0, n / ((n - 1) * (n - 2)) * z3, np.nan)
+        spread = np.nanmax(x, axis=1) - np.nanmin(x, axis=1)
+    out = pd.DataFrame({"skew": skew, "std": std, "spread": spread, "n": n}, index=panel.index)
+    out.loc[n < min_n, ["skew", "std", "spread"]] = np.nan
+    return out
+
+
+def skew_label(skew):
+    """Etichetta SKEW_LABELS per ogni valore (None se NaN)."""
+    s = np.asarray(skew, dtype=np.float64)
+    k = np.searchsorted(np.array([b for b, _, _ in SKEW_LABELS[:-1]]), s, side="right")
+    lab = np.array([name for _, name, _ in SKEW_LABELS], dtype=object)[np.minimum(k, len(SKEW_LABELS) - 1)]
+    lab[np.isnan(s)] = None
+    return lab
+
+
+# ========================
+# RELATIVE ROTATION GRAPH — RS-Ratio / RS-Momentum per settore e data
+# ========================
+# rs = prezzo / benchmark smussato (EMA); RS-Ratio = 100 + z-score di rs sulla
+# finestra mobile; RS-Momentum = 100 + z-score della variazione del RS-Ratio.
+# Tutto per colonna sull'intero pannello: le code si ottengono per slicing.
+RRG_WINDOW = 63
+RRG_SMOOTH = 10
+RRG_MOM    = 10
+RRG_QUADRANTS = {"LEADER": "#00ff55", "IMPROVING": "#44aaff",
+                 "WEAKENING": "#ffaa00", "LAGGARD": "#ff4422"}
+
+
+def _rolling_z(df, window):
+    mean = df.rolling(window, min_periods=window // 2).mean()
+    std  = df.rolling(window, min_periods=window // 2).std()
+    return (df - mean) / std.where(std != 0)
+
+
+def rrg_panels(close, tickers, benchmark, window=RRG_WINDOW, smooth=RRG_SMOOTH, mom=RRG_MOM):
+    """Dict index / tickers / ratio / momentum (array data × ticker)."""
+    tickers = [t for t in tickers if t in close.columns and t != benchmark]
+    rs    = close[tickers].div(close[benchmark], axis=0).ewm(span=smooth, ignore_na=True).mean()
+    ratio = 100 + _rolling_z(rs, window)
+    momentum = 100 + _rolling_z(ratio.diff(mom), window)
+    return {"index": close.index, "tickers": tickers,
+            "ratio": ratio.to_numpy(dtype=np.float64), "momentum": momentum.to_numpy(dtype=np.float64)}
+
+
+def rrg_quadrant(ratio, momentum):
+    """Quadrante RRG per ogni coppia (None se NaN)."""
+    r, m = np.asarray(ratio, dtype=np.float64), np.asarray(momentum, dtype=np.float64)
+    q = np.where(r >= 100, np.where(m >= 100, "LEADER", "WEAKENING"),
+                 np.where(m >= 100, "IMPROVING", "LAGGARD")).astype(object)
+    q[np.isnan(r) | np.isnan(m)] = None
+    return q
+
+
+# ========================
+# PERCENTILE STORICO MOBILE — ogni indicatore rispetto alla propria storia
+# ========================
+# Per ogni serie i valori validi sono compattati (NaN saltati) e ogni data è
+# confrontata con la propria finestra (sliding_window_view, nessuna copia):
+# conteggio di minori e uguali in numpy, nessun loop Python per elemento.
+# Per le tabelle serve solo l'ultima data: percentile_latest guarda una finestra.
+PCT_INDICATORS = ["MMS6M RSr", "MAC", "MMS6M React.", "Δ React.", "Tact. Thrust", "Mr Index", "MME", "GTE"]
+PCT_WINDOW     = 252
+
+
+def rolling_percentile(values, window=PCT_WINDOW, min_obs=None):
+    """
+    Percentile (0–100, mid-rank sui pari merito) di ogni valore tra le ultime
+    `window` osservazioni valide, incluso il valore stesso. NaN saltati.
+    """
+    min_obs = window // 4 if min_obs is None else min_obs
+    v   = np.asarray(values, dtype=np.float64)
+    out = np.full(len(v), np.nan)
+    ok  = ~np.isnan(v)
+    x   = v[ok]
+    if not len(x):
+        return out
+    # riga i = ultime `window` osservazioni valide fino a x[i] (NaN di riempimento in testa)
+    win = np.lib.stride_tricks.sliding_window_view(np.concatenate([np.full(window - 1, np.nan), x]), window)
+    n   = np.minimum(np.arange(1, len(x) + 1), window)
+    lo  = (win < x[:, None]).sum(axis=1)
+    eq  = (win == x[:, None]).sum(axis=1)
+    pct = 100.0 * (lo + 0.5 * eq) / n
+    pct[n < min_obs] = np.nan
+    out[ok] = pct
+    return out
+
+
+def latest_percentile(values, window=PCT_WINDOW, min_obs=None):
+    """Come rolling_percentile(...)[-1], calcolato sulla sola ultima finestra."""
+    min_obs = window // 4 if min_obs is None else min_obs
+    v = np.asarray(values, dtype=np.float64)
+    if not len(v) or np.isnan(v[-1]):
+        return np.nan
+    win = v[~np.isnan(v)][-window:]
+    if len(win) < min_obs:
+        return np.nan
+    return 100.0 * ((win < v[-1]).sum() + 0.5 * (win == v[-1]).sum()) / len(win)
+
+
+def percentile_panels(panels, window=PCT_WINDOW, indicators=PCT_INDICATORS):
+    """Dict indicatore → percentile mobile data × ticker."""
+    return {k: pd.DataFrame({t: rolling_percentile(panels[k][t].to_numpy(), window) for t in panels[k].columns},
+                            index=panels[k].index)
+            for k in indicators if k in panels}
+
+
+def percentile_latest(panels, window=PCT_WINDOW, indicators=PCT_INDICATORS):
+    """Dict indicatore → percentile dell'ultima data per ticker (ultima riga di percentile_panels)."""
+    return {k: pd.Series({t: latest_percentile(panels[k][t].to_numpy(), window) for t in panels[k].columns},
+                         dtype=np.float64)
+            for k in indicators if k in panels}
+
+
+def table_panels(close, tickers, benchmark):
+    """
+    indicator_panels con le definizioni delle tabelle Tab 5/6: Tact. Thrust e
+    Mr Index usano il breve con RSr 1D (50/35/15) invece di 1M/1W (60/40).
+    """
+    p     = dict(indicator_panels(close, tickers, benchmark))
+    rb1   = _col_returns(close[benchmark], 1)
+    r1d   = pd.DataFrame({t: (1 + _col_returns(close[t], 1)) / (1 + rb1) - 1 for t in p["RSr 1W"].columns})
+    breve = p["RSr 1M"] * 0.50 + p["RSr 1W"] * 0.35 + r1d * 0.15
+    medio = p["RSr 1M"] * 0.35 + p["RSr 3M"] * 0.25 + p["RSr 6M"] * 0.20 + p["RSr 1W"] * 0.20
+    p["Tact. Thrust"] = breve - medio
+    p["Mr Index"]     = breve / (medio.abs() + 2)
+    return p
+
+
+# ========================
+# SIMULATORE ROTAZIONE — portafoglio giornaliero da pannello segnali
+# ========================
+def operativita_panel(close, tickers, benchmark, weights):
+    """
+    Operatività storica (logica Tab 1) per ogni data: Classifica per Rsr_momentum,
+    Coerenza_Trend su 1D/1W/1M/3M/6M. Segnale = Rsr_momentum dove LEADER o HOLD
+    (Classifica ≤ 3 e Coerenza ≥ 4), NaN altrove.
+    """
+    tickers = [t for t in tickers if t in close.columns]
+    days    = {"1D": 1, "1W": 5, "1M": 21, "3M": 63, "6M": 126}
+    rb      = {k: _col_returns(close[benchmark], d) for k, d in days.items()}
+    rr      = {k: pd.DataFrame({t: _col_returns(close[t], d) for t in tickers}).add(1)
+                  .div(1 + rb[k], axis=0) - 1 for k, d in days.items()}
+    mom     = sum(rr[k] * w for k, w in weights.items())
+    coer    = sum((rr[k] > 0).astype(int) for k in days)
+    classif = mom.rank(axis=1, ascending=False, method="first")
+    return mom.where((classif <= 3) & (coer >= 4))
+
+
+def select_weights(signal, rule, n=3, threshold=0.0):
+    """Pesi target equal-weight: primi n per segnale ("top") o segnale > soglia ("soglia")."""
+    if rule == "top":
+        sel = signal.rank(axis=1, ascending=False, method="first") <= n
+    else:
+        sel = signal > threshold
+    sel = sel & signal.notna()
+    return sel.div(sel.sum(axis=1).where(lambda k: k > 0), axis=0).fillna(0.0)
+
+
+def simulate_rotation(close, target, rebalance=21, cost_bps=10.0):
+    """
+    Portafoglio giornaliero: pesi target (data × ticker, decisi in chiusura) applicati
+    ogni `rebalance` sedute, deriva dei pesi tra un ribilanciamento e l'altro,
+    quota non investita in cash. Tutto con operazioni su array: la crescita di
+    ogni posizione dall'ultimo ribilanciamento è exp(L_t − L_s) con L = cumsum log(1+r).
+    Ritorna DataFrame con Rend (netto costi), Equity, Drawdown, Turnover.
+    """
+    R   = close.ffill().pct_change().fillna(0.0).to_numpy(dtype=np.float64)
+    W   = target.reindex(index=close.index, columns=close.columns).fillna(0.0).to_numpy(dtype=np.float64)
+    T   = len(R)
+    reb = np.zeros(T, dtype=bool)
+    reb[::max(int(rebalance), 1)] = True
+    seg = np.maximum.accumulate(np.where(reb, np.arange(T), 0))      # ultimo ribilanciamento ≤ t
+    L   = np.cumsum(np.log1p(R), axis=0)
+
+    def _drift(s):
+        v = W[s] * np.exp(L - L[s])
+        return v / (v.sum(axis=1) + 1.0 - W[s].sum(axis=1))[:, None]
+
+    H = _drift(seg)                                   # pesi in chiusura t (dopo ribilanciamento)
+    D = _drift(np.r_[0, seg[:-1]])                    # pesi in chiusura t prima del ribilanciamento
+    rp = np.zeros(T)
+    rp[1:] = (H[:-1] * R[1:]).sum(axis=1)
+    turnover    = np.where(reb, np.abs(W - D).sum(axis=1), 0.0)
+    turnover[0] = np.abs(W[0]).sum()
+    r_net  = rp - turnover * cost_bps / 1e4
+    equity = np.cumprod(1 + r_net)
+    return pd.DataFrame({"Rend": r_net, "Equity": equity,
+                         "Drawdown": equity / np.maximum.accumulate(equity) - 1,
+                         "Turnover": turnover}, index=close.index)
+
+
+def sim_stats(sim, periods=252):
+    """CAGR, volatilità, Sharpe (rf = 0), max drawdown, turnover annuo."""
+    years = max(len(sim) / periods, 1e-9)
+    r     = sim["Rend"]
+    vol   = r.std() * np.sqrt(periods)
+    return {"CAGR":          sim["Equity"].iloc[-1] ** (1 / years) - 1,
+            "Vol":           vol,
+            "Sharpe":        r.mean() * periods / vol if vol > 0 else np.nan,
+            "Max DD":        sim["Drawdown"].min(),
+            "Turnover annuo": sim["Turnover"].sum() / years}
+
+
+# ========================
+# WALK-FORWARD SOGLIE — fit su finestra di training, verifica out-of-sample
+# ========================
+# Ogni soglia ha una griglia di candidati e una metrica vettoriale sull'intera
+# griglia (nessun loop sui candidati). Dati di input già pronti (pannelli in
+# cache): il costo di un fold è solo la valutazione della griglia.
+def ros_threshold_metric(ros, spread, grid):
+    """
+    Regime ROS con soglia ±θ → posizione +1/−1/0 sullo spread forward
+    ciclici − difensivi. Metrica: spread forward medio (sull'intero orizzonte
+    forward, non per seduta) della posizione presa a ogni data, per ogni θ.
+    """
+    ok = ~(np.isnan(ros) | np.isnan(spread))
+    if not ok.any():
+        return np.full(len(grid), np.nan)
+    r, y = ros[ok], spread[ok]
+    pos  = np.where(r[None, :] > grid[:, None], 1.0, np.where(r[None, :] < -grid[:, None], -1.0, 0.0))
+    return (pos * y).mean(axis=1)
+
+
+def _sorted_sums(x, y):
+    ok    = ~(np.isnan(x) | np.isnan(y))
+    order = np.argsort(x[ok], kind="stable")
+    xs, ys = x[ok][order], y[ok][order]
+    return xs, np.concatenate([[0.0], np.cumsum(ys)])
+
+
+def cutoff_metric(x, y, grid, min_frac=0.05):
+    """Delta medio di y per x > c rispetto alla media totale, per ogni c (prefix sum)."""
+    xs, cs = _sorted_sums(x, y)
+    n = len(xs)
+    if n == 0:
+        return np.full(len(grid), np.nan)
+    i   = np.searchsorted(xs, grid, side="right")
+    cnt = n - i
+    with np.errstate(invalid="ignore", divide="ignore"):
+        m = (cs[-1] - cs[i]) / cnt - cs[-1] / n
+    return np.where(cnt >= max(1, min_frac * n), m, np.nan)
+
+
+def band_metric(x, y, lows, width=20.0, min_frac=0.05):
+    """Delta medio di y per lo < x ≤ lo + width rispetto alla media totale, per ogni lo."""
+    xs, cs = _sorted_sums(x, y)
+    n = len(xs)
+    if n == 0:
+        return np.full(len(lows), np.nan)
+    i0  = np.searchsorted(xs, lows, side="right")
+    i1  = np.searchsorted(xs, lows + width, side="right")
+    cnt = i1 - i0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        m = (cs[i1] - cs[i0]) / cnt - cs[-1] / n
+    return np.where(cnt >= max(1, min_frac * n), m, np.nan)
+
+
+WF_TARGETS = {
+    "Soglia regime ROS": {"grid": np.round(np.arange(0.25, 4.01, 0.25), 2), "fixed": 1.5,
+                          "metric": ros_threshold_metric, "fmt": lambda v: f"±{v:.2f}"},
+    "Banda MAC forte":   {"grid": np.round(np.arange(0.0, 0.501, 0.025), 3), "fixed": 0.15,
+                          "metric": cutoff_metric, "fmt": lambda v: f"> {v:.3f}"},
+    "Fascia quintile MMS6M": {"grid": np.arange(0.0, 80.1, 10.0), "fixed": 60.0,
+                              "metric": band_metric, "fmt": lambda v: f"{v:.0f}–{v + 20:.0f}°"},
+}
+
+
+def walk_forward_folds(index, train, test, purge=0):
+    """
+    Finestre mobili sulle sedute di `index`: training di `train` sedute (ultime
+    `purge` escluse: i loro rendimenti forward cadono nel test), test sulle
+    `test` sedute successive. Ritorna (inizio train, fine train, inizio test, fine test).
+    """
+    folds, s = [], 0
+    while s + train + test <= len(index):
+        folds.append((index[s], index[s + train - purge - 1], index[s + train], index[s + train + test - 1]))
+        s += test
+    return folds
+
+
+def wf_fold(folds, calendars, data):
+    """
+    Un fold per tutte le soglie. calendars: nome → indice delle sedute; folds:
+    nome calendario → fold di walk_forward_folds su quelle stesse sedute; data:
+    nome soglia → (x, y, calendario) con x, y array data × … allineati al
+    calendario. Ritorna fit e metriche OOS (fit vs fissa).
+    """
+    row = {}
+    for cal, (tr0, tr1, te0, te1) in folds.items():
+        row[f"Train {cal}"] = f"{tr0:%Y-%m-%d} → {tr1:%Y-%m-%d}"
+        row[f"Test {cal}"]  = f"{te0:%Y-%m-%d} → {te1:%Y-%m-%d}"
+    for name, (x, y, cal) in data.items():
+        spec  = WF_TARGETS[name]
+        grid  = spec["grid"]
+        index = calendars[cal]
+        tr0, tr1, te0, te1 = folds[cal]
+        a, b = index.searchsorted(tr0), index.searchsorted(tr1, side="right")
+        c, d = index.searchsorted(te0), index.searchsorted(te1, side="right")
+        m_tr = spec["metric"](x[a:b].ravel(), y[a:b].ravel(), grid)
+        if np.all(np.isnan(m_tr)):
+            row[name], row[f"{name} OOS fit"], row[f"{name} OOS fissa"] = np.nan, np.nan, np.nan
+            continue
+        best = grid[int(np.nanargmax(m_tr))]
+        m_te = spec["metric"](x[c:d].ravel(), y[c:d].ravel(), np.array([best, spec["fixed"]]))
+        row[name], row[f"{name} OOS fit"], row[f"{name} OOS fissa"] = best, m_te[0], m_te[1]
+    return row
+
+
+# ========================
+# ANALOGHI STORICI — kNN sul vettore di stato giornaliero
+# ========================
+# Indice = matrice grezza data × feature + somme per colonna (media e std dello
+# z-score). analog_update accoda le nuove sedute senza ricalcolare le feature
+# storiche: vale solo se le righe già indicizzate non sono cambiate (stesso
+# storico prezzi); con prezzi rivisti va ricostruito con analog_index.
+# La ricerca è una distanza euclidea vettoriale.
+ANALOG_FEATURES = ["ROS v2", "Banda", "Δ Banda", "RSI BM", "Dispersione", "Spread RSI C-D"]
+
+
+def analog_features(close, benchmark, cyclical, defensive, ros, band, band_deriv):
+    """
+    Feature giornaliere (data × ANALOG_FEATURES). ros, band, band_deriv sono le
+    serie già calcolate da app.py; dispersione = std cross-settoriale del
+    rendimento relativo 1M (in %), spread = RSI medio ciclici − difensivi.
+    """
+    sectors = [t for t in cyclical + defensive if t in close.columns]
+    rsi     = pd.DataFrame({t: rsi_series(close[t]) for t in sectors + [benchmark]})
+    rb      = _col_returns(close[benchmark], 21)
+    rel     = pd.DataFrame({t: _col_returns(close[t], 21) for t in sectors}).sub(rb, axis=0)
+    cyc     = [t for t in cyclical if t in sectors]
+    dif     = [t for t in defensive if t in sectors]
+    return pd.DataFrame({
+        "ROS v2":         ros,
+        "Banda":          band,
+        "Δ Banda":        band_deriv,
+        "RSI BM":         rsi[benchmark],
+        "Dispersione":    rel.std(axis=1) * 100,
+        "Spread RSI C-D": rsi[cyc].mean(axis=1) - rsi[dif].mean(axis=1),
+    }, index=close.index)[ANALOG_FEATURES]
+
+
+def analog_index(feats):
+    """Indice dalle sole date con tutte le feature valide."""
+    f = feats.dropna()
+    X = f.to_numpy(dtype=np.float64)
+    return {"dates": f.index, "X": X, "s1": X.sum(axis=0), "s2": (X ** 2).sum(axis=0)}
+
+
+def analog_update(index, feats):
+    """
+    Aggiunge le date nuove. L'ultima seduta indicizzata viene sostituita
+    (barra intraday ancora in formazione al build precedente). Le somme sono
+    ricalcolate dalla matrice: stesso risultato di analog_index sullo storico
+    completo, purché le righe precedenti non siano cambiate.
+    """
+    if len(index["dates"]) == 0:
+        return analog_index(feats)
+    last = index["dates"][-1]
+    new  = feats.dropna()
+    new  = new[new.index >= last]
+    if new.empty:
+        return index
+    keep = len(index["dates"]) - 1
+    X    = np.vstack([index["X"][:keep], new.to_numpy(dtype=np.float64)])
+    return {"dates": index["dates"][:keep].append(new.index), "X": X,
+            "s1": X.sum(axis=0), "s2": (X ** 2).sum(axis=0)}
+
+
+def analog_search(index, k=10, query=-1, exclude=40, min_gap=10):
+    """
+    k date più simili alla riga `query` (z-score, distanza euclidea). Escluse
+    le `exclude` sedute prima della query e tutte le successive; i vicini sono
+    distanziati di almeno `min_gap` sedute (niente k giorni dello stesso episodio).
+    Ritorna (posizioni, distanze).
+    """
+    X  = index["X"]
+    n  = len(X)
+    q  = query % n
+    mu = index["s1"] / n
+    sd = np.sqrt(np.maximum(index["s2"] / n - mu ** 2, 0))
+    sd[sd == 0] = 1.0
+    Z  = (X - mu) / sd
+    d  = np.sqrt(((Z - Z[q]) ** 2).sum(axis=1))
+    d[max(0, q - exclude):] = np.inf
+    pos = []
+    for p in np.argsort(d, kind="stable"):
+        if not np.isfinite(d[p]) or len(pos) == k:
+            break
+        if all(abs(p - c) >= min_gap for c in pos):
+            pos.append(int(p))
+    pos = np.array(pos, dtype=int)
+    return pos, d[pos]
+
+
+# ========================
+# DATASET EPISODI — rigenerazione di backtest_patterns.json dai prezzi
+# ========================
+# Stesso schema del file curato a mano. Regole:
+#  - episodi: compute_risk_off_episodes sulla serie ROS v2 (solo episodi chiusi
+#    con SPY +40 sedute già disponibile);
+#  - bottom SPY: minimo di chiusura tra EP_SPY_LOOKBACK sedute prima dell'inizio
+#    e la fine episodio; swing = primo minimo locale su ±EP_SWING sedute nella
+#    stessa finestra; performance misurate dal bottom SPY;
+#  - indicatori alla data del minimo RS; ief_shy = RSI 14 del rapporto IEF/SHY;
+#  - top successivo: massimo ROS tra fine episodio e inizio del successivo
+#    (al più EP_TOP_WINDOW sedute).
+# Pattern e note dal template per gli episodi che coincidono con quelli curati
+# (altrimenti pattern da classify_patterns);
+# statistiche, payoff e nota timing ricalcolati.
+EP_SPY_LOOKBACK = 10
+EP_SWING        = 10
+EP_TOP_WINDOW   = 126
+EP_MATCH_DAYS   = 10
+EP_MACRO        = {"vix": "^VIX", "move": "^MOVE", "ief": "IEF", "shy": "SHY"}
+
+
+def _r2(v):
+    """Float arrotondato per il JSON (None se mancante)."""
+    return None if v is None or not np.isfinite(v) else round(float(v), 2)
+
+
+def episode_esito(p20, p40):
+    """Classe di esito come nel dataset curato."""
+    if p40 < 0:   return "negativo"
+    if p40 >= 10: return "positivo_forte"
+    if p20 < 1:   return "positivo_lento"
+    return "positivo"
+
+
+def _episode_pattern(ind, patterns):
+    """Pattern di un episodio non curato dal classificatore (rs_min = minimo episodio)."""
+    label = classify_patterns(pd.DataFrame([ind]), patterns).iloc[0] if patterns else PATTERN_NONE
+    return "n/d" if label == PATTERN_NONE else label
+
+
+def _episode_stats(episodi):
+    """statistiche_aggregate ricalcolate, note comprese."""
+    pos = [e for e in episodi if e["esito"].startswith("positivo")]
+
+    def _mean(vals):
+        return round(float(np.mean(vals)), 2) if vals else 0.0
+
+    stats = {
+        "episodi_totali":             len(episodi),
+        "episodi_positivi":           len(pos),
+        "episodi_negativi":           len(episodi) - len(pos),
+        "win_rate":                   f"{100 * len(pos) / len(episodi):.0f}%" if episodi else "n/d",
+        "spy_perf_20_media_tutti":    _mean([e["spy_perf_20"] for e in episodi]),
+        "spy_perf_40_media_tutti":    _mean([e["spy_perf_40"] for e in episodi]),
+        "spy_perf_20_media_positivi": _mean([e["spy_perf_20"] for e in pos]),
+        "spy_perf_40_media_positivi": _mean([e["spy_perf_40"] for e in pos]),
+        "durata_media_gg":            round(float(np.mean([e["durata_gg"] for e in episodi])), 1) if episodi else 0.0,
+        "durata_max_gg":              max((e["durata_gg"] for e in episodi), default=0),
+        "rs_min_storico":             min((e["rs_min"] for e in episodi), default=0.0),
+        "rs_min_medio":               _mean([e["rs_min"] for e in episodi]),
+        "delta_rs_spy_medio_gg":      int(round(np.mean([e["delta_rs_spy_gg"] for e in episodi]))) if episodi else 0,
+        "qualita_top_veri":           sum(e["top_successivo"]["qualita"] == "VERO" for e in episodi),
+        "qualita_top_tecnici":        sum(e["top_successivo"]["qualita"] == "TECNICO" for e in episodi),
+    }
+    d = stats["delta_rs_spy_medio_gg"]
+    stats["nota_qualita_top"] = (f"{stats['qualita_top_veri']} top VERI e {stats['qualita_top_tecnici']} "
+                                 f"TECNICI su {len(episodi)} episodi.")
+    stats["nota_timing"] = (f"In media il RS tocca il fondo {abs(d)} giorni "
+                            f"{'prima' if d >= 0 else 'dopo'} il bottom SPY.")
+    return stats
+
+
+def build_episode_dataset(ros, close, benchmark, cyclical, defensive, threshold,
+                          confirm_days=5, template=None, macro=None, aggiornato=None):
+    """
+    Dict nello schema di backtest_patterns.json. ros: serie ROS v2; close: prezzi
+    settori + benchmark; macro: DataFrame opzionale con le colonne di EP_MACRO
+    (campi a None se assenti); template: JSON curato da cui copiare definizioni,
+    pattern, regole e note.
+    """
+    template = template or {}
+    macro    = pd.DataFrame(index=close.index) if macro is None else macro
+    ros      = ros.dropna()
+    spy      = close[benchmark].dropna()
+    sectors  = [t for t in cyclical + defensive if t in close.columns]
+    rsi      = pd.DataFrame({t: rsi_series(close[t]) for t in sectors + [benchmark]})
+    rsi_cyc  = rsi[[t for t in cyclical if t in sectors]].mean(axis=1)
+    rsi_def  = rsi[[t for t in defensive if t in sectors]].mean(axis=1)
+    pivot    = spy == spy.rolling(2 * EP_SWING + 1, center=True, min_periods=1).min()
+
+    def _macro(col, date):
+        name = EP_MACRO[col]
+        return macro[name].asof(date) if name in macro.columns and not macro[name].dropna().empty else np.nan
+
+    ief_shy = (rsi_series(macro[EP_MACRO["ief"]] / macro[EP_MACRO["shy"]])
+               if {EP_MACRO["ief"], EP_MACRO["shy"]} <= set(macro.columns) else pd.Series(dtype=float))
+
+    found   = compute_risk_off_episodes(ros, threshold, confirm_days=confirm_days)
+    closed  = [e for e in found if not e["open"]]
+    bottoms = []
+    for ep in closed:
+        a = max(0, spy.index.searchsorted(ep["start"]) - EP_SPY_LOOKBACK)
+        b = spy.index.searchsorted(ep["end"], side="right")
+        win = spy.iloc[a:b]
+        piv = win[pivot.iloc[a:b]]
+        bottoms.append((win.idxmin(), piv.index[0] if not piv.empty else win.idxmin()))
+    ft = forward_tensor(close[[benchmark]], 40, dates=[b for b, _ in bottoms])
+
+    curated  = template.get("episodi", [])
+    episodi  = []
+    for i, (ep, (spy_bot, swing)) in enumerate(zip(closed, bottoms)):
+        p20, p40 = ft["values"][i, 0, 19] * 100, ft["values"][i, 0, 39] * 100
+        if not np.isfinite(p40):
+            continue
+        nxt   = next((e["start"] for e in found if e["start"] > ep["end"]), None)
+        after = ros[ros.index > ep["end"]].iloc[:EP_TOP_WINDOW]
+        if nxt is not None:
+            after = after[after.index < nxt]
+        top_date = after.idxmax() if not after.empty else None
+        top_spread = (rsi_cyc.asof(top_date) - rsi_def.asof(top_date)) if top_date is not None else np.nan
+        d = ep["rs_min_date"]
+        ref = next((c for c in curated
+                    if abs((pd.Timestamp(c["rs_inizio"]) - ep["start"]).days) <= EP_MATCH_DAYS), {})
+        ind = {"vix": _macro("vix", d), "move": _macro("move", d), "rs_min": ep["rs_min"],
+               "ief_shy": ief_shy.asof(d) if not ief_shy.dropna().empty else np.nan}
+        episodi.append({
+            "id":              len(episodi) + 1,
+            "pattern":         ref.get("pattern") or _episode_pattern(ind, template.get("pattern", {})),
+            "rs_inizio":       f"{ep['start']:%Y-%m-%d}",
+            "rs_confermato":   f"{ep['confirmed']:%Y-%m-%d}",
+            "rs_fine":         f"{ep['end']:%Y-%m-%d}",
+            "rs_bottom_date":  f"{d:%Y-%m-%d}",
+            "rs_min":          ep["rs_min"],
+            "durata_gg":       ep["duration"],
+            "spy_bottom_date": f"{spy_bot:%Y-%m-%d}",
+            "spy_swing_date":  f"{swing:%Y-%m-%d}",
+            "delta_rs_spy_gg": (spy_bot - d).days,
+            "spy_perf_20":     _r2(p20),
+            "spy_perf_40":     _r2(p40),
+            "esito":           episode_esito(p20, p40),
+            "indicatori": {
+                "vix":            _r2(ind["vix"]),
+                "move":           _r2(ind["move"]),
+                "ief_shy":        _r2(ind["ief_shy"]),
+                "rsi_spy":        _r2(rsi[benchmark].asof(d)),
+                "rsi_ciclici":    _r2(rsi_cyc.asof(d)),
+                "rsi_difensivi":  _r2(rsi_def.asof(d)),
+                "spread_cic_dif": _r2(rsi_cyc.asof(d) - rsi_def.asof(d)),
+            },
+            "top_successivo": {
+                "data":          f"{top_date:%Y-%m-%d}" if top_date is not None else None,
+                "rs_valore":     _r2(after.max()) if top_date is not None else None,
+                "rsi_ciclici":   _r2(rsi_cyc.asof(top_date)) if top_date is not None else None,
+                "rsi_difensivi": _r2(rsi_def.asof(top_date)) if top_date is not None else None,
+                "spread":        _r2(top_spread),
+                "qualita":       "VERO" if top_spread > 5 else "TECNICO",
+            },
+            "note":            ref.get("note", ""),
+        })
+
+    meta = dict(template.get("metadata", {}))
+    meta["aggiornato"] = aggiornato or f"{ros.index[-1]:%Y-%m-%d}"
+    meta["note"] = (f"Dataset rigenerato dai prezzi ({ros.index[0]:%Y}-{ros.index[-1]:%Y}). "
+                    f"Soglia Risk Off {-abs(threshold):.2f}, conferma {confirm_days} giorni. "
+                    "Performance SPY calcolata da bottom SPY (non bottom RS).")
+    stats = _episode_stats(episodi)
+    regola = dict(template.get("regola_operativa", {}))
+    regola["payoff_medio_casi_positivi"] = (
+        f"{stats['spy_perf_40_media_positivi']:+.1f}% a +40gg "
+        f"({stats['episodi_positivi']} episodi su {stats['episodi_totali']})")
+    regola["nota_timing"] = stats["nota_timing"]
+    definizioni = dict(template.get("definizioni", {}))
+    definizioni.setdefault("ief_shy", "RSI 14 del rapporto IEF/SHY alla data del minimo RS")
+    return {
+        "metadata":              meta,
+        "definizioni":           definizioni,
+        "pattern":               template.get("pattern", {}),
+        "regola_qualita_top":    template.get("regola_qualita_top", {}),
+        "regola_operativa":      regola,
+        "statistiche_aggregate": stats,
+        "episodi":               episodi,
+    }
+
+
+# ========================
+# PATTERN A/B/C/D — classificatore giornaliero
+# ========================
+# Le condizioni testuali di backtest_patterns.json ("> 30", "60-130", "qualsiasi")
+# diventano maschere numpy sull'intero storico. Variabili giornaliere: VIX, MOVE,
+# ief_shy (RSI 14 di IEF/SHY, come nel dataset episodi) e rs_min = minimo ROS v2
+# delle ultime PATTERN_RS_WINDOW sedute. Condizioni non numeriche (es. "causa
+# esogena") non sono osservabili e vengono ignorate.
+PATTERN_RS_WINDOW = 21
+PATTERN_NONE      = "—"
+_COND_CMP   = re.compile(r"^([<>])\s*(-?\d+(?:\.\d+)?)$")
+_COND_RANGE = re.compile(r"^(-?\d+(?:\.\d+)?)\s*-\s*(-?\d+(?:\.\d+)?)$")
+
+
+def condition_mask(values, text):
+    """Maschera di una condizione del JSON (NaN → False); None se non numerica."""
+    v = np.asarray(values, dtype=np.float64)
+    t = str(text).strip().lower()
+    if t == "qualsiasi":
+        return np.ones(len(v), dtype=bool)
+    m = _COND_CMP.match(t)
+    if m:
+        thr = float(m.group(2))
+        return v > thr if m.group(1) == ">" else v < thr
+    m = _COND_RANGE.match(t)
+    if m:
+        return (v >= float(m.group(1))) & (v <= float(m.group(2)))
+    return None
+
+
+def pattern_features(ros, macro, window=PATTERN_RS_WINDOW):
+    """DataFrame data × (vix, move, ief_shy, rs_min) sulle date di `ros`."""
+    idx = ros.index
+
+    def _col(name):
+        if name not in macro.columns or macro[name].dropna().empty:
+            return pd.Series(np.nan, index=idx)
+        return macro[name].dropna().reindex(idx, method="ffill")
+
+    ief, shy = EP_MACRO["ief"], EP_MACRO["shy"]
+    ief_shy = (rsi_series((macro[ief] / macro[shy]).dropna()).reindex(idx, method="ffill")
+               if {ief, shy} <= set(macro.columns) else pd.Series(np.nan, index=idx))
+    return pd.DataFrame({"vix": _col(EP_MACRO["vix"]), "move": _col(EP_MACRO["move"]),
+                         "ief_shy": ief_shy, "rs_min": ros.rolling(window, min_periods=1).min()},
+                        index=idx)
+
+
+def classify_patterns(feats, patterns):
+    """
+    Pattern per ogni riga di `feats`: il primo (ordine del JSON) con tutte le
+    condizioni osservabili vere, PATTERN_NONE altrimenti.
+    """
+    label = np.full(len(feats), PATTERN_NONE, dtype=object)
+    free  = np.ones(len(feats), dtype=bool)
+    for pid, p in patterns.items():
+        m = np.ones(len(feats), dtype=bool)
+        for key, text in p.get("condizioni", {}).items():
+            mk = condition_mask(feats[key], text) if key in feats.columns else None
+            if mk is not None:
+                m &= mk
+        label[free & m] = pid
+        free &= ~m
+    return pd.Series(label, index=feats.index)
+
+
+# ========================
+# LEAD/LAG — cross-correlazione ROS → benchmark via FFT
+# ========================
+def xcorr_fft(x, y, max_lag):
+    """
+    corr(x_t, y_{t+k}) per k = -max_lag..max_lag su tutta la storia: serie
+    standardizzate, prodotti di tutte le coppie con una sola FFT, divisi per il
+    numero di coppie valide a ogni lag (NaN esclusi). k > 0 = x anticipa y.
+    """
+    x, y = x.align(y, join="inner")
+    a, b = x.to_numpy(dtype=np.float64), y.to_numpy(dtype=np.float64)
+    ma, mb = ~np.isnan(a), ~np.isnan(b)
+    a = np.where(ma, (a - np.nanmean(a)) / np.nanstd(a), 0.0)
+    b = np.where(mb, (b - np.nanmean(b)) / np.nanstd(b), 0.0)
+    n = len(a)
+    size = 1 << int(np.ceil(np.log2(2 * n - 1)))
+
+    def _cc(u, v):
+        # c[k] = Σ_t u_t v_{t+k}; indici negativi in coda (correlazione circolare con padding)
+        return np.fft.irfft(np.conj(np.fft.rfft(u, size)) * np.fft.rfft(v, size), size)
+
+    lags  = np.arange(-max_lag, max_lag + 1)
+    num   = _cc(a, b)[lags % size]
+    pairs = np.rint(_cc(ma.astype(np.float64), mb.astype(np.float64))[lags % size])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        corr = np.where(pairs > 2, num / pairs, np.nan)
+    return pd.Series(corr, index=pd.Index(lags, name="lag"))
+
+
+def rolling_xcorr(x, y, lags, window):
+    """Correlazione mobile su `window` sedute di x_t con y_{t+k} per ogni lag (data × lag)."""
+    x, y = x.align(y, join="inner")
+    out = {}
+    for k in lags:
+        out[int(k)] = x.rolling(window, min_periods=window // 2).corr(y.shift(-k))
+    return pd.DataFrame(out, index=x.index)
+
+
+# ========================
+# COSTITUENTI S&P 500 — storico con date di validità
+# ========================
+# Una riga per (ticker, settore, periodo): start/end = date di validità, end
+# vuota = ancora membro, start vuota = membro da prima dell'inizio dello storico.
+# Ogni aggiornamento chiude le righe dei ticker usciti o che cambiano settore e
+# ne apre di nuove: l'appartenenza a qualunque data resta ricostruibile.
+CONSTITUENT_COLUMNS = ["Ticker", "Sector", "start", "end"]
+
+
+def constituents_update(hist, snapshot, today):
+    """
+    Nuovo storico da storico precedente (None al primo avvio) e snapshot
+    (Ticker, Sector, Added opzionale) osservato alla data `today`.
+    Un nuovo membro parte dalla sua "Date added" se nota, altrimenti da today
+    (vuota allo snapshot iniziale); un cambio di settore parte da today.
+    """
+    today = pd.Timestamp(today).normalize()
+    seed  = hist is None or hist.empty
+    hist  = (pd.DataFrame(columns=CONSTITUENT_COLUMNS) if seed else hist[CONSTITUENT_COLUMNS].copy())
+    snap  = snapshot.drop_duplicates("Ticker").set_index("Ticker")
+    added = (pd.to_datetime(snap["Added"], errors="coerce") if "Added" in snap.columns
+             else pd.Series(pd.NaT, index=snap.index))
+
+    is_open = hist["end"].isna()
+    cur     = hist[is_open].set_index("Ticker")["Sector"]
+    gone    = [t for t in cur.index if t not in snap.index or snap.at[t, "Sector"] != cur[t]]
+    hist.loc[is_open & hist["Ticker"].isin(gone), "end"] = today
+
+    new = [t for t in snap.index if t not in cur.index or t in gone]
+    start = [today if t in cur.index                       # cambio di settore
+             else added[t] if pd.notna(added[t])
+             else (pd.NaT if seed else today)
+             for t in new]
+    rows = pd.DataFrame({"Ticker": new, "Sector": snap.loc[new, "Sector"].to_numpy(),
+                         "start": pd.to_datetime(pd.Series(start, dtype="datetime64[ns]")),
+                         "end": pd.Series(pd.NaT, index=range(len(new)), dtype="datetime64[ns]")})
+    out = pd.concat([hist, rows], ignore_index=True) if len(hist) else rows
+    out["start"] = pd.to_datetime(out["start"])
+    out["end"]   = pd.to_datetime(out["end"])
+    return out.sort_values(["Ticker", "start"], na_position="first").reset_index(drop=True)
+
+
+def constituents_at(hist, date):
+    """Membri (Ticker, Sector) alla data."""
+    date = pd.Timestamp(date)
+    ok = ((hist["start"].isna() | (hist["start"] <= date))
+          & (hist["end"].isna() | (hist["end"] > date)))
+    return hist.loc[ok, ["Ticker", "Sector"]].drop_duplicates("Ticker").reset_index(drop=True)
+
+
+def _membership_spans(hist, index, tickers):
+    """Per ogni riga dello storico: (riga di ingresso, riga di uscita esclusa, colonna, settore)."""
+    col = {t: j for j, t in enumerate(tickers)}
+    h   = hist[hist["Ticker"].isin(list(col))]
+    a   = index.searchsorted(h["start"].to_numpy())
+    b   = index.searchsorted(h["end"].to_numpy())
+    a   = np.where(h["start"].isna().to_numpy(), 0, a)
+    b   = np.where(h["end"].isna().to_numpy(), len(index), b)
+    return a, b, np.array([col[t] for t in h["Ticker"]], dtype=int), h["Sector"].to_numpy()
+
+
+def _spans_mask(a, b, j, n_rows, n_cols):
+    """+1 all'ingresso, -1 all'uscita, somma cumulata lungo le date."""
+    delta = np.zeros((n_rows + 1, n_cols), dtype=np.int32)
+    np.add.at(delta, (a, j), 1)
+    np.add.at(delta, (b, j), -1)
+    return np.cumsum(delta, axis=0)[:-1] > 0
+
+
+def membership_mask(hist, index, tickers):
+    """Maschera data × ticker: True se il ticker era membro alla data (senza survivorship bias)."""
+    a, b, j, _ = _membership_spans(hist, index, tickers)
+    return pd.DataFrame(_spans_mask(a, b, j, len(index), len(tickers)),
+                        index=index, columns=list(tickers))
+
+
+# ========================
+# BREADTH S&P 500 — serie storiche per settore e aggregato
+# ========================
+# Riduzioni su matrici data × ticker (calendario NYSE comune: offset per riga),
+# contando solo i titoli membri dell'indice alla data secondo lo storico
+# costituenti (niente survivorship bias). Lo stato tiene le ultime
+# BREADTH_WARMUP righe del pannello: aggiungere una seduta ricalcola solo quella,
+# su una finestra di 252 righe, invece dell'intero storico.
+BREADTH_WARMUP  = 252
+BREADTH_ALL     = "S&P 500"
+BREADTH_LAGS    = {"% >0 1W": 5, "% >0 1M": 21, "% >0 3M": 63}
+BREADTH_MAS     = {"% > MM50": 50, "% > MM200": 200}
+BREADTH_METRICS = list(BREADTH_LAGS) + list(BREADTH_MAS) + ["Avanzano", "Scendono",
+                                                          "Nuovi massimi", "Nuovi minimi"]
+
+
+def breadth_groups(hist, index, tickers):
+    """Gruppo (aggregato + settori) → maschera membri data × ticker (numpy bool)."""
+    a, b, j, sec = _membership_spans(hist, index, tickers)
+    groups = {BREADTH_ALL: _spans_mask(a, b, j, len(index), len(tickers))}
+    for g in sorted(pd.unique(sec[pd.notna(sec)])):
+        k = sec == g
+        groups[g] = _spans_mask(a[k], b[k], j[k], len(index), len(tickers))
+    return groups
+
+
+def _breadth_rows(c, groups, n_new):
+    """
+    Metriche per le ultime n_new righe di c (T × N, righe di warm-up in testa).
+    Statistiche mobili (NaN sotto il 90% di dati nella finestra) calcolate sulla
+    sola finestra di ogni riga: calcolo completo e incrementale coincidono.
+    """
+    t0  = len(c) - n_new
+    cur = c[t0:]
+
+    def _lag(k):
+        out = np.full_like(cur, np.nan)
+        src = np.arange(t0, len(c)) - k
+        ok  = src >= 0
+        out[ok] = c[src[ok]]
+        return out
+
+    # finestra di w righe che termina in ogni riga nuova, troncata a inizio pannello
+    P   = BREADTH_WARMUP - 1
+    pad = np.vstack([np.full((P, c.shape[1]), np.nan), c])
+
+    def _roll(w, how):
+        win = np.lib.stride_tricks.sliding_window_view(pad, w, axis=0)[t0 + P - w + 1:len(c) + P - w + 1]
+        out = np.empty(cur.shape)
+        with np.errstate(invalid="ignore"), warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            for i in range(0, n_new, 32):                       # blocchi: memoria n × N × w limitata
+                blk = win[i:i + 32]
+                v   = {"max": np.nanmax, "min": np.nanmin, "mean": np.nanmean}[how](blk, axis=-1)
+                out[i:i + 32] = np.where((~np.isnan(blk)).sum(axis=-1) >= int(w * 0.9), v, np.nan)
+        return out
+
+    prev = _lag(1)
+    hi, lo = _roll(BREADTH_WARMUP, "max"), _roll(BREADTH_WARMUP, "min")
+    cond = {}                                                   # metrica → (idonei, colpiti)
+    for name, k in BREADTH_LAGS.items():
+        ref = _lag(k)
+        cond[name] = (~np.isnan(cur) & ~np.isnan(ref), cur > ref)
+    for name, w in BREADTH_MAS.items():
+        ma = _roll(w, "mean")
+        cond[name] = (~np.isnan(cur) & ~np.isnan(ma), cur > ma)
+
+    out = {}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for g, mask in groups.items():
+            m = mask[-n_new:]
+            for name, (elig, hit) in cond.items():
+                out[(g, name)] = 100 * (hit & elig & m).sum(axis=1) / (elig & m).sum(axis=1)
+            out[(g, "Avanzano")]      = ((cur > prev) & m).sum(axis=1)
+            out[(g, "Scendono")]      = ((cur < prev) & m).sum(axis=1)
+            out[(g, "Nuovi massimi")] = ((cur >= hi) & m).sum(axis=1)
+            out[(g, "Nuovi minimi")]  = ((cur <= lo) & m).sum(axis=1)
+    return out
+
+
+def breadth_history(close, hist):
+    """Stato breadth calcolato sull'intero pannello close dei costituenti."""
+    c = close.to_numpy(dtype=np.float64, na_value=np.nan)
+    rows = _breadth_rows(c, breadth_groups(hist, close.index, list(close.columns)), len(c))
+    return {"close":  close.iloc[-BREADTH_WARMUP:],
+            "counts": pd.DataFrame(rows, index=close.index)}
+
+
+def breadth_update(state, close, hist):
+    """
+    Aggiunge le sedute di close successive all'ultima dello stato (stesse
+    colonne); l'ultima seduta viene ricalcolata (barra ancora in formazione).
+    """
+    last = state["counts"].index[-1]
+    new  = close[close.index >= last]
+    if new.empty:
+        return state
+    window = pd.concat([state["close"][state["close"].index < last], new])
+    rows   = _breadth_rows(window.to_numpy(dtype=np.float64, na_value=np.nan),
+                           breadth_groups(hist, new.index, list(close.columns)), len(new))
+    return {"close":  window.iloc[-BREADTH_WARMUP:],
+            "counts": pd.concat([state["counts"].iloc[:-1], pd.DataFrame(rows, index=new.index)])}
+
+
+def breadth_frame(state, group):
+    """Metriche di un gruppo + linea avanzate/declinanti cumulata e nuovi massimi netti."""
+    d = state["counts"][group].copy()
+    d["A/D line"]      = (d["Avanzano"] - d["Scendono"]).cumsum()
+    d["Netti massimi"] = d["Nuovi massimi"] - d["Nuovi minimi"]
+    return d
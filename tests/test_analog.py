@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+from indicators import ANALOG_FEATURES, analog_index, analog_search, analog_update
+
+
+def _feats(n=600, seed=0):
+    rng   = np.random.default_rng(seed)
+    feats = pd.DataFrame(rng.normal(size=(n, len(ANALOG_FEATURES))),
+                         index=pd.bdate_range("2020-01-01", periods=n), columns=ANALOG_FEATURES)
+    feats.iloc[:30, 0] = np.nan          # warm-up di una feature
+    feats.iloc[200, 3] = np.nan          # buco isolato
+    return feats
+
+
+def _assert_same(a, b):
+    assert a["dates"].equals(b["dates"])
+    np.testing.assert_array_equal(a["X"], b["X"])
+    np.testing.assert_array_equal(a["s1"], b["s1"])
+    np.testing.assert_array_equal(a["s2"], b["s2"])
+
+
+def test_update_equals_full_rebuild():
+    feats = _feats()
+    idx   = analog_index(feats.iloc[:400])
+    for end in (450, 451, 520, len(feats)):      # più aggiornamenti successivi
+        idx = analog_update(idx, feats.iloc[:end])
+    _assert_same(idx, analog_index(feats))
+    full = analog_index(feats)
+    for a, b in zip(analog_search(idx, k=10), analog_search(full, k=10)):
+        np.testing.assert_array_equal(a, b)
+
+
+def test_update_replaces_last_intraday_row():
+    feats    = _feats()
+    intraday = feats.iloc[:400].copy()
+    intraday.iloc[-1] += 5.0                     # barra in formazione al build precedente
+    idx = analog_update(analog_index(intraday), feats)
+    _assert_same(idx, analog_index(feats))
+
+
+def test_update_without_new_dates_is_noop():
+    feats = _feats()
+    idx   = analog_index(feats)
+    _assert_same(analog_update(idx, feats.iloc[:300]), idx)
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from indicators import (aligned_panel, ap_maxdd, ap_returns, compute_risk_off_episodes,
+                        compute_rsi, risk_off_episodes_panel, rsi_series)
+
+
+# Implementazioni per ticker con dropna() sostituite dal pannello allineato
+def _old_ret(data, days):
+    if len(data) <= days:
+        return np.nan
+    return (data.iloc[-1] / data.iloc[-days-1] - 1) * 100
+
+
+def _old_maxdd(ticker, bt_close, actual_ref, periodo_giorni=63):
+    try:
+        tk_s = bt_close[ticker].dropna()
+        end_idx   = tk_s.index.searchsorted(actual_ref)
+        start_idx = max(0, end_idx - periodo_giorni)
+        tk_win = tk_s.iloc[start_idx:end_idx]
+        if len(tk_win) < 10: return np.nan
+        rolling_max = tk_win.expanding().max()
+        drawdown = (tk_win - rolling_max) / rolling_max
+        return float(drawdown.min())
+    except: return np.nan
+
+
+def _close(n=320, seed=1):
+    rng   = np.random.default_rng(seed)
+    close = pd.DataFrame(100 * np.exp(rng.normal(0, 0.015, size=(n, 4)).cumsum(axis=0)),
+                         index=pd.bdate_range("2021-01-01", periods=n), columns=["A", "B", "C", "D"])
+    close.iloc[:40, 1] = np.nan                               # serie che parte dopo
+    close.iloc[rng.choice(n, 30, replace=False), 2] = np.nan  # buchi sparsi
+    close.iloc[150:160, 0] = np.nan                           # buco lungo
+    close["E"] = np.nan                                       # colonna tutta NaN
+    return close
+
+
+@pytest.mark.parametrize("days", [1, 5, 21, 126])
+def test_ap_returns_matches_dropna_lookup(days):
+    close = _close()
+    ap    = aligned_panel(close)
+    new   = ap_returns(ap, np.arange(len(close)), days) * 100
+    for i, d in enumerate(close.index):
+        old = [_old_ret(close.loc[:d, t].dropna(), days) for t in close.columns]
+        np.testing.assert_allclose(new[i], old, rtol=1e-12, equal_nan=True)
+
+
+@pytest.mark.parametrize("window", [63, 126])
+def test_ap_maxdd_matches_calcola_maxdd(window):
+    close = _close()
+    ap    = aligned_panel(close)
+    rows  = np.arange(0, len(close), 7)
+    new   = ap_maxdd(ap, rows, window)
+    for n, i in enumerate(rows):
+        old = [_old_maxdd(t, close, close.index[i], periodo_giorni=window) for t in close.columns]
+        np.testing.assert_allclose(new[n], old, rtol=1e-12, equal_nan=True)
+
+
+def test_rsi_series_matches_compute_rsi():
+    close = _close()
+    for t in close.columns:
+        new = rsi_series(close[t])
+        old = [compute_rsi(close.loc[:d, t]) for d in close.index]
+        np.testing.assert_allclose(new.round(2).to_numpy(), old, equal_nan=True)
+
+
+@pytest.mark.parametrize("thr", [1.5, pd.Series({"A": 1.0, "B": 2.0, "C": 1.5, "D": 0.5, "E": 1.0})])
+def test_risk_off_panel_matches_per_ticker(thr):
+    rng   = np.random.default_rng(2)
+    panel = _close().pct_change(fill_method=None).mul(100).rolling(5).sum() + rng.normal(0, 0.5, size=(320, 5))
+    panel.iloc[-10:, 3] = -5.0                                # episodio ancora aperto
+    episodes = risk_off_episodes_panel(panel, thr, confirm_days=3)
+    for t in panel.columns:
+        t_thr = thr[t] if isinstance(thr, pd.Series) else thr
+        old   = compute_risk_off_episodes(panel[t].dropna(), t_thr, confirm_days=3)
+        new   = [{k: v for k, v in ep.items() if k != "ticker"} for ep in episodes if ep["ticker"] == t]
+        assert new == old
+    assert any(ep["ticker"] == "C" for ep in episodes)